@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# Embedding backend 比較：回填吞吐量、單筆查詢延遲、以及 backend 間的向量一致性
+#
+# 文本來源預設為 bench fixtures 產生的 XBRL（經 arelle_db.parse_xbrl + pipeline.report_text，
+# 與實際 upsert 的文本格式相同）；--source db 則讀取 PostgreSQL 內所有 ticker table。
+# ollama backend 連到 OLLAMA_URL，--fake-ollama 改用 bench/fakes.py 的 stand-in（只適合冒煙測試，
+# 此時一致性數字沒有意義）。ONNX 的數字請在實際部署的 CPU 節點上量測。
+#
+#   python bench/bench_embed.py --backends ollama,onnx --batch-sizes 1,8,32 --queries 200
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+import numpy as np
+
+from stats import summarize, git_commit
+
+QUESTIONS = [
+    "What was {name}'s total revenue for the period ended {end}?",
+    "How much net income did {name} report for {end}?",
+    "What were {name}'s operating expenses in the quarter ending {end}?",
+    "Summarize {name}'s cash position as of {end}.",
+    "What diluted earnings per share did {name} report for {end}?",
+]
+
+
+def fixture_texts(n_tickers: int, n_filings: int, n_extra: int):
+    from fixtures import Corpus, build_xbrl
+    import arelle_db
+    import pipeline
+
+    corpus = Corpus(n_tickers=n_tickers, n_filings=n_filings, n_extra=n_extra)
+    texts, questions = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        for tk, name in corpus.companies:
+            for f in corpus.filings[tk]:
+                fp = os.path.join(tmp, f"{tk}.xml")
+                with open(fp, "wb") as fh:
+                    fh.write(build_xbrl(f, n_extra))
+                report = f"{tk}_{f.period_end:%Y}Q{(f.period_end.month - 1) // 3 + 1}"
+                texts.append(pipeline.report_text(report, arelle_db.parse_xbrl(fp)))
+                questions += [q.format(name=name, end=f.period_end.isoformat()) for q in QUESTIONS]
+    return texts, questions
+
+
+def db_texts():
+    import pipeline
+    texts, questions = [], []
+    for tk in pipeline.list_ticker_tables():
+        for report, text in pipeline.extract_reports(tk):
+            texts.append(text)
+            questions += [q.format(name=tk.upper(), end=report.split("_", 1)[-1]) for q in QUESTIONS]
+    return texts, questions
+
+
+def make_embedder(backend: str, batch_size: int):
+    import embedders
+    emb = embedders.BACKENDS[backend]()
+    if hasattr(emb, "max_batch"):
+        emb.max_batch = batch_size
+    else:
+        emb.batch_size = batch_size
+    return emb
+
+
+def run_backend(backend, texts, questions, batch_sizes, rounds):
+    rows, vectors = [], None
+    for bs in batch_sizes:
+        emb = make_embedder(backend, bs)
+        emb.embed(texts[:min(len(texts), bs)])           # warm-up：模型載入 / 連線建立
+        best = None
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            out = emb.embed(texts)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        vectors = out
+        rows.append({"batch_size": bs, "seconds": round(best, 4),
+                     "texts_per_s": round(len(texts) / best, 1),
+                     "chars_per_s": round(sum(len(t) for t in texts) / best, 1)})
+        print(f"[INFO] {backend:<7} batch={bs:<4} {len(texts) / best:>9.1f} texts/s")
+
+    emb = make_embedder(backend, max(batch_sizes))
+    emb.embed(questions[:1])
+    latencies, qvecs = [], []
+    for q in questions:
+        t0 = time.perf_counter()
+        qvecs.append(emb.embed([q])[0])
+        latencies.append(time.perf_counter() - t0)
+    return {"backend": backend, "dim": int(vectors.shape[1]), "backfill": rows,
+            "query_latency_ms": summarize(latencies)}, vectors, np.stack(qvecs)
+
+
+def topk(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def agreement(a, b, k):
+    (ta, qa), (tb, qb) = a, b
+    out = {"top_k_overlap": None, "k": k}
+    if ta.shape[1] == tb.shape[1]:
+        cos = np.sum(ta * tb, axis=1)
+        out["text_cosine"] = {"mean": round(float(cos.mean()), 4),
+                              "p5": round(float(np.percentile(cos, 5)), 4),
+                              "min": round(float(cos.min()), 4)}
+    # 就算維度不同，仍可比較兩邊對同一批查詢取回的文本是否一致
+    k = min(k, len(ta))
+    hits_a, hits_b = topk(ta, qa, k), topk(tb, qb, k)
+    overlap = [len(set(x) & set(y)) / k for x, y in zip(hits_a.tolist(), hits_b.tolist())]
+    out["top_k_overlap"] = round(float(np.mean(overlap)), 4)
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare embedding backends")
+    ap.add_argument("--backends", default="ollama,onnx")
+    ap.add_argument("--source", choices=["fixtures", "db"], default="fixtures")
+    ap.add_argument("--tickers", type=int, default=4)
+    ap.add_argument("--filings", type=int, default=12)
+    ap.add_argument("--extra-facts", type=int, default=40)
+    ap.add_argument("--batch-sizes", default="1,8,32")
+    ap.add_argument("--rounds", type=int, default=3, help="回填重複次數，取最佳值")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--fake-ollama", action="store_true", help="以 FakeOllama 取代真正的 Ollama")
+    ap.add_argument("--out")
+    args = ap.parse_args()
+
+    fake = None
+    if args.fake_ollama:
+        from fakes import FakeOllama
+        fake = FakeOllama().start()
+        os.environ["OLLAMA_URL"] = fake.url
+
+    if args.source == "db":
+        texts, questions = db_texts()
+    else:
+        texts, questions = fixture_texts(args.tickers, args.filings, args.extra_facts)
+    rng = np.random.default_rng(42)
+    questions = [questions[i] for i in rng.permutation(len(questions))[:args.queries]]
+    if not texts:
+        sys.exit("[ERROR] 沒有可用的文本")
+    print(f"[INFO] texts={len(texts)} avg_chars={sum(map(len, texts)) // len(texts)} "
+          f"queries={len(questions)}")
+
+    batch_sizes = [int(x) for x in args.batch_sizes.split(",") if x]
+    results, vecs = [], {}
+    try:
+        for backend in [b for b in args.backends.split(",") if b]:
+            res, tv, qv = run_backend(backend, texts, questions, batch_sizes, args.rounds)
+            results.append(res)
+            vecs[backend] = (tv, qv)
+    finally:
+        if fake:
+            fake.stop()
+
+    names = list(vecs)
+    pairs = {f"{a}~{b}": agreement(vecs[a], vecs[b], args.k)
+             for i, a in enumerate(names) for b in names[i + 1:]}
+
+    print(f"\n{'backend':<9}{'batch':>6}{'texts/s':>10}{'q p50 ms':>10}{'q p95 ms':>10}")
+    for r in results:
+        for row in r["backfill"]:
+            print(f"{r['backend']:<9}{row['batch_size']:>6}{row['texts_per_s']:>10.1f}"
+                  f"{r['query_latency_ms']['p50']:>10.2f}{r['query_latency_ms']['p95']:>10.2f}")
+    for name, a in pairs.items():
+        cos = a.get("text_cosine", {}).get("mean", "n/a")
+        print(f"[INFO] {name}: text cosine mean={cos} top-{a['k']} overlap={a['top_k_overlap']}")
+
+    report = {
+        "meta": {"commit": git_commit(),
+                 "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                 "source": "fake-ollama" if fake else args.source, "texts": len(texts),
+                 "queries": len(questions), "cpu_count": os.cpu_count(),
+                 "embed_threads": os.getenv("EMBED_THREADS", "0")},
+        "backends": results,
+        "agreement": pairs,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results",
+                                   f"embed-{report['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+    print(f"\n[BENCH] 結果已寫入 {out}")
+
+
+if __name__ == "__main__":
+    main()
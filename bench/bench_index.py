@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# 各 index profile 的 recall / 延遲 / 記憶體比較
+#
+# 向量來源預設為 QDRANT_URL 上既有的財報 collection（即實際 embedding），
+# 亦可用 --source npy:vectors.npy 或 --source synthetic:20000（只適合冒煙測試）。
+# 需連到真正的 Qdrant server：local mode 不支援量化與 HNSW 參數。
+# 記憶體以建立 collection 前後（查詢完、頁面已載入）的實測差值為準：Qdrant /metrics 的
+# memory_resident_bytes（allocator 統計，不含 mmap），給 --qdrant-pid 時另讀該 process 的 VmRSS
+# （含已載入的 mmap 頁面，server 在本機時較準確）；estimate_ram 的估算值另列一欄供對照。
+#
+#   python bench/bench_index.py --profiles default,int8,binary --ef 64,128,256 --k 10
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+import numpy as np
+import requests
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from index_profiles import INDEX_PROFILES, get_profile, collection_kwargs, estimate_ram
+from summary_index import SUMMARY_COLLECTION
+from stats import summarize, git_commit
+
+
+# 只取財報 collection 的 chunk 向量：bench 自己的 _* collection 與摘要層不算
+def load_from_qdrant(client: QdrantClient, limit: int) -> np.ndarray:
+    vecs = []
+    for col in client.get_collections().collections:
+        if col.name.startswith("_") or col.name == SUMMARY_COLLECTION:
+            continue
+        offset = None
+        while True:
+            points, offset = client.scroll(col.name, limit=256, offset=offset,
+                                           with_vectors=True, with_payload=False)
+            vecs.extend(p.vector for p in points)
+            if offset is None or len(vecs) >= limit:
+                break
+        if len(vecs) >= limit:
+            break
+    return np.asarray(vecs[:limit], dtype=np.float32)
+
+
+def load_vectors(source: str, client: QdrantClient, limit: int) -> np.ndarray:
+    if source == "qdrant":
+        return load_from_qdrant(client, limit)
+    kind, _, arg = source.partition(":")
+    if kind == "npy":
+        return np.load(arg).astype(np.float32)[:limit]
+    if kind == "synthetic":
+        # 以群聚的高斯向量近似 embedding 分佈
+        rng = np.random.default_rng(0)
+        n = int(arg or 20000)
+        centers = rng.normal(size=(max(n // 50, 1), 768)).astype(np.float32)
+        labels = rng.integers(0, len(centers), size=n)
+        return centers[labels] + 0.35 * rng.normal(size=(n, 768)).astype(np.float32)
+    raise ValueError(f"未知的 --source: {source}")
+
+
+def exact_topk(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    out = []
+    for i in range(0, len(queries), 256):
+        sims = queries[i:i + 256] @ corpus.T
+        idx = np.argpartition(-sims, k, axis=1)[:, :k]
+        order = np.take_along_axis(sims, idx, axis=1).argsort(axis=1)[:, ::-1]
+        out.append(np.take_along_axis(idx, order, axis=1))
+    return np.vstack(out)
+
+
+# Qdrant server 目前的記憶體用量（bytes）；取不到的項目省略
+def measure_memory(url: str, pid: int = None) -> dict:
+    out = {}
+    try:
+        resp = requests.get(f"{url}/metrics", timeout=10)
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            name, _, value = line.partition(" ")
+            if name in ("memory_resident_bytes", "memory_allocated_bytes"):
+                out[name[len("memory_"):-len("_bytes")]] = int(float(value))
+    except (requests.RequestException, ValueError) as e:
+        print(f"[WARN] 無法讀取 {url}/metrics：{e}")
+    if pid:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    out["rss"] = int(line.split()[1]) * 1024
+    return out
+
+
+def memory_delta(before: dict, after: dict) -> dict:
+    delta = {k: after[k] - before[k] for k in after if k in before}
+    # 主要數字：有 VmRSS 用 VmRSS，否則用 allocator resident
+    delta["total"] = delta.get("rss", delta.get("resident"))
+    return delta
+
+
+def wait_indexed(client, name, timeout=600):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        info = client.get_collection(name)
+        if info.status == models.CollectionStatus.GREEN:
+            return info
+        time.sleep(0.5)
+    return client.get_collection(name)
+
+
+def run_profile(client, name, corpus, queries, truth, k, efs, keep, url, pid):
+    profile = get_profile(name)
+    col = f"_bench_index_{name}"
+    if client.collection_exists(col):
+        client.delete_collection(col)
+    before = measure_memory(url, pid)
+    client.create_collection(col, **collection_kwargs(corpus.shape[1], profile))
+    t0 = time.perf_counter()
+    client.upload_collection(col, vectors=corpus, ids=list(range(len(corpus))), batch_size=256)
+    info = wait_indexed(client, col)
+    build_s = time.perf_counter() - t0
+
+    rows = []
+    for ef in efs:
+        quant = None
+        if profile.get("quantization"):
+            quant = models.QuantizationSearchParams(
+                ignore=False, rescore=True, oversampling=profile.get("oversampling", 2.0))
+        params = models.SearchParams(hnsw_ef=ef, quantization=quant)
+        latencies, recalls = [], []
+        for q, expected in zip(queries, truth):
+            t = time.perf_counter()
+            hits = client.search(col, query_vector=q.tolist(), limit=k, search_params=params)
+            latencies.append(time.perf_counter() - t)
+            recalls.append(len({h.id for h in hits} & set(expected.tolist())) / k)
+        rows.append({"ef": ef, "recall_at_k": round(float(np.mean(recalls)), 4),
+                     "latency_ms": summarize(latencies)})
+    ram = memory_delta(before, measure_memory(url, pid))
+    if not keep:
+        client.delete_collection(col)
+    return {
+        "profile": profile,
+        "build_s": round(build_s, 3),
+        "indexed_vectors": info.indexed_vectors_count,
+        "ram_measured_bytes": ram,
+        "ram_estimate_bytes": estimate_ram(len(corpus), corpus.shape[1], profile),
+        "search": rows,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Recall / latency / memory per Qdrant index profile")
+    ap.add_argument("--qdrant-url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    ap.add_argument("--source", default="qdrant", help="qdrant | npy:<path> | synthetic:<n>")
+    ap.add_argument("--limit", type=int, default=200_000, help="最多使用的向量數")
+    ap.add_argument("--queries", type=int, default=200, help="保留作為查詢的向量數")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--profiles", default=",".join(INDEX_PROFILES))
+    ap.add_argument("--ef", default="64,128,256")
+    ap.add_argument("--keep", action="store_true", help="保留 _bench_index_* collection")
+    ap.add_argument("--qdrant-pid", type=int, help="Qdrant server 的 pid（本機時另量 VmRSS）")
+    ap.add_argument("--out")
+    args = ap.parse_args()
+
+    client = QdrantClient(url=args.qdrant_url, prefer_grpc=False, timeout=120)
+    vectors = load_vectors(args.source, client, args.limit + args.queries)
+    if len(vectors) <= args.queries + args.k:
+        sys.exit(f"[ERROR] 向量數不足：{len(vectors)}")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    rng = np.random.default_rng(42)
+    rng.shuffle(vectors)
+    queries, corpus = vectors[:args.queries], vectors[args.queries:]
+    truth = exact_topk(corpus, queries, args.k)
+    print(f"[INFO] corpus={len(corpus)} dim={corpus.shape[1]} queries={len(queries)} k={args.k}")
+
+    efs = [int(x) for x in args.ef.split(",") if x]
+    results = [run_profile(client, p, corpus, queries, truth, args.k, efs, args.keep,
+                           args.qdrant_url, args.qdrant_pid)
+               for p in args.profiles.split(",") if p]
+
+    # RAM MB / RAM % 為實測差值，est MB 為 estimate_ram 的估算
+    base_ram = results[0]["ram_measured_bytes"]["total"]
+    print(f"\n{'profile':<10}{'ef':>6}{'recall@k':>10}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'RAM MB':>10}{'RAM %':>8}{'est MB':>10}")
+    for r in results:
+        ram, est = r["ram_measured_bytes"]["total"], r["ram_estimate_bytes"]["total"]
+        ram_mb = f"{ram / 2**20:>10.1f}" if ram is not None else f"{'-':>10}"
+        ram_pct = f"{ram / base_ram * 100:>7.0f}%" if ram is not None and base_ram else f"{'-':>8}"
+        for row in r["search"]:
+            print(f"{r['profile']['name']:<10}{row['ef']:>6}{row['recall_at_k']:>10.4f}"
+                  f"{row['latency_ms']['p50']:>9.2f}{row['latency_ms']['p95']:>9.2f}"
+                  f"{ram_mb}{ram_pct}{est / 2**20:>10.1f}")
+
+    report = {
+        "meta": {"commit": git_commit(),
+                 "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                 "source": args.source, "corpus": len(corpus), "dim": int(corpus.shape[1]),
+                 "queries": len(queries), "k": args.k},
+        "profiles": results,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results",
+                                   f"index-{report['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+    print(f"\n[BENCH] 結果已寫入 {out}")
+
+
+if __name__ == "__main__":
+    main()
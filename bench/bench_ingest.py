@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# ingest daemon：既有檔案的補處理吞吐量，以及新檔落地到可查詢（寫入 Qdrant）的延遲
+#
+# 假 Ollama + Qdrant local mode + 本機 PostgreSQL。前 --backlog 份財報先放進資料夾，以 --once 補處理；
+# 其餘財報平分給 inotify 與輪詢兩種監看方式，daemon 執行中每隔 --interval 秒丟入一份（先寫暫存檔再 rename，
+# 與一般下載工具相同），量測每份報告從檔案出現到 point 寫入 Qdrant 的時間。
+# 最後保留同一 ticker 的兩份財報連續丟入（burst），檢查同一 ticker 的兩輪 chunk 不會交錯寫入，
+# 結束時整批重新規劃應沒有待 embed 的 chunk（Qdrant 內容與 DB 一致）。
+#
+#   python bench/bench_ingest.py --tickers 4 --filings 12 --backlog 24 --interval 0.2
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+from fixtures import Corpus, build_xbrl
+from fakes import FakeOllama
+from local_pg import LocalPostgres
+from stats import summarize, git_commit
+
+
+def filing_files(corpus: Corpus) -> list[tuple[str, bytes]]:
+    from edgar_client import get_quarter
+    files = []
+    for tk, _ in corpus.companies:
+        for f in corpus.filings[tk]:
+            name = f"{tk}_{get_quarter(f.filing_date.isoformat())}" + ("&Annual" if f.form == "10-K" else "")
+            files.append((f"{name}.xml", build_xbrl(f, corpus.n_extra)))
+    # 依申報日交錯各公司，模擬實際下載順序
+    return sorted(files, key=lambda x: (x[0].split("_", 1)[1], x[0]))
+
+
+def drop(watch_dir: str, name: str, data: bytes):
+    tmp = os.path.join(watch_dir, f".{name}.part")
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, os.path.join(watch_dir, name))
+
+
+def run_watch(mode: str, watch_dir: str, files, interval: float, quiet: bool, timeout: float,
+              label: str = None) -> dict:
+    import ingest_daemon
+    daemon = ingest_daemon.IngestDaemon(watch_dir, mode)
+    stop = threading.Event()
+    sink = io.StringIO()
+
+    def target():
+        with contextlib.ExitStack() as stack:
+            if quiet:
+                stack.enter_context(contextlib.redirect_stdout(sink))
+            daemon.run(stop_event=stop)
+
+    t = threading.Thread(target=target)
+    t.start()
+    time.sleep(0.5)
+    t0 = time.perf_counter()
+    for name, data in files:
+        drop(watch_dir, name, data)
+        time.sleep(interval)
+    deadline = time.monotonic() + timeout
+    while len(daemon.latencies) < len(files) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    t.join()
+    res = {"mode": mode, "label": label or mode, "files": len(files), "indexed": len(daemon.latencies),
+           "seconds": round(elapsed, 3), "latency_ms": summarize(daemon.latencies), "stats": daemon.stats}
+    lat = res["latency_ms"]
+    print(f"[INFO] {res['label']:<8} {res['indexed']}/{len(files)} 份可查詢  "
+          f"p50={lat['p50']:.1f} p95={lat['p95']:.1f} max={lat['max']:.1f} ms")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the watch-folder ingest daemon")
+    ap.add_argument("--tickers", type=int, default=4)
+    ap.add_argument("--filings", type=int, default=12, help="每支股票的財報數")
+    ap.add_argument("--extra-facts", type=int, default=40)
+    ap.add_argument("--backlog", type=int, default=24, help="daemon 啟動前就已存在的財報數")
+    ap.add_argument("--interval", type=float, default=0.2, help="監看階段丟入新檔的間隔秒數")
+    ap.add_argument("--poll-interval", type=float, default=0.5, help="輪詢模式的掃描間隔秒數")
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="假 Ollama 每個請求的延遲秒數")
+    ap.add_argument("--timeout", type=float, default=60.0)
+    ap.add_argument("--out")
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+
+    corpus = Corpus(n_tickers=args.tickers, n_filings=args.filings, n_extra=args.extra_facts)
+    files = filing_files(corpus)
+    backlog, rest = files[:args.backlog], files[args.backlog:]
+    # 同一 ticker 最新的兩份財報留到最後連續丟入
+    burst_ticker = rest[-1][0].split("_", 1)[0]
+    burst = [f for f in rest if f[0].split("_", 1)[0] == burst_ticker][-2:]
+    rest = [f for f in rest if f not in burst]
+    tmp = tempfile.mkdtemp(prefix="ingest-")
+    watch_dir = os.path.join(tmp, "xbrl_downloads")
+    os.makedirs(watch_dir)
+
+    ollama = FakeOllama(latency=args.embed_latency).start()
+    pg = LocalPostgres()
+    db = pg.start()
+    pg.reset()
+    # 被測模組於 import 時讀取環境變數，必須在 import 之前設定
+    os.environ.update({
+        "XBRL_DIR": watch_dir,
+        "DB_HOST": db["host"], "DB_PORT": db["port"], "DB_NAME": db["dbname"],
+        "DB_USER": db["user"], "DB_PASSWORD": db["password"],
+        "OLLAMA_URL": ollama.url, "OLLAMA_EMBED_API_URL": ollama.url + "/api/embeddings",
+        "INGEST_POLL_INTERVAL": str(args.poll_interval),
+    })
+
+    from qdrant_client import QdrantClient
+    import pipeline
+    import ingest_daemon
+    client = QdrantClient(path=os.path.join(tmp, "qdrant"))
+    pipeline.qdrant = client
+
+    results = {}
+    try:
+        for name, data in backlog:
+            drop(watch_dir, name, data)
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+            stats = ingest_daemon.IngestDaemon(watch_dir).run(once=True)
+        elapsed = time.perf_counter() - t0
+        results["backlog"] = {"files": len(backlog), "seconds": round(elapsed, 3),
+                              "reports_per_s": round(stats["reports"] / elapsed, 2) if elapsed else 0.0,
+                              "stats": stats}
+        print(f"[INFO] backlog  {stats['reports']} 份，{elapsed:.2f}s（{results['backlog']['reports_per_s']} 份/s）")
+        half = len(rest) // 2
+        results["inotify"] = run_watch("inotify", watch_dir, rest[:half], args.interval,
+                                       not args.verbose, args.timeout)
+        results["poll"] = run_watch("poll", watch_dir, rest[half:], args.interval,
+                                    not args.verbose, args.timeout)
+        results["burst"] = run_watch("auto", watch_dir, burst, 0.0, not args.verbose, args.timeout,
+                                     label="burst")
+        points = sum(client.count(c.name).count for c in client.get_collections().collections)
+        # 一致性：daemon 寫入的內容應與整批 upsert 相同，重新規劃時不該有需要 embed 的 chunk
+        with contextlib.redirect_stdout(io.StringIO()):
+            plans = [pipeline.plan_report(tk, report, text, pipeline.report_metrics(tk).get(report))
+                     for tk in pipeline.list_ticker_tables() for report, text in pipeline.extract_reports(tk)]
+            stale = sum(len(p["todo"]) + p["stale"] for p in plans)
+        print(f"[INFO] {points} points，整批重新規劃後待 embed / 待刪除的 point：{stale}")
+    finally:
+        client.close()
+        ollama.stop()
+        pg.stop()
+
+    report = {
+        "meta": {"commit": git_commit(),
+                 "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                 "config": {k: v for k, v in vars(args).items() if k not in ("out", "verbose")},
+                 "points": points, "stale_chunks": stale, "ollama_calls": ollama.calls},
+        "results": results,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results",
+                                   f"ingest-{report['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+    print(f"\n[BENCH] 結果已寫入 {out}")
+
+
+if __name__ == "__main__":
+    main()
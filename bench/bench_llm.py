@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# LLM client 策略比較：單一 model、只 fallback、固定延遲 hedge、p95 hedge
+#
+# 全部打在 bench/fakes.py 的 FakeChat 上：主要 model 有長尾延遲（指數分佈 jitter）與隨機 429，
+# 備援 model 延遲較穩定。每個策略使用新的 LLMClient（breaker / 延遲統計互不影響），
+# 以多個 thread 並行呼叫 complete()，量測端到端延遲、錯誤率、hedge 次數與 breaker 狀態。
+# 另以 acomplete() 檢查 half-open 試探請求輸掉 hedge 被取消後，breaker 仍能恢復（不會卡在 half-open），
+# 並檢查由備援 model 回答時 llm_cache 不會以主要 model 的 key 寫入快取。
+#
+#   python bench/bench_llm.py --requests 200 --primary-delay 0.05 --primary-jitter 0.1
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+from stats import summarize, git_commit
+from fakes import FakeChat
+
+PRIMARY = "primary/model"
+SECONDARY = "secondary/model"
+
+
+def run_strategy(url: str, name: str, models: list[str], hedge: str, args) -> dict:
+    import llm_client
+    client = llm_client.LLMClient(url, models=models, timeout=args.timeout, hedge_delay=hedge,
+                                  hedge_min_delay=args.hedge_min_delay,
+                                  breaker_failures=args.breaker_failures,
+                                  breaker_cooldown=args.breaker_cooldown)
+    data = {"model": models[0], "messages": [{"role": "user", "content": "What was revenue?"}]}
+    samples, errors = [], 0
+
+    def one(_):
+        t0 = time.perf_counter()
+        try:
+            client.complete({}, data)
+            return time.perf_counter() - t0, None
+        except llm_client.LLMError as e:
+            return time.perf_counter() - t0, e
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for seconds, err in pool.map(one, range(args.requests)):
+            if err is None:
+                samples.append(seconds)
+            else:
+                errors += 1
+    stats = client.stats()
+    res = {"strategy": name, "models": models, "hedge_delay": hedge,
+           "latency_ms": summarize(samples), "errors": errors,
+           "error_rate": round(errors / args.requests, 4), "hedged": stats["hedged"],
+           "per_model": stats["models"]}
+    lat = res["latency_ms"]
+    print(f"[INFO] {name:<10} p50={lat['p50']:>8.1f} p95={lat['p95']:>8.1f} p99={lat['p99']:>8.1f} ms "
+          f"errors={errors} hedged={stats['hedged']}")
+    return res
+
+
+# half-open 的試探請求輸掉 hedge 被取消後，model 恢復正常時 breaker 應回到 closed
+def check_probe_cancel(chat: FakeChat, url: str) -> dict:
+    import aiohttp
+    import llm_client
+    a, b = "probe/a", "probe/b"
+    client = llm_client.LLMClient(url, models=[a, b], hedge_delay="0.05",
+                                  breaker_failures=1, breaker_cooldown=0.1)
+    data = {"model": a, "messages": [{"role": "user", "content": "What was revenue?"}]}
+
+    async def run():
+        async with aiohttp.ClientSession() as http:
+            chat.set_model(a, status=500)
+            await client.acomplete(http, {}, data)            # a 失敗 → breaker 打開
+            await asyncio.sleep(0.15)
+            chat.set_model(a, delay=0.3)
+            await client.acomplete(http, {}, data)            # a 為試探請求，輸給 b 後被取消
+            await asyncio.sleep(0.15)
+            chat.set_model(a)
+            return await client.acomplete(http, {}, data)     # a 已恢復
+
+    answer = asyncio.run(run())
+    state = client.model_state(a).stats()
+    ok = state["state"] == "closed" and answer.startswith(f"[{a}]")
+    print(f"[CHECK] 試探請求被取消後 breaker={state['state']} rejected={state['rejected']} "
+          f"{'OK' if ok else 'FAIL'}")
+
+    # breaker 打開前送出的請求被取消時，不會釋放目前試探請求的名額
+    ms = llm_client.ModelState("probe/c", failures=1, cooldown=0.0)
+    earlier = ms.allow()
+    ms.failure()
+    probe = ms.allow()
+    ms.release(earlier)
+    while_probing = ms.allow()
+    ms.release(probe)
+    after_release = ms.allow()
+    token_ok = probe is not None and while_probing is None and after_release is not None
+    print(f"[CHECK] 非試探請求取消不影響試探名額 {'OK' if token_ok else 'FAIL'}")
+    if not (ok and token_ok):
+        raise SystemExit(1)
+    return dict(state, probe_token_ok=token_ok)
+
+
+# 主要 model 失敗、由備援 model 回答時不寫入快取；主要 model 恢復後的回答才會被快取（同步與 async 各一次）
+def check_fallback_cache(chat: FakeChat, url: str) -> dict:
+    import aiohttp
+    import llm_cache
+    import llm_client
+    a, b = "cache/a", "cache/b"
+    client = llm_client.LLMClient(url, models=[a, b], hedge_delay="off", breaker_failures=100)
+    data = {"model": a, "messages": [{"role": "user", "content": "What was revenue?"}]}
+    res = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = llm_cache.LLMCache(os.path.join(tmp, "llm_cache.sqlite"))
+
+        def sync_call(key):
+            return cache.get_or_call(key, lambda: client.complete({}, data, with_model=True), model=a)
+
+        async def async_call(key):
+            async with aiohttp.ClientSession() as http:
+                return await cache.aget_or_call(
+                    key, lambda: client.acomplete(http, {}, data, with_model=True), model=a)
+
+        for mode, call in (("sync", sync_call), ("async", lambda k: asyncio.run(async_call(k)))):
+            key = f"fallback-{mode}"
+            chat.set_model(a, status=500)
+            fallback = call(key)
+            after_fallback = cache.get(key)
+            chat.set_model(a)
+            primary = call(key)
+            res[mode] = {"fallback_answer": fallback, "cached_after_fallback": after_fallback,
+                         "cached_after_primary": cache.get(key)}
+            ok = (fallback.startswith(f"[{b}]") and after_fallback is None
+                  and primary.startswith(f"[{a}]") and cache.get(key) == primary)
+            print(f"[CHECK] {mode:<5} 備援回答不快取、主要 model 回答才快取 {'OK' if ok else 'FAIL'}")
+            if not ok:
+                raise SystemExit(1)
+        res["stats"] = cache.info()
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare LLM client fallback / hedging strategies")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--primary-delay", type=float, default=0.05)
+    ap.add_argument("--primary-jitter", type=float, default=0.1, help="指數分佈長尾的平均秒數")
+    ap.add_argument("--primary-fail-rate", type=float, default=0.1, help="隨機回 429 的比例")
+    ap.add_argument("--secondary-delay", type=float, default=0.08)
+    ap.add_argument("--secondary-jitter", type=float, default=0.01)
+    ap.add_argument("--hedge-delay", default="0.15", help="固定 hedge 延遲（秒）")
+    ap.add_argument("--hedge-min-delay", type=float, default=0.05, help="p95 hedge 的延遲下限（秒）")
+    ap.add_argument("--timeout", type=float, default=5.0)
+    ap.add_argument("--breaker-failures", type=int, default=5)
+    ap.add_argument("--breaker-cooldown", type=float, default=2.0)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+
+    chat = FakeChat().start()
+    chat.set_model(PRIMARY, delay=args.primary_delay, jitter=args.primary_jitter,
+                   fail_rate=args.primary_fail_rate)
+    chat.set_model(SECONDARY, delay=args.secondary_delay, jitter=args.secondary_jitter)
+    url = f"{chat.url}/api/v1/chat/completions"
+    try:
+        results = [
+            run_strategy(url, "single", [PRIMARY], "off", args),
+            run_strategy(url, "fallback", [PRIMARY, SECONDARY], "off", args),
+            run_strategy(url, "hedge", [PRIMARY, SECONDARY], args.hedge_delay, args),
+            run_strategy(url, "hedge-p95", [PRIMARY, SECONDARY], "p95", args),
+        ]
+        probe_check = check_probe_cancel(chat, url)
+        cache_check = check_fallback_cache(chat, url)
+    finally:
+        chat.stop()
+
+    report = {
+        "meta": {"commit": git_commit(),
+                 "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                 "requests": args.requests, "concurrency": args.concurrency,
+                 "upstream_calls": dict(chat.calls),
+                 "primary": {"delay": args.primary_delay, "jitter": args.primary_jitter,
+                             "fail_rate": args.primary_fail_rate},
+                 "secondary": {"delay": args.secondary_delay, "jitter": args.secondary_jitter}},
+        "strategies": results,
+        "probe_cancel": probe_check,
+        "fallback_cache": cache_check,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results",
+                                   f"llm-{report['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+    print(f"\n[BENCH] 結果已寫入 {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# 比較兩份 benchmark 結果：python bench/compare.py base.json head.json [--threshold 0.1]
+# 任一 stage 的吞吐量下降或 p95 延遲上升超過門檻時以 exit code 1 結束
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare two benchmark result files")
+    ap.add_argument("base")
+    ap.add_argument("head")
+    ap.add_argument("--threshold", type=float, default=0.10, help="容許的相對退步比例")
+    args = ap.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    print(f"base={base['meta']['commit']}  head={head['meta']['commit']}\n")
+    print(f"{'stage':<14}{'base/s':>10}{'head/s':>10}{'Δ%':>8}{'base p95':>10}{'head p95':>10}{'Δ%':>8}")
+    regressed = []
+    for name, h in head["stages"].items():
+        b = base["stages"].get(name)
+        if not b:
+            continue
+        bt, ht = b["throughput_per_s"], h["throughput_per_s"]
+        bp, hp = b["latency_ms"]["p95"], h["latency_ms"]["p95"]
+        dt = (ht - bt) / bt if bt else 0.0
+        dp = (hp - bp) / bp if bp else 0.0
+        flag = ""
+        if dt < -args.threshold or dp > args.threshold:
+            regressed.append(name)
+            flag = "  <-- regression"
+        print(f"{name:<14}{bt:>10.2f}{ht:>10.2f}{dt * 100:>7.1f}%{bp:>10.2f}{hp:>10.2f}{dp * 100:>7.1f}%{flag}")
+    if regressed:
+        print(f"\n[REGRESSION] {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
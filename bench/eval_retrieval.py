@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# 檢索品質 vs 延遲評估：以已知 fact 產生有標準答案的問題集，比較不同檢索設定的 recall / MRR / 延遲 / prompt 大小
+#
+# 資料與 run_bench 相同：假 EDGAR → edgar_fetcher 下載 → arelle_db 載入本機 PostgreSQL（含衍生指標），
+# 每個 chunk 大小（CHUNK_MAX_CHARS）各自 upsert 到一個 Qdrant in-memory client，embedding 用假 Ollama。
+# 問題由 fixtures 的已知數值產生：(ticker, concept, 期末日) → 預期數值；某個 chunk 內有
+# "<concept> [...]: <預期數值>" 這一行即視為相關。對 grid 中每組 (chunk 大小, per_collection_k,
+# max_chunks, 查詢模式) 跑完全部問題，量測：
+#   recall   實際送進 prompt 的 chunk 中有相關 chunk 的比例（candidates 為截斷到 max_chunks 之前）
+#   mrr      相關 chunk 在 prompt 中的名次倒數平均（沒有則為 0）
+#   延遲     embed + 路由 + 搜尋（retrieve_ms）與含 LLM 呼叫的端到端（e2e_ms，LLM 為假 chat，快取關閉）
+#   tokens   prompt（PROMPT_TEMPLATE 套入 context 與問題）的 token 估計（字元數 / 4）
+# 假 embedder 是 token hash，語意能力有限；數字用來比較設定間的相對取捨，換成真實 backend 請加 --embedder env。
+#
+# --summaries 另外建立摘要層（summary_index），以不指名公司 / 期間的寬問題比較逐 collection 搜尋（flat）
+# 與兩層檢索（summary）：搜尋的 collection 數、prompt tokens、檢索延遲，以及 context 涵蓋的公司比例。
+#
+#   python bench/eval_retrieval.py --chunk-chars 0,1500,600 --k 1,2,4 --max-chunks 4,8 --questions 120
+#   python bench/eval_retrieval.py --chunk-chars 0 --k 2 --max-chunks 8 --summaries
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+from fixtures import Corpus, DURATION_CONCEPTS, INSTANT_CONCEPTS, concept_value
+from fakes import FakeEdgar, FakeOllama, FakeChat
+from local_pg import LocalPostgres
+from run_bench import quiet
+from stats import percentile, summarize, git_commit
+
+CONCEPT_LABELS = {
+    "Revenues": "total revenue",
+    "CostOfRevenue": "cost of revenue",
+    "GrossProfit": "gross profit",
+    "OperatingExpenses": "operating expenses",
+    "OperatingIncomeLoss": "operating income",
+    "NetIncomeLoss": "net income",
+    "NetCashProvidedByUsedInOperatingActivities": "operating cash flow",
+    "AssetsCurrent": "current assets",
+    "LiabilitiesCurrent": "current liabilities",
+    "Assets": "total assets",
+    "Liabilities": "total liabilities",
+    "StockholdersEquity": "stockholders' equity",
+    "CashAndCashEquivalentsAtCarryingValue": "cash and cash equivalents",
+}
+TEMPLATES = [
+    "What was {name}'s {label} ({concept}) for the period ended {end}?",
+    "How much {label} ({concept}) did {name} report as of {end}?",
+]
+WIDE_QUESTIONS = [
+    "Which company had the highest revenue growth year over year?",
+    "Compare net margins across all companies.",
+    "Which companies reported declining net income?",
+    "Rank the companies by operating margin in the most recent quarter.",
+    "Summarize revenue trends across the portfolio.",
+    "Which company has the strongest balance sheet in terms of current ratio and cash?",
+]
+
+
+# 已知 fact → 有標準答案的問題（查詢模式由 grid 決定，不寫在題目裡）
+def labeled_questions(corpus: Corpus, n: int, seed: int = 0) -> list[dict]:
+    concepts = DURATION_CONCEPTS + INSTANT_CONCEPTS
+    pool = [(tk, name, f, concept, ratio) for tk, name in corpus.companies
+            for f in corpus.filings[tk] for concept, ratio in concepts]
+    rng = random.Random(seed)
+    items = []
+    for i, (tk, name, f, concept, ratio) in enumerate(rng.sample(pool, min(n, len(pool)))):
+        end = f.period_end.isoformat()
+        items.append({
+            "id": i, "ticker": tk, "concept": concept, "period_end": end,
+            "expected": str(concept_value(tk, concept, ratio, f.period_end)),
+            "question": TEMPLATES[i % len(TEMPLATES)].format(
+                name=name, label=CONCEPT_LABELS[concept], concept=concept, end=end),
+        })
+    return items
+
+
+def read_questions(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def is_relevant(text: str, concept: str, expected: str) -> bool:
+    for line in text.split("\n"):
+        tag, _, rest = line.partition(": ")
+        if tag.split(" [", 1)[0] == concept and rest.split(" ", 1)[0] == expected:
+            return True
+    return False
+
+
+def first_rank(chunks: list[str], item: dict) -> int:
+    for rank, text in enumerate(chunks, 1):
+        if is_relevant(text, item["concept"], item["expected"]):
+            return rank
+    return 0
+
+
+def approx_tokens(text: str) -> int:
+    return math.ceil(len(text) / 4)
+
+
+def count_stats(vals: list[int]) -> dict:
+    vals = sorted(vals)
+    return {"mean": round(sum(vals) / len(vals), 1) if vals else 0.0,
+            "p50": round(percentile(vals, 0.50), 1), "p95": round(percentile(vals, 0.95), 1),
+            "max": vals[-1] if vals else 0}
+
+
+def load_corpus(corpus: Corpus, csv_path: str, verbose: bool):
+    import edgar_fetcher
+    import arelle_db
+    with quiet(not verbose):
+        edgar_fetcher.process_csv(csv_path)
+        arelle_db.main(csv_path)
+
+
+def index_corpus(chunk_chars: int, verbose: bool) -> dict:
+    # 每個 chunk 大小使用獨立的 in-memory Qdrant，避免不同切法的 point 混在一起
+    from qdrant_client import QdrantClient
+    import pipeline
+    import rag_en
+    client = QdrantClient(location=":memory:")
+    pipeline.qdrant = rag_en.qdrant = client
+    pipeline.CHUNK_MAX_CHARS = chunk_chars
+    t0 = time.perf_counter()
+    with quiet(not verbose):
+        for tk in pipeline.list_ticker_tables():
+            pipeline.upsert_chunks(tk, reset=True)
+    elapsed = time.perf_counter() - t0
+    collections = rag_en.get_all_collections()
+    points = sum(client.count(c).count for c in collections)
+    return {"chunk_chars": chunk_chars, "collections": len(collections), "points": points,
+            "seconds": round(elapsed, 3)}
+
+
+def evaluate(items: list[dict], mode: str, k: int, max_chunks: int, collections: list[str]) -> dict:
+    import rag_en
+    ranks, cand_hits, tokens, retrieve_s, e2e_s, chunk_counts = [], 0, [], [], [], []
+    for item in items:
+        item_mode = f"company:{item['ticker'].lower()}" if mode == "company" else mode
+        t0 = time.perf_counter()
+        query_emb = rag_en.embed_query(item["question"])
+        payloads = []
+        for col in rag_en.resolve_collections(item_mode, item["question"], collections):
+            payloads.extend(rag_en.search_hits(col, query_emb, top_k=k))
+        chunks = rag_en.select_chunks(payloads, max_chunks)
+        context = "\n---\n".join(chunks)
+        t1 = time.perf_counter()
+        rag_en.ask_llm(context, item["question"])
+        t2 = time.perf_counter()
+        ranks.append(first_rank(chunks, item))
+        cand_hits += any(is_relevant(p["text"], item["concept"], item["expected"]) for p in payloads)
+        tokens.append(approx_tokens(rag_en.PROMPT_TEMPLATE.format(context=context, question=item["question"])))
+        retrieve_s.append(t1 - t0)
+        e2e_s.append(t2 - t0)
+        chunk_counts.append(len(chunks))
+    n = len(items)
+    return {
+        "mode": mode, "k": k, "max_chunks": max_chunks, "questions": n,
+        "recall": round(sum(1 for r in ranks if r) / n, 4),
+        "hit_at_1": round(sum(1 for r in ranks if r == 1) / n, 4),
+        "mrr": round(sum(1 / r for r in ranks if r) / n, 4),
+        "candidate_recall": round(cand_hits / n, 4),
+        "chunks_avg": round(sum(chunk_counts) / n, 2),
+        "prompt_tokens": count_stats(tokens),
+        "retrieve_ms": summarize(retrieve_s),
+        "e2e_ms": summarize(e2e_s),
+    }
+
+
+def build_summaries(verbose: bool) -> dict:
+    import summary_index
+    t0 = time.perf_counter()
+    with quiet(not verbose):
+        total, _ = summary_index.main(reset=True)
+    return {"summaries": total, "summary_seconds": round(time.perf_counter() - t0, 3)}
+
+
+# 寬問題：flat（每個 collection 各搜 k 筆再截斷）vs summary（摘要層 + 深入前幾份報告）
+def evaluate_wide(corpus: Corpus, strategy: str, k: int, max_chunks: int, collections: list[str]) -> dict:
+    import rag_en
+    import summary_index
+    summary_index.SUMMARY_ENABLED = strategy == "summary"
+    names = [(tk.upper(), name) for tk, name in corpus.companies]
+    searched, tokens, retrieve_s, coverage = [], [], [], []
+    for question in WIDE_QUESTIONS:
+        t0 = time.perf_counter()
+        query_emb = rag_en.embed_query(question)
+        context, n = rag_en.retrieve("all", question, query_emb, k, max_chunks, collections)
+        retrieve_s.append(time.perf_counter() - t0)
+        searched.append(n)
+        tokens.append(approx_tokens(rag_en.PROMPT_TEMPLATE.format(context=context, question=question)))
+        coverage.append(sum(1 for tk, name in names if tk in context or name in context) / len(names))
+    n = len(WIDE_QUESTIONS)
+    return {"strategy": strategy, "k": k, "max_chunks": max_chunks, "questions": n,
+            "collections_avg": round(sum(searched) / n, 2),
+            "company_coverage": round(sum(coverage) / n, 4),
+            "prompt_tokens": count_stats(tokens),
+            "retrieve_ms": summarize(retrieve_s)}
+
+
+def print_wide_table(rows: list[dict]):
+    print(f"\n{'chunk':>6}{'strategy':>10}{'k':>4}{'max':>5}{'searched':>10}{'coverage':>10}"
+          f"{'tok p50':>9}{'tok max':>9}{'ret p50':>9}{'ret p95':>9}")
+    for r in rows:
+        print(f"{r['chunk_chars']:>6}{r['strategy']:>10}{r['k']:>4}{r['max_chunks']:>5}"
+              f"{r['collections_avg']:>10.2f}{r['company_coverage']:>10.3f}"
+              f"{r['prompt_tokens']['p50']:>9.0f}{r['prompt_tokens']['max']:>9.0f}"
+              f"{r['retrieve_ms']['p50']:>9.2f}{r['retrieve_ms']['p95']:>9.2f}")
+
+
+def int_list(s: str) -> list[int]:
+    return [int(x) for x in s.split(",") if x.strip()]
+
+
+def print_table(rows: list[dict]):
+    print(f"\n{'chunk':>6}{'mode':>9}{'k':>4}{'max':>5}{'recall':>8}{'hit@1':>7}{'mrr':>7}"
+          f"{'cand':>7}{'chunks':>8}{'tok p50':>9}{'tok p95':>9}{'ret p50':>9}{'e2e p50':>9}{'e2e p95':>9}")
+    for r in rows:
+        print(f"{r['chunk_chars']:>6}{r['mode']:>9}{r['k']:>4}{r['max_chunks']:>5}"
+              f"{r['recall']:>8.3f}{r['hit_at_1']:>7.3f}{r['mrr']:>7.3f}{r['candidate_recall']:>7.3f}"
+              f"{r['chunks_avg']:>8.2f}{r['prompt_tokens']['p50']:>9.0f}{r['prompt_tokens']['p95']:>9.0f}"
+              f"{r['retrieve_ms']['p50']:>9.2f}{r['e2e_ms']['p50']:>9.2f}{r['e2e_ms']['p95']:>9.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Evaluate retrieval quality vs latency over a grid of settings")
+    ap.add_argument("--tickers", type=int, default=4)
+    ap.add_argument("--filings", type=int, default=12, help="每支股票的財報數")
+    ap.add_argument("--extra-facts", type=int, default=40, help="每份 XBRL 額外的 filler facts")
+    ap.add_argument("--questions", type=int, default=120, help="由已知 fact 抽樣的問題數")
+    ap.add_argument("--question-file", help="改用既有的標註問題集（JSONL：question、ticker、concept、expected）")
+    ap.add_argument("--save-questions", help="把產生的問題集寫成 JSONL")
+    ap.add_argument("--chunk-chars", default="0,1500,600", help="CHUNK_MAX_CHARS 候選值，0 = 整份報告")
+    ap.add_argument("--k", default="1,2,4", help="per_collection_k 候選值")
+    ap.add_argument("--max-chunks", default="4,8,16", help="max_chunks 候選值")
+    ap.add_argument("--modes", default="all,company", help="all（路由）、company（company:<ticker>）")
+    ap.add_argument("--summaries", action="store_true",
+                    help="建立摘要層，並以寬問題比較 flat 與兩層檢索")
+    ap.add_argument("--embedder", choices=["fake", "env"], default="fake",
+                    help="fake = bench/fakes.py 的假 Ollama；env = 沿用環境變數設定的 backend")
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="假 Ollama 每個請求的延遲秒數")
+    ap.add_argument("--llm-latency", type=float, default=0.0, help="假 chat 每個請求的延遲秒數")
+    ap.add_argument("--out")
+    ap.add_argument("--verbose", action="store_true", help="不要隱藏被測程式的輸出")
+    args = ap.parse_args()
+
+    corpus = Corpus(n_tickers=args.tickers, n_filings=args.filings, n_extra=args.extra_facts)
+    items = read_questions(args.question_file) if args.question_file \
+        else labeled_questions(corpus, args.questions)
+    if args.save_questions:
+        with open(args.save_questions, "w", encoding="utf-8") as fh:
+            fh.writelines(json.dumps(it, ensure_ascii=False) + "\n" for it in items)
+
+    tmp = tempfile.mkdtemp(prefix="eval-")
+    xbrl_dir, csv_path = os.path.join(tmp, "xbrl_downloads"), os.path.join(tmp, "tickers.csv")
+    os.makedirs(xbrl_dir)
+    corpus.write_ticker_csv(csv_path)
+    edgar = FakeEdgar(corpus).start()
+    ollama = FakeOllama(latency=args.embed_latency).start()
+    chat = FakeChat(latency=args.llm_latency).start()
+    pg = LocalPostgres()
+    db = pg.start()
+    pg.reset()
+
+    # 被測模組於 import 時讀取環境變數，必須在 import 之前設定；LLM 快取關閉以免各設定互相命中
+    env = {
+        "SEC_WWW_URL": edgar.url, "SEC_DATA_URL": edgar.url,
+        "SEC_REQUEST_DELAY": "0", "SEC_TICKER_DELAY": "0",
+        "XBRL_DIR": xbrl_dir, "TICKER_CSV_PATH": csv_path,
+        "DB_HOST": db["host"], "DB_PORT": db["port"], "DB_NAME": db["dbname"],
+        "DB_USER": db["user"], "DB_PASSWORD": db["password"],
+        "OPENROUTER_URL": chat.url + "/api/v1/chat/completions",
+        "OPENROUTER_API_KEY": "bench",
+        "LLM_CACHE": "0",
+    }
+    if args.embedder == "fake":
+        env.update({"EMBED_BACKEND": "ollama", "OLLAMA_URL": ollama.url,
+                    "OLLAMA_EMBED_API_URL": ollama.url + "/api/embeddings"})
+    os.environ.update(env)
+
+    indexes, rows, wide_rows = [], [], []
+    try:
+        print(f"[EVAL] 載入 {len(corpus.companies)} 家公司的財報，{len(items)} 題", flush=True)
+        load_corpus(corpus, csv_path, args.verbose)
+        import rag_en
+        for chunk_chars in int_list(args.chunk_chars):
+            info = index_corpus(chunk_chars, args.verbose)
+            indexes.append(info)
+            print(f"[EVAL] chunk_chars={chunk_chars}: {info['points']} points / "
+                  f"{info['collections']} collections", flush=True)
+            collections = rag_en.get_all_collections()
+            for mode in [m for m in args.modes.split(",") if m]:
+                for k in int_list(args.k):
+                    for max_chunks in int_list(args.max_chunks):
+                        with quiet(not args.verbose):
+                            res = evaluate(items, mode, k, max_chunks, collections)
+                        rows.append(dict(chunk_chars=chunk_chars, **res))
+            if args.summaries:
+                info.update(build_summaries(args.verbose))
+                print(f"[EVAL] 摘要層：{info['summaries']} 筆（{info['summary_seconds']}s）", flush=True)
+                # 重新列出 collection，rag_en 才會知道摘要層已存在
+                collections = rag_en.get_all_collections()
+                for strategy in ("flat", "summary"):
+                    for k in int_list(args.k):
+                        for max_chunks in int_list(args.max_chunks):
+                            with quiet(not args.verbose):
+                                res = evaluate_wide(corpus, strategy, k, max_chunks, collections)
+                            wide_rows.append(dict(chunk_chars=chunk_chars, **res))
+    finally:
+        for srv in (edgar, ollama, chat):
+            srv.stop()
+        pg.stop()
+
+    report = {
+        "meta": {"commit": git_commit(),
+                 "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                 "config": {k: v for k, v in vars(args).items() if k not in ("out", "verbose")},
+                 "upstream_calls": {"ollama": ollama.calls, "chat": chat.calls}},
+        "indexes": indexes,
+        "results": rows,
+        "wide_results": wide_rows,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results",
+                                   f"retrieval-{report['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+    print_table(rows)
+    if wide_rows:
+        print_wide_table(wide_rows)
+    print(f"\n[EVAL] 結果已寫入 {out}")
+
+
+if __name__ == "__main__":
+    main()
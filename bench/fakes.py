@@ -0,0 +1,185 @@
+# 本機假服務：EDGAR、Ollama embedding、OpenAI 相容 chat completions
+# 全部以標準函式庫 ThreadingHTTPServer 實作，綁定 127.0.0.1 隨機埠
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # keep-alive 連線下 header 與 body 分兩次寫出，需關閉 Nagle 以免 40ms delayed-ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._dispatch(self, "GET", None)
+
+            def do_POST(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(n) if n else b""
+                fake._dispatch(self, "POST", body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, key: str, n: int = 1):
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + n
+
+    def _dispatch(self, h, method, body):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            status, ctype, payload = self.handle(method, h.path.split("?", 1)[0], body)
+        except Exception as e:
+            status, ctype, payload = 500, "text/plain", str(e).encode()
+        h.send_response(status)
+        h.send_header("Content-Type", ctype)
+        h.send_header("Content-Length", str(len(payload)))
+        h.end_headers()
+        h.wfile.write(payload)
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+
+def json_response(obj, status=200):
+    return status, "application/json", json.dumps(obj).encode()
+
+
+class FakeEdgar(FakeServer):
+    # 同時扮演 www.sec.gov 與 data.sec.gov，路由表來自 fixtures.Corpus
+    def __init__(self, corpus, latency: float = 0.0):
+        super().__init__(latency)
+        self.routes = corpus.routes
+
+    def handle(self, method, path, body):
+        hit = self.routes.get(path)
+        self.count(path.split("/")[1] if hit else "404")
+        if not hit:
+            return 404, "text/plain", b"not found"
+        ctype, payload = hit
+        return 200, ctype, payload
+
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+@lru_cache(maxsize=200_000)
+def token_slot(token: str, dim: int) -> tuple[int, float]:
+    h = hashlib.blake2b(token.encode(), digest_size=8).digest()
+    v = int.from_bytes(h, "little")
+    return v % dim, 1.0 if (v >> 63) else -1.0
+
+
+def hash_embed(text: str, dim: int = 768) -> list[float]:
+    # feature hashing 詞袋向量：相同詞彙的文本 cosine 相近，足以讓檢索結果有意義
+    vec = [0.0] * dim
+    tokens = TOKEN_RE.findall(text.lower())
+    for tok in tokens:
+        i, sign = token_slot(tok, dim)
+        vec[i] += sign
+    for a, b in zip(tokens, tokens[1:]):
+        i, sign = token_slot(a + " " + b, dim)
+        vec[i] += 0.5 * sign
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+class FakeOllama(FakeServer):
+    # /api/embeddings（單筆 prompt）與 /api/embed（input 可為 list）
+    def __init__(self, dim: int = 768, latency: float = 0.0, per_text: float = 0.0):
+        super().__init__(latency)
+        self.dim = dim
+        self.per_text = per_text
+
+    def handle(self, method, path, body):
+        req = json.loads(body or b"{}")
+        if path == "/api/embeddings":
+            self.count("embeddings")
+            self.count("texts")
+            if self.per_text:
+                time.sleep(self.per_text)
+            return json_response({"embedding": hash_embed(req.get("prompt", ""), self.dim)})
+        if path == "/api/embed":
+            inputs = req.get("input", "")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self.count("embed")
+            self.count("texts", len(inputs))
+            if self.per_text:
+                time.sleep(self.per_text * len(inputs))
+            return json_response({"model": req.get("model"),
+                                  "embeddings": [hash_embed(t, self.dim) for t in inputs]})
+        return 404, "text/plain", b"not found"
+
+
+class FakeChat(FakeServer):
+    # OpenAI 相容 chat completions；可依 model 注入延遲與錯誤
+    def __init__(self, latency: float = 0.0):
+        super().__init__(latency)
+        self.models: dict[str, dict] = {}
+        self.rng = random.Random(0)
+
+    def set_model(self, model: str, delay: float = 0.0, status: int = 200,
+                  fail_rate: float = 0.0, jitter: float = 0.0):
+        self.models[model] = {"delay": delay, "status": status,
+                              "fail_rate": fail_rate, "jitter": jitter}
+
+    def handle(self, method, path, body):
+        if not path.endswith("/chat/completions"):
+            return 404, "text/plain", b"not found"
+        req = json.loads(body or b"{}")
+        model = req.get("model", "")
+        self.count(model or "chat")
+        cfg = self.models.get(model, {})
+        delay = cfg.get("delay", 0.0)
+        if cfg.get("jitter"):
+            with self._lock:
+                delay += self.rng.expovariate(1.0 / cfg["jitter"])
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            failed = cfg.get("fail_rate") and self.rng.random() < cfg["fail_rate"]
+        if cfg.get("status", 200) != 200 or failed:
+            status = cfg.get("status", 200)
+            status = status if status != 200 else 429
+            return json_response({"error": {"code": status, "message": "injected"}}, status)
+        prompt = "".join(m.get("content", "") for m in req.get("messages", []))
+        return json_response({
+            "id": "fake-" + hashlib.md5(prompt.encode()).hexdigest()[:12],
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant",
+                                     "content": f"[{model}] answered from {len(prompt)} chars of context."}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 12},
+        })
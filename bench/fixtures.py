@@ -0,0 +1,239 @@
+# 產生可重現的假 EDGAR 資料：company_tickers.json、submissions JSON（含分頁）、
+# index.json 與 XBRL instance，供 benchmark 與本機假伺服器使用
+import json
+import random
+from datetime import date, timedelta
+
+COMPANIES = [
+    ("ALFA", "Alfa Dynamics Inc"), ("BRVO", "Bravo Systems Corp"),
+    ("CHRL", "Charlie Foods Co"), ("DLTA", "Delta Energy Holdings"),
+    ("ECHO", "Echo Semiconductor Inc"), ("FXTR", "Foxtrot Retail Group"),
+    ("GOLF", "Golf Medical Devices"), ("HTEL", "Hotel Software Inc"),
+    ("INDI", "India Freight Lines"), ("JLTT", "Juliett Telecom Corp"),
+    ("KILO", "Kilo Biotech Inc"), ("LIMA", "Lima Financial Corp"),
+    ("MIKE", "Mike Aerospace Inc"), ("NOVB", "November Banks Corp"),
+    ("OSCR", "Oscar Utilities Co"), ("PAPA", "Papa Chemicals Inc"),
+]
+
+# (concept, 期間型態, 相對營收的比例)
+DURATION_CONCEPTS = [
+    ("Revenues", 1.0),
+    ("CostOfRevenue", 0.58),
+    ("GrossProfit", 0.42),
+    ("OperatingExpenses", 0.21),
+    ("OperatingIncomeLoss", 0.21),
+    ("NetIncomeLoss", 0.16),
+    ("NetCashProvidedByUsedInOperatingActivities", 0.24),
+]
+INSTANT_CONCEPTS = [
+    ("AssetsCurrent", 1.3),
+    ("LiabilitiesCurrent", 0.9),
+    ("Assets", 4.1),
+    ("Liabilities", 2.6),
+    ("StockholdersEquity", 1.5),
+    ("CashAndCashEquivalentsAtCarryingValue", 0.4),
+]
+SEGMENTS = ["ProductMember", "ServiceMember"]
+
+NS = {
+    "xbrli": "http://www.xbrl.org/2003/instance",
+    "us-gaap": "http://fasb.org/us-gaap/2024",
+    "dei": "http://xbrl.sec.gov/dei/2024",
+    "iso4217": "http://www.xbrl.org/2003/iso4217",
+    "xbrldi": "http://xbrl.org/2006/xbrldi",
+    "srt": "http://fasb.org/srt/2024",
+}
+
+
+def quarter_ends(last: date, n: int) -> list[date]:
+    # 由 last 往回 n 個季末（含 last）
+    out = []
+    y, m = last.year, last.month
+    for _ in range(n):
+        out.append(date(y, m, 31 if m in (3, 12) else 30))
+        m -= 3
+        if m <= 0:
+            m += 12
+            y -= 1
+    return out
+
+
+def quarter_start(end: date) -> date:
+    m = end.month - 2
+    return date(end.year, m, 1)
+
+
+def base_revenue(ticker: str) -> float:
+    return random.Random(ticker).uniform(2e8, 9e10)
+
+
+def concept_value(ticker: str, concept: str, ratio: float, period_end: date) -> int:
+    # 同一 (ticker, concept, period) 在不同報告中永遠得到相同數值，模擬前期比較數
+    idx = period_end.year * 4 + period_end.month // 3
+    growth = (1.015 + random.Random(ticker + "g").uniform(-0.01, 0.03)) ** (idx - 2020 * 4)
+    noise = random.Random(f"{ticker}|{concept}|{period_end}").uniform(0.95, 1.05)
+    return int(base_revenue(ticker) * growth * ratio * noise)
+
+
+class Filing:
+    def __init__(self, ticker, cik, seq, period_end):
+        self.ticker = ticker
+        self.cik = cik
+        self.period_end = period_end
+        self.form = "10-K" if period_end.month == 12 else "10-Q"
+        lag = 60 if self.form == "10-K" else 38
+        self.filing_date = period_end + timedelta(days=lag)
+        self.accession = f"{cik}-{self.filing_date.year % 100:02d}-{seq:06d}"
+        self.doc_name = f"{ticker.lower()}-{period_end:%Y%m%d}_htm.xml"
+
+    @property
+    def archive_dir(self):
+        return f"/Archives/edgar/data/{int(self.cik)}/{self.accession.replace('-', '')}"
+
+
+def build_xbrl(f: Filing, n_extra: int = 40) -> bytes:
+    tk = f.ticker
+    cur_end = f.period_end
+    cur_start = date(cur_end.year, 1, 1) if f.form == "10-K" else quarter_start(cur_end)
+    prior_end = date(cur_end.year - 1, cur_end.month, cur_end.day)
+    prior_start = date(cur_start.year - 1, cur_start.month, cur_start.day)
+    fy_end = date(cur_end.year - 1, 12, 31)
+
+    contexts, facts = [], []
+
+    def ctx(cid, start=None, end=None, instant=None, member=None):
+        seg = ""
+        if member:
+            seg = (f"<xbrli:segment><xbrldi:explicitMember dimension=\"srt:ProductOrServiceAxis\">"
+                   f"us-gaap:{member}</xbrldi:explicitMember></xbrli:segment>")
+        if instant:
+            period = f"<xbrli:instant>{instant}</xbrli:instant>"
+        else:
+            period = f"<xbrli:startDate>{start}</xbrli:startDate><xbrli:endDate>{end}</xbrli:endDate>"
+        contexts.append(
+            f"<xbrli:context id=\"{cid}\"><xbrli:entity>"
+            f"<xbrli:identifier scheme=\"http://www.sec.gov/CIK\">{f.cik}</xbrli:identifier>{seg}"
+            f"</xbrli:entity><xbrli:period>{period}</xbrli:period></xbrli:context>")
+
+    ctx("c-1", cur_start, cur_end)
+    ctx("c-2", prior_start, prior_end)
+    ctx("c-3", instant=cur_end)
+    ctx("c-4", instant=fy_end)
+    for i, m in enumerate(SEGMENTS):
+        ctx(f"c-{5 + i}", cur_start, cur_end, member=m)
+
+    def fact(concept, cid, value, unit="usd", decimals="-6", prefix="us-gaap"):
+        unit_attr = f" unitRef=\"{unit}\" decimals=\"{decimals}\"" if unit else ""
+        facts.append(f"<{prefix}:{concept} contextRef=\"{cid}\"{unit_attr}>{value}</{prefix}:{concept}>")
+
+    # 前期比較數在前、分部資料次之、本期合併數最後（舊解析器以最後一筆為準）
+    for concept, ratio in DURATION_CONCEPTS:
+        fact(concept, "c-2", concept_value(tk, concept, ratio, prior_end))
+    for concept, ratio in INSTANT_CONCEPTS:
+        fact(concept, "c-4", concept_value(tk, concept, ratio, fy_end))
+    for i, m in enumerate(SEGMENTS):
+        share = 0.7 if i == 0 else 0.3
+        fact("Revenues", f"c-{5 + i}", int(concept_value(tk, "Revenues", 1.0, cur_end) * share))
+    for concept, ratio in DURATION_CONCEPTS:
+        fact(concept, "c-1", concept_value(tk, concept, ratio, cur_end))
+    for concept, ratio in INSTANT_CONCEPTS:
+        fact(concept, "c-3", concept_value(tk, concept, ratio, cur_end))
+    eps = round(concept_value(tk, "NetIncomeLoss", 0.16, cur_end) / 1.5e9, 2)
+    fact("EarningsPerShareBasic", "c-1", eps, unit="usdPerShare", decimals="2")
+    for i in range(n_extra):
+        fact(f"OtherDisclosureItem{i:03d}", "c-1",
+             concept_value(tk, f"x{i}", 0.01, cur_end))
+
+    fp = "FY" if f.form == "10-K" else f"Q{cur_end.month // 3}"
+    name = dict(COMPANIES).get(tk, tk)
+    fact("DocumentType", "c-1", f.form, unit=None, prefix="dei")
+    fact("DocumentPeriodEndDate", "c-1", cur_end.isoformat(), unit=None, prefix="dei")
+    fact("DocumentFiscalYearFocus", "c-1", cur_end.year, unit=None, prefix="dei")
+    fact("DocumentFiscalPeriodFocus", "c-1", fp, unit=None, prefix="dei")
+    fact("EntityRegistrantName", "c-1", name, unit=None, prefix="dei")
+    fact("EntityCentralIndexKey", "c-1", f.cik, unit=None, prefix="dei")
+
+    units = (
+        "<xbrli:unit id=\"usd\"><xbrli:measure>iso4217:USD</xbrli:measure></xbrli:unit>"
+        "<xbrli:unit id=\"usdPerShare\"><xbrli:divide>"
+        "<xbrli:unitNumerator><xbrli:measure>iso4217:USD</xbrli:measure></xbrli:unitNumerator>"
+        "<xbrli:unitDenominator><xbrli:measure>xbrli:shares</xbrli:measure></xbrli:unitDenominator>"
+        "</xbrli:divide></xbrli:unit>"
+    )
+    ns = " ".join(f"xmlns:{k}=\"{v}\"" for k, v in NS.items())
+    body = "\n".join(contexts) + "\n" + units + "\n" + "\n".join(facts)
+    return f"<?xml version=\"1.0\" encoding=\"utf-8\"?>\n<xbrli:xbrl {ns}>\n{body}\n</xbrli:xbrl>\n".encode()
+
+
+class Corpus:
+    # routes: URL path → (content-type, bytes)，直接給 FakeEdgar 使用
+    def __init__(self, n_tickers=4, n_filings=12, n_extra=40, recent_count=8,
+                 page_size=10, last=date(2024, 9, 30)):
+        self.companies = COMPANIES[:n_tickers]
+        self.filings: dict[str, list[Filing]] = {}
+        self.routes: dict[str, tuple[str, bytes]] = {}
+        self.n_extra = n_extra
+
+        ticker_map = {}
+        for i, (tk, name) in enumerate(self.companies):
+            cik = str(1000 + i).zfill(10)
+            ticker_map[str(i)] = {"cik_str": int(cik), "ticker": tk, "title": name}
+            fl = [Filing(tk, cik, seq, pe)
+                  for seq, pe in enumerate(quarter_ends(last, n_filings), start=1)]
+            self.filings[tk] = fl
+            self._add_submissions(tk, name, cik, fl, recent_count, page_size)
+            for f in fl:
+                self._add_archive(f)
+        self.routes["/files/company_tickers.json"] = (
+            "application/json", json.dumps(ticker_map).encode())
+
+    @property
+    def tickers(self) -> list[str]:
+        return [tk for tk, _ in self.companies]
+
+    def _columns(self, filings: list[Filing]) -> dict:
+        cols = {"accessionNumber": [], "filingDate": [], "reportDate": [],
+                "form": [], "primaryDocument": []}
+        for f in filings:
+            # 夾雜 8-K，模擬真實 submissions 內大量非財報表單
+            cols["accessionNumber"] += [f.accession, f.accession[:-1] + "9"]
+            cols["filingDate"] += [f.filing_date.isoformat()] * 2
+            cols["reportDate"] += [f.period_end.isoformat(), ""]
+            cols["form"] += [f.form, "8-K"]
+            cols["primaryDocument"] += [f.doc_name, "ex99.htm"]
+        return cols
+
+    def _add_submissions(self, tk, name, cik, filings, recent_count, page_size):
+        recent, older = filings[:recent_count], filings[recent_count:]
+        files = []
+        for p in range(0, len(older), page_size):
+            chunk = older[p:p + page_size]
+            page_name = f"CIK{cik}-submissions-{p // page_size + 1:03d}.json"
+            files.append({
+                "name": page_name,
+                "filingCount": len(chunk) * 2,
+                "filingFrom": chunk[-1].filing_date.isoformat(),
+                "filingTo": chunk[0].filing_date.isoformat(),
+            })
+            self.routes[f"/submissions/{page_name}"] = (
+                "application/json", json.dumps(self._columns(chunk)).encode())
+        main = {
+            "cik": cik, "name": name, "tickers": [tk],
+            "filings": {"recent": self._columns(recent), "files": files},
+        }
+        self.routes[f"/submissions/CIK{cik}.json"] = ("application/json", json.dumps(main).encode())
+
+    def _add_archive(self, f: Filing):
+        index = {"directory": {"item": [
+            {"name": f"{f.accession}-index.htm"},
+            {"name": f.doc_name.replace("_htm.xml", ".htm")},
+            {"name": f.doc_name},
+        ]}}
+        self.routes[f"{f.archive_dir}/index.json"] = ("application/json", json.dumps(index).encode())
+        self.routes[f"{f.archive_dir}/{f.doc_name}"] = ("application/xml", build_xbrl(f, self.n_extra))
+
+    def write_ticker_csv(self, path: str):
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write("Name,Ticker,Found_Name,Exchange\n")
+            for tk, name in self.companies:
+                fh.write(f"{name},{tk},{name},NMS\n")
@@ -0,0 +1,90 @@
+# 取得 benchmark 用的 PostgreSQL：
+#   1. 若設定 BENCH_DB_HOST 等環境變數，直接使用既有（拋棄式）資料庫
+#   2. 否則以 initdb/pg_ctl 在暫存目錄啟動一個用完即丟的 cluster
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+
+
+def find_pg_bindir() -> str | None:
+    if os.getenv("PG_BINDIR"):
+        return os.getenv("PG_BINDIR")
+    initdb = shutil.which("initdb")
+    if initdb:
+        return os.path.dirname(initdb)
+    pg_config = shutil.which("pg_config")
+    if pg_config:
+        out = subprocess.run([pg_config, "--bindir"], capture_output=True, text=True)
+        if out.returncode == 0 and os.path.exists(os.path.join(out.stdout.strip(), "initdb")):
+            return out.stdout.strip()
+    cands = sorted(glob.glob("/usr/lib/postgresql/*/bin/initdb"))
+    return os.path.dirname(cands[-1]) if cands else None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class LocalPostgres:
+    def __init__(self):
+        self.tmp = None
+        self.bindir = None
+        self.params = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self) -> dict:
+        if os.getenv("BENCH_DB_HOST"):
+            self.params = {
+                "host": os.getenv("BENCH_DB_HOST"),
+                "port": os.getenv("BENCH_DB_PORT", "5432"),
+                "dbname": os.getenv("BENCH_DB_NAME", "postgres"),
+                "user": os.getenv("BENCH_DB_USER", "postgres"),
+                "password": os.getenv("BENCH_DB_PASSWORD", ""),
+            }
+            return self.params
+        self.bindir = find_pg_bindir()
+        if not self.bindir:
+            raise RuntimeError("找不到 initdb，請安裝 PostgreSQL 或設定 BENCH_DB_HOST")
+        self.tmp = tempfile.mkdtemp(prefix="bench-pg-")
+        data = os.path.join(self.tmp, "data")
+        port = free_port()
+        subprocess.run([os.path.join(self.bindir, "initdb"), "-D", data, "-U", "bench",
+                        "-A", "trust", "--no-sync"], check=True, capture_output=True)
+        opts = f"-p {port} -k {self.tmp} -c listen_addresses=127.0.0.1 -c fsync=off"
+        subprocess.run([os.path.join(self.bindir, "pg_ctl"), "-D", data, "-o", opts,
+                        "-l", os.path.join(self.tmp, "pg.log"), "-w", "start"],
+                       check=True, capture_output=True)
+        self.params = {"host": "127.0.0.1", "port": str(port), "dbname": "postgres",
+                       "user": "bench", "password": ""}
+        return self.params
+
+    def stop(self):
+        if self.tmp:
+            subprocess.run([os.path.join(self.bindir, "pg_ctl"), "-D",
+                            os.path.join(self.tmp, "data"), "-m", "fast", "stop"],
+                           capture_output=True)
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            self.tmp = None
+
+    def reset(self):
+        # 清空 public 與 xbrl（fact 去重）schema，讓各 stage 從乾淨狀態開始；
+        # 外部資料庫需明確設定 BENCH_DB_RESET=1 才會清空
+        if not self.tmp and os.getenv("BENCH_DB_RESET") != "1":
+            return
+        import psycopg2
+        conn = psycopg2.connect(**self.params)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public; "
+                        "DROP SCHEMA IF EXISTS xbrl CASCADE;")
+        conn.close()
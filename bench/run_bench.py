@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+# 離線端到端 benchmark：假 EDGAR / Ollama / chat 伺服器 + Qdrant local mode + 本機 PostgreSQL
+# 分別量測 download、parse、extract（DB 與欄式匯出）、embed+upsert、query 各階段的吞吐量與延遲，輸出 JSON
+#
+#   python bench/run_bench.py --tickers 4 --filings 12 --out bench/results/head.json
+#   python bench/compare.py bench/results/base.json bench/results/head.json
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+SRC_DIR = os.path.join(ROOT, "src")
+sys.path.insert(0, SRC_DIR)
+
+from fixtures import Corpus
+from fakes import FakeEdgar, FakeOllama, FakeChat
+from local_pg import LocalPostgres
+from stats import Recorder, summarize, git_commit
+
+STAGES = ["download", "parse", "extract", "columnar", "embed_upsert", "query", "batch", "service"]
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    if not enabled:
+        yield
+        return
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink), contextlib.redirect_stderr(sink):
+        yield
+
+
+def stage_result(seconds, items, unit, rec, latency_key):
+    return {
+        "items": items,
+        "unit": unit,
+        "seconds": round(seconds, 4),
+        "throughput_per_s": round(items / seconds, 3) if seconds else 0.0,
+        "latency_ms": summarize(rec.samples.get(latency_key, [])),
+        "calls": rec.report(),
+    }
+
+
+def bench_download(ctx):
+    import edgar_fetcher
+    rec = Recorder()
+    restore = [rec.wrap(edgar_fetcher, "get_cik"),
+               rec.wrap(edgar_fetcher, "get_filings"),
+               rec.wrap(edgar_fetcher, "download_xbrl")]
+    try:
+        t0 = time.perf_counter()
+        with quiet(ctx.quiet):
+            edgar_fetcher.process_csv(ctx.csv_path)
+        elapsed = time.perf_counter() - t0
+    finally:
+        for r in restore:
+            r()
+    files = glob.glob(os.path.join(ctx.xbrl_dir, "*.xml"))
+    return stage_result(elapsed, len(files), "filings", rec, "edgar_fetcher.download_xbrl")
+
+
+def bench_parse(ctx):
+    import arelle_db
+    rec = Recorder()
+    restore = [rec.wrap(arelle_db, "load_file")]
+    files = glob.glob(os.path.join(ctx.xbrl_dir, "*.xml"))
+    try:
+        t0 = time.perf_counter()
+        with quiet(ctx.quiet):
+            arelle_db.main(ctx.csv_path)
+        elapsed = time.perf_counter() - t0
+    finally:
+        for r in restore:
+            r()
+    return stage_result(elapsed, len(files), "filings", rec, "arelle_db.load_file")
+
+
+def bench_extract(ctx):
+    import pipeline
+    rec = Recorder()
+    n = 0
+    t0 = time.perf_counter()
+    for tk in pipeline.list_ticker_tables():
+        with rec.timed("pipeline.extract_reports"):
+            n += len(list(pipeline.extract_reports(tk)))
+    elapsed = time.perf_counter() - t0
+    return stage_result(elapsed, n, "reports", rec, "pipeline.extract_reports")
+
+
+def bench_columnar(ctx):
+    # 匯出 Parquet 後以 memory map 重建報告文本（與 extract stage 對照），另量測衍生指標輸入的載入
+    import psycopg2
+    import pipeline
+    import derived_metrics
+    import fact_export
+    rec = Recorder()
+    root = os.path.join(os.path.dirname(ctx.xbrl_dir), "columnar")
+    with quiet(ctx.quiet), rec.timed("fact_export.export"):
+        fact_export.export(root=root, clean=True)
+    n = 0
+    t0 = time.perf_counter()
+    for tk in fact_export.list_tickers(root):
+        with rec.timed("fact_export.extract_reports"):
+            n += len(list(fact_export.extract_reports(tk, root)))
+    elapsed = time.perf_counter() - t0
+    with rec.timed("fact_export.metric_inputs"):
+        fact_export.metric_inputs(root=root)
+    conn = psycopg2.connect(**pipeline.DB_PARAMS)
+    try:
+        with conn.cursor() as cur, rec.timed("derived_metrics.load_facts"):
+            derived_metrics.load_facts(cur, fact_export.list_tickers(root))
+    finally:
+        conn.close()
+    return stage_result(elapsed, n, "reports", rec, "fact_export.extract_reports")
+
+
+def bench_embed_upsert(ctx):
+    import pipeline
+    rec = Recorder()
+    restore = [rec.wrap(pipeline, "embed"),
+               rec.wrap(pipeline, "ensure_collection"),
+               rec.wrap(pipeline.qdrant, "upsert", "qdrant.upsert"),
+               rec.wrap(pipeline.qdrant, "retrieve", "qdrant.retrieve")]
+    try:
+        t0 = time.perf_counter()
+        with quiet(ctx.quiet):
+            for tk in pipeline.list_ticker_tables():
+                with rec.timed("pipeline.upsert_chunks"):
+                    pipeline.upsert_chunks(tk, reset=True)
+        elapsed = time.perf_counter() - t0
+    finally:
+        for r in restore:
+            r()
+    client = pipeline.get_qdrant()
+    points = sum(client.count(c.name).count for c in client.get_collections().collections)
+    return stage_result(elapsed, points, "points", rec, "pipeline.upsert_chunks")
+
+
+def make_questions(corpus, n):
+    templates = [
+        "What was the total revenue of {name} in {period}?",
+        "How did net income of {name} change in {period}?",
+        "What are the current assets and current liabilities of {name} for {period}?",
+        "Summarize operating expenses and gross profit for {name} in {period}.",
+    ]
+    out = []
+    for i in range(n):
+        tk, name = corpus.companies[i % len(corpus.companies)]
+        f = corpus.filings[tk][i % len(corpus.filings[tk])]
+        from edgar_client import get_quarter
+        report = f"{tk}_{get_quarter(f.filing_date.isoformat())}"
+        if f.form == "10-K":
+            report += "&Annual"
+        period = f"the quarter ended {f.period_end.isoformat()}"
+        kind = i % 4
+        mode = {0: f"company:{tk.lower()}", 1: report.lower(), 2: f"company:{tk.lower()}", 3: "all"}[kind]
+        out.append((mode, templates[i % len(templates)].format(name=name, period=period)))
+    return out
+
+
+def bench_query(ctx):
+    import rag_en
+    rec = Recorder()
+    restore = [rec.wrap(rag_en, "embed_query"),
+               rec.wrap(rag_en, "search_hits"),
+               rec.wrap(rag_en, "ask_llm")]
+    questions = make_questions(ctx.corpus, ctx.queries)
+    try:
+        t0 = time.perf_counter()
+        with quiet(ctx.quiet):
+            for mode, q in questions:
+                with rec.timed("rag_en.rag_ask_multi"):
+                    rag_en.rag_ask_multi(mode, q, per_collection_k=2, max_chunks=8)
+        elapsed = time.perf_counter() - t0
+    finally:
+        for r in restore:
+            r()
+    return stage_result(elapsed, len(questions), "questions", rec, "rag_en.rag_ask_multi")
+
+
+def bench_batch(ctx):
+    # 與 query stage 相同的問題，改由 rag_batch 批次 embed + 平行檢索 / LLM；第二次執行驗證續跑
+    import rag_batch
+    rec = Recorder()
+    restore = [rec.wrap(rag_batch.BatchRunner, "embed_batch", "rag_batch.embed_batch"),
+               rec.wrap(rag_batch.BatchRunner, "answer", "rag_batch.answer")]
+    base = os.path.dirname(ctx.xbrl_dir)
+    src, out = os.path.join(base, "questions.jsonl"), os.path.join(base, "answers.jsonl")
+    with open(src, "w", encoding="utf-8") as fh:
+        for i, (mode, q) in enumerate(make_questions(ctx.corpus, ctx.queries)):
+            fh.write(json.dumps({"id": i, "question": q, "mode": mode}) + "\n")
+    try:
+        t0 = time.perf_counter()
+        with quiet(ctx.quiet):
+            summary = rag_batch.main(src, out, concurrency=ctx.concurrency)
+        elapsed = time.perf_counter() - t0
+        with quiet(ctx.quiet):
+            resumed = rag_batch.main(src, out, concurrency=ctx.concurrency)
+    finally:
+        for r in restore:
+            r()
+    result = stage_result(elapsed, summary["done"], "questions", rec, "rag_batch.answer")
+    result["errors"] = summary["errors"]
+    result["resumed_skipped"] = resumed["skipped"]
+    with quiet(ctx.quiet):
+        check = check_batch_window(src, os.path.join(base, "answers-window.jsonl"))
+    print(f"[CHECK] rag_batch embed 失敗的錯誤紀錄={check['embed_errors']} "
+          f"在途上限={check['peak_inflight']}/{check['limit']} {'OK' if check['ok'] else 'FAIL'}")
+    if not check["ok"]:
+        raise SystemExit(1)
+    result["window_check"] = check
+    return result
+
+
+# 第二批 embed 失敗時該批每題寫出錯誤紀錄、其他批照常完成，且在途題數不超過 window 批
+def check_batch_window(src: str, out: str, embed_size: int = 4, window: int = 2) -> dict:
+    import threading
+    import rag_batch
+    items = rag_batch.load_items(src, ["all"])
+    runner = rag_batch.BatchRunner(out, embed_size=embed_size, window=window)
+    embed, answer = runner.embed_batch, runner.answer
+    calls, inflight, peak, lock = [0], [0], [0], threading.Lock()
+
+    def failing_embed(batch):
+        calls[0] += 1
+        if calls[0] == 2:
+            raise RuntimeError("embed upstream down")
+        # embed 之後到 answer 完成前都算在途
+        with lock:
+            inflight[0] += len(batch)
+            peak[0] = max(peak[0], inflight[0])
+        return embed(batch)
+
+    def tracked_answer(*a):
+        try:
+            return answer(*a)
+        finally:
+            with lock:
+                inflight[0] -= 1
+
+    runner.embed_batch, runner.answer = failing_embed, tracked_answer
+    summary = runner.run(items)
+    with open(out, encoding="utf-8") as fh:
+        embed_errors = sum("embed failed" in (json.loads(line).get("error") or "") for line in fh)
+    ok = (summary["done"] == len(items) and embed_errors == min(embed_size, len(items) - embed_size)
+          and peak[0] <= window * embed_size)
+    return {"items": len(items), "done": summary["done"], "embed_errors": embed_errors,
+            "peak_inflight": peak[0], "limit": window * embed_size, "ok": ok}
+
+
+def bench_service(ctx):
+    import asyncio
+    import random
+    import aiohttp
+    from aiohttp import web
+    from qdrant_client import AsyncQdrantClient
+    import rag_service
+
+    # local mode 的資料夾同時只能被一個 client 開啟
+    ctx.close_qdrant()
+    questions = make_questions(ctx.corpus, ctx.queries)
+    # 每題送兩次並打散，讓重複問題同時在途以觸發 coalescing
+    workload = questions * 2
+    random.Random(0).shuffle(workload)
+    rec = Recorder()
+
+    async def run():
+        service = rag_service.RagService(qdrant=AsyncQdrantClient(path=ctx.qdrant_path))
+        runner = web.AppRunner(rag_service.create_app(service))
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+        sem = asyncio.Semaphore(ctx.concurrency)
+
+        async def one(session, mode, q):
+            async with sem:
+                t0 = time.perf_counter()
+                async with session.post(f"{url}/ask", json={"question": q, "mode": mode}) as r:
+                    r.raise_for_status()
+                    await r.json()
+                rec.add("service.ask", time.perf_counter() - t0)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                t0 = time.perf_counter()
+                await asyncio.gather(*(one(session, m, q) for m, q in workload))
+                return time.perf_counter() - t0, service.coalesced_count, service.llm_cache.info()
+        finally:
+            await runner.cleanup()
+
+    elapsed, coalesced, cache = asyncio.run(run())
+    result = stage_result(elapsed, len(workload), "questions", rec, "service.ask")
+    result["concurrency"] = ctx.concurrency
+    result["coalesced"] = coalesced
+    result["llm_cache"] = {k: cache[k] for k in ("hits", "misses", "coalesced")}
+    return result
+
+
+class Context:
+    def close_qdrant(self):
+        if self.qdrant is not None:
+            self.qdrant.close()
+            self.qdrant = None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline end-to-end benchmark")
+    ap.add_argument("--tickers", type=int, default=4)
+    ap.add_argument("--filings", type=int, default=12, help="每支股票的財報數")
+    ap.add_argument("--extra-facts", type=int, default=40, help="每份 XBRL 額外的 filler facts")
+    ap.add_argument("--queries", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=16, help="service stage 的同時請求數")
+    ap.add_argument("--sec-latency", type=float, default=0.0, help="假 EDGAR 每個請求的延遲秒數")
+    ap.add_argument("--embed-latency", type=float, default=0.0, help="假 Ollama 每個請求的延遲秒數")
+    ap.add_argument("--llm-latency", type=float, default=0.0, help="假 chat 每個請求的延遲秒數")
+    ap.add_argument("--llm-cache", action="store_true", help="啟用 LLM 回應快取（SQLite 放在暫存目錄）")
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--out", help="結果 JSON 路徑（預設 bench/results/<commit>-<時間>.json）")
+    ap.add_argument("--verbose", action="store_true", help="不要隱藏被測程式的輸出")
+    args = ap.parse_args()
+
+    stages = [s for s in args.stages.split(",") if s]
+    corpus = Corpus(n_tickers=args.tickers, n_filings=args.filings, n_extra=args.extra_facts)
+    tmp = tempfile.mkdtemp(prefix="bench-")
+
+    ctx = Context()
+    ctx.corpus = corpus
+    ctx.quiet = not args.verbose
+    ctx.queries = args.queries
+    ctx.concurrency = args.concurrency
+    ctx.xbrl_dir = os.path.join(tmp, "xbrl_downloads")
+    ctx.csv_path = os.path.join(tmp, "tickers.csv")
+    os.makedirs(ctx.xbrl_dir)
+    corpus.write_ticker_csv(ctx.csv_path)
+
+    edgar = FakeEdgar(corpus, latency=args.sec_latency).start()
+    ollama = FakeOllama(latency=args.embed_latency).start()
+    chat = FakeChat(latency=args.llm_latency).start()
+    pg = LocalPostgres()
+    db = pg.start()
+    pg.reset()
+
+    # 被測模組於 import 時讀取環境變數，必須在 import 之前設定
+    os.environ.update({
+        "SEC_WWW_URL": edgar.url, "SEC_DATA_URL": edgar.url,
+        "SEC_REQUEST_DELAY": "0", "SEC_TICKER_DELAY": "0",
+        "XBRL_DIR": ctx.xbrl_dir, "TICKER_CSV_PATH": ctx.csv_path,
+        "DB_HOST": db["host"], "DB_PORT": db["port"], "DB_NAME": db["dbname"],
+        "DB_USER": db["user"], "DB_PASSWORD": db["password"],
+        "OLLAMA_URL": ollama.url,
+        "OLLAMA_EMBED_API_URL": ollama.url + "/api/embeddings",
+        "OPENROUTER_URL": chat.url + "/api/v1/chat/completions",
+        "OPENROUTER_API_KEY": "bench",
+        # LLM 回應快取預設關閉，避免 query / service 兩個 stage 互相命中；--llm-cache 改為量測快取路徑
+        "LLM_CACHE": "1" if args.llm_cache else "0",
+        "LLM_CACHE_PATH": os.path.join(tmp, "llm_cache.sqlite"),
+    })
+
+    from qdrant_client import QdrantClient
+    import pipeline
+    import rag_en
+    ctx.qdrant_path = os.path.join(tmp, "qdrant")
+    ctx.qdrant = QdrantClient(path=ctx.qdrant_path)
+    pipeline.qdrant = ctx.qdrant
+    rag_en.qdrant = ctx.qdrant
+
+    runners = {"download": bench_download, "parse": bench_parse, "extract": bench_extract,
+               "columnar": bench_columnar, "batch": bench_batch,
+               "embed_upsert": bench_embed_upsert, "query": bench_query,
+               "service": bench_service}
+    results = {}
+    try:
+        for name in stages:
+            print(f"[BENCH] {name} ...", flush=True)
+            results[name] = runners[name](ctx)
+    finally:
+        ctx.close_qdrant()
+        for srv in (edgar, ollama, chat):
+            srv.stop()
+        pg.stop()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "verbose")},
+        },
+        "upstream_calls": {"edgar": edgar.calls, "ollama": ollama.calls, "chat": chat.calls},
+        "stages": results,
+    }
+    out = args.out or os.path.join(
+        BENCH_DIR, "results", f"{report['meta']['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, ensure_ascii=False)
+
+    print(f"\n{'stage':<14}{'items':>8}{'sec':>10}{'items/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, r in results.items():
+        lat = r["latency_ms"]
+        print(f"{name:<14}{r['items']:>8}{r['seconds']:>10.3f}{r['throughput_per_s']:>10.2f}"
+              f"{lat['p50']:>10.2f}{lat['p95']:>10.2f}")
+    print(f"\n[BENCH] 結果已寫入 {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# 延遲 / 吞吐量紀錄工具：以 wrap() 包住模組函式，不改動被測程式碼
+import functools
+import os
+import statistics
+import subprocess
+import time
+from contextlib import contextmanager
+
+
+def percentile(sorted_vals: list[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def summarize(samples: list[float]) -> dict:
+    vals = sorted(samples)
+    ms = lambda x: round(x * 1000, 3)
+    return {
+        "count": len(vals),
+        "mean": ms(statistics.fmean(vals)) if vals else 0.0,
+        "p50": ms(percentile(vals, 0.50)),
+        "p95": ms(percentile(vals, 0.95)),
+        "p99": ms(percentile(vals, 0.99)),
+        "max": ms(vals[-1]) if vals else 0.0,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+
+    def add(self, name: str, seconds: float):
+        self.samples.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def timed(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def wrap(self, module, attr: str, name: str | None = None):
+        # 替換 module.attr 為計時版本；回傳還原函式
+        orig = getattr(module, attr)
+        key = name or f"{module.__name__}.{attr}"
+
+        @functools.wraps(orig)
+        def timed_fn(*a, **kw):
+            t0 = time.perf_counter()
+            try:
+                return orig(*a, **kw)
+            finally:
+                self.add(key, time.perf_counter() - t0)
+
+        setattr(module, attr, timed_fn)
+        return lambda: setattr(module, attr, orig)
+
+    def report(self) -> dict:
+        return {k: summarize(v) for k, v in self.samples.items()}
+
+
+def git_commit() -> str:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                         capture_output=True, text=True)
+    return out.stdout.strip() or "unknown"
@@ -0,0 +1,4 @@
+# python src <subcommand> 與 python cli.py <subcommand> 相同
+from cli import main
+
+main()
@@ -1,17 +1,15 @@
 import os
 import glob
-import pandas as pd
-import json
-from lxml import etree
 import psycopg2
 from psycopg2 import sql
 from dotenv import load_dotenv
+from metrics import span, inc
+import fact_store
+import derived_metrics
 
 load_dotenv()
 
-csv_path = os.getenv('TICKER_CSV_PATH', '../csv/test.csv')
-df = pd.read_csv(csv_path, dtype=str)
-tickers = df['Ticker'].dropna().unique()
+CSV_PATH = os.getenv('TICKER_CSV_PATH', '../csv/test.csv')
 
 # 取得 script 所在資料夾，再定位到 xbrl_downloads
 base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -27,8 +25,21 @@ DB_PARAMS = {
     'user':     os.getenv('DB_USER'),
     'password': os.getenv('DB_PASSWORD'),
 }
-conn = psycopg2.connect(**DB_PARAMS)
-conn.autocommit = True
+
+_conn = None
+
+# 第一次使用時才連線
+def get_conn():
+    global _conn
+    if _conn is None or _conn.closed:
+        _conn = psycopg2.connect(**DB_PARAMS)
+        _conn.autocommit = True
+    return _conn
+
+def load_tickers(csv_path: str = None):
+    import pandas as pd
+    df = pd.read_csv(csv_path or CSV_PATH, dtype=str)
+    return df['Ticker'].dropna().unique()
 
 def ensure_table(cursor, table_name):
     create = sql.SQL("""
@@ -40,45 +51,69 @@ def ensure_table(cursor, table_name):
     """).format(table=sql.Identifier(table_name))
     cursor.execute(create)
 
-with conn.cursor() as cur:
-    for ticker in tickers:
-        tbl = ticker.lower()
-        ensure_table(cur, tbl)
-
-        patterns = [
-            os.path.join(xml_dir, f"{ticker}_*Q?.xml"),
-            os.path.join(xml_dir, f"{ticker}_*Q?&Annual.xml")
-        ]
-        xbrl_files = []
-        for pat in patterns:
-            matched = glob.glob(pat)
-            # 顯示 matched 的數量和檔案清單
-            names = [os.path.basename(p) for p in matched]
-            print(f"[DEBUG] pattern={os.path.basename(pat)!r} -> found {len(names)} files:")
-            xbrl_files.extend(matched)
-
-        if not xbrl_files:
-            print(f"[WARNING] ticker={ticker!r}: no XBRL files found under {xml_dir}")
-            continue
-
-        for fp in xbrl_files:
-            report = os.path.basename(fp).rsplit('.',1)[0]
-            tree = etree.parse(fp)
-            root = tree.getroot()
-            facts = {}
-            for fact in root.findall('.//'):
-                ctx = fact.get('contextRef')
-                if not ctx: continue
-                tag = etree.QName(fact.tag).localname
-                facts[tag] = {
-                    'value': fact.text,
-                    'unitRef': fact.get('unitRef'),
-                    'contextRef': ctx,
-                    'decimals': fact.get('decimals')
-                }
-            insert = sql.SQL(
-                "INSERT INTO {table} (report, facts) VALUES (%s, %s::jsonb)"
-            ).format(table=sql.Identifier(tbl))
-            cur.execute(insert, (report, json.dumps(facts)))
-
-print("all ticker XBRL->JSONB finish")
+def find_xbrl_files(ticker: str) -> list[str]:
+    patterns = [
+        os.path.join(xml_dir, f"{ticker}_*Q?.xml"),
+        os.path.join(xml_dir, f"{ticker}_*Q?&Annual.xml")
+    ]
+    xbrl_files = []
+    for pat in patterns:
+        matched = glob.glob(pat)
+        # 顯示 matched 的數量和檔案清單
+        names = [os.path.basename(p) for p in matched]
+        print(f"[DEBUG] pattern={os.path.basename(pat)!r} -> found {len(names)} files:")
+        xbrl_files.extend(matched)
+    return xbrl_files
+
+def parse_xbrl(fp: str) -> dict:
+    from lxml import etree
+    with span("xbrl.parse", source="arelle_db") as sp:
+        tree = etree.parse(fp)
+        root = tree.getroot()
+        facts = fact_store.parse_legacy(root)
+        sp.set(file=os.path.basename(fp), facts=len(facts))
+    return facts
+
+# 解析單一 XBRL 檔並寫入該 ticker 的 table
+# FACT_DEDUP（預設開啟）時 fact 去重寫入 xbrl schema，報告表只留 report 列
+def load_file(cur, ticker: str, fp: str):
+    tbl = ticker.lower()
+    report = os.path.basename(fp).rsplit('.',1)[0]
+    if fact_store.FACT_DEDUP:
+        from lxml import etree
+        with span("xbrl.parse", source="arelle_db") as sp:
+            records = fact_store.parse_facts(etree.parse(fp).getroot())
+            sp.set(file=os.path.basename(fp), facts=len(records))
+        fact_store.insert_report_row(cur, tbl, report, None)
+        fact_store.store_report(cur, tbl, report, records)
+        inc("xbrl_facts_total", len(records), source="arelle_db")
+        return report
+    facts = parse_xbrl(fp)
+    fact_store.insert_report_row(cur, tbl, report, facts)
+    inc("xbrl_facts_total", len(facts), source="arelle_db")
+    return report
+
+def main(csv_path: str = None):
+    tickers = load_tickers(csv_path)
+    with get_conn().cursor() as cur:
+        if fact_store.FACT_DEDUP:
+            fact_store.ensure_schema(cur)
+        for ticker in tickers:
+            ensure_table(cur, ticker.lower())
+
+            xbrl_files = find_xbrl_files(ticker)
+            if not xbrl_files:
+                print(f"[WARNING] ticker={ticker!r}: no XBRL files found under {xml_dir}")
+                continue
+
+            for fp in xbrl_files:
+                load_file(cur, ticker, fp)
+
+        # 只重算有新報告的 ticker 的衍生指標
+        if fact_store.FACT_DEDUP:
+            derived_metrics.refresh(cur)
+
+    print("all ticker XBRL->JSONB finish")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# 統一入口：python cli.py <subcommand> ...（或 python src <subcommand>）
+#
+#   fetch    從 EDGAR 下載 XBRL（--db 直接解析寫入 PostgreSQL；--since / --until 限定申報期間）
+#   load     解析 xbrl_downloads 內的 XBRL 寫入 PostgreSQL
+#   extract  從 DB 拆 JSONB，顯示可讀文本
+#   embed    chunk→embed→寫入 Qdrant
+#   reindex  將 index profile 套用到既有 collection
+#   ask      RAG 問答（不帶問題則進入互動模式）
+#   batch    批次問答：JSONL / CSV 問題檔 → JSONL 回答（平行、限速、可續跑）
+#   serve    啟動 async RAG 查詢服務
+#   ingest   監看 XBRL 資料夾，新檔自動入庫並寫入 Qdrant（inotify，無法使用時輪詢）
+#   enrich   以 yfinance 補 ticker / 產業資料
+#   dedup-report  跨報告 fact 去重省下的儲存量與 embedding 量
+#   derive   重算衍生指標（成長率、利潤率、比率）
+#   summarize  產生報告 / 公司摘要並寫入摘要層 collection（寬問題的兩層檢索）
+#   route    顯示問題會被路由到哪些 collection（--refresh-map 下載 SEC ticker 字典）
+#   llm-cache  LLM 回應快取的統計 / 淘汰 / 清空
+#   facts    以期間範圍 / instant・duration / 合併數 / 維度 member 查詢 fact（索引欄位）
+#   export   facts 匯出成 Parquet / Arrow（extract / embed 可加 --source parquet 改從匯出檔讀取）
+#
+# 各子命令只在執行時才 import 對應模組，pandas / lxml / qdrant_client / yfinance
+# 與 DB、Qdrant 連線都延遲到真正用到時才載入。
+import argparse
+import sys
+
+from index_profiles import INDEX_PROFILES
+
+PROFILE_NAMES = list(INDEX_PROFILES)
+
+
+def resolve_tickers(args) -> list[str]:
+    import pipeline
+    if getattr(args, "source", None):
+        pipeline.FACT_SOURCE = args.source
+    if args.all:
+        return pipeline.list_ticker_tables()
+    if args.ticker:
+        return [args.ticker.lower()]
+    print("請指定 --all 或 ticker，例如：")
+    print(f"  python cli.py {args.cmd} --all")
+    sys.exit(1)
+
+
+def cmd_fetch(args):
+    forms = tuple(f.strip().upper() for f in args.forms.split(",") if f.strip())
+    if args.db:
+        import download_db
+        download_db.main(args.csv, args.since, args.until, forms)
+    else:
+        import edgar_fetcher
+        edgar_fetcher.main(args.csv or "../csv/global_ticker.csv", args.since, args.until, forms)
+
+
+def cmd_load(args):
+    import arelle_db
+    arelle_db.main(args.csv)
+
+
+def cmd_extract(args):
+    import pipeline
+    for tk in resolve_tickers(args):
+        print(f"\n=== Extract {tk} ===")
+        for report, text in pipeline.extract_reports(tk):
+            print(f"\n--- {report} ---\n{text}\n")
+
+
+def cmd_embed(args):
+    import pipeline
+    for tk in resolve_tickers(args):
+        pipeline.upsert_chunks(tk, reset=args.reset, profile=args.profile)
+
+
+def cmd_reindex(args):
+    import pipeline
+    names = args.collections or [c.name for c in pipeline.get_qdrant().get_collections().collections]
+    for name in names:
+        pipeline.apply_profile(name, args.profile)
+        print(f"• {name} -> {args.profile}")
+
+
+def cmd_ask(args):
+    import rag_en
+    if not args.question:
+        rag_en.main(args.mode)
+        return
+    rag_en.setup_console()
+    answer = rag_en.rag_ask_multi(args.mode or "all", " ".join(args.question),
+                                  per_collection_k=args.k, max_chunks=args.max_chunks)
+    sys.stdout.buffer.write(answer.encode("utf-8", "replace") + b"\n")
+
+
+def cmd_batch(args):
+    import rag_batch
+    if args.each_company and args.scope:
+        print("--scope 與 --each-company 擇一")
+        sys.exit(1)
+    rag_batch.main(args.input, args.out, args.scope, args.each_company, args.k, args.max_chunks,
+                   concurrency=args.concurrency, llm_concurrency=args.llm_concurrency,
+                   llm_rps=args.llm_rps)
+
+
+def cmd_serve(args):
+    from aiohttp import web
+    import rag_service
+    web.run_app(rag_service.create_app(), host=args.host or rag_service.HOST,
+                port=args.port or rag_service.PORT)
+
+
+def cmd_ingest(args):
+    import ingest_daemon
+    ingest_daemon.main(args.dir, args.once, args.watch)
+
+
+def cmd_enrich(args):
+    if args.what == "tickers":
+        import find_ticker
+        find_ticker.main(args.input or find_ticker.INPUT_FILE,
+                         args.output or find_ticker.OUTPUT_FILE)
+    else:
+        import sector
+        sector.main(args.input or sector.INPUT_FILE, args.output or sector.OUTPUT_FILE)
+
+
+def cmd_dedup_report(args):
+    import fact_store
+    fact_store.main(args.json)
+
+
+def cmd_derive(args):
+    import derived_metrics
+    derived_metrics.main(args.full)
+
+
+def cmd_summarize(args):
+    import summary_index
+    summary_index.main(resolve_tickers(args), args.reset, args.profile)
+
+
+def cmd_route(args):
+    import query_router
+    if args.refresh_map:
+        query_router.refresh_sec_map()
+    if args.question:
+        query_router.main(" ".join(args.question))
+
+
+def cmd_llm_cache(args):
+    import json
+    import llm_cache
+    cache = llm_cache.get_cache()
+    if args.clear:
+        cache.clear()
+    elif args.evict:
+        cache.evict()
+    print(json.dumps(cache.info(), ensure_ascii=False))
+
+
+def cmd_facts(args):
+    import fact_store
+    members = None
+    if args.member:
+        if any("=" not in m or not m.split("=", 1)[0] for m in args.member):
+            args.parser.error("--member expects AXIS=MEMBER")
+        members = dict(m.split("=", 1) for m in args.member)
+    fact_store.query_main(args.ticker, args.json, concepts=args.concept or None,
+                          start=args.start, end=args.end, instant=args.instant,
+                          consolidated=args.consolidated, members=members, limit=args.limit)
+
+
+def cmd_export(args):
+    import fact_export
+    fact_export.main(None if args.all else resolve_tickers(args), args.out, args.format,
+                     args.partition, args.clean)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Financial report RAG toolkit")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("fetch", help="從 EDGAR 下載 10-K / 10-Q XBRL")
+    p.add_argument("--csv", help="ticker CSV（需含 Ticker 欄）")
+    p.add_argument("--db", action="store_true", help="直接解析並寫入 PostgreSQL（download_db）")
+    p.add_argument("--since", help="申報日窗口起點：YYYY-MM-DD、YYYY 或 YYYYQn（報告季別）")
+    p.add_argument("--until", help="申報日窗口終點（格式同 --since）；指定窗口時只抓相關的 submissions 分頁")
+    p.add_argument("--forms", default="10-Q,10-K", help="表單類型，逗號分隔")
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser("load", help="解析 XBRL_DIR 內的 XBRL 寫入 PostgreSQL")
+    p.add_argument("--csv", help="ticker CSV（預設 TICKER_CSV_PATH）")
+    p.set_defaults(func=cmd_load)
+
+    for name, func, help_text in (("extract", cmd_extract, "從 DB 拆 JSONB，顯示可讀文本"),
+                                  ("embed", cmd_embed, "chunk→embed→寫入 Qdrant")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--all", action="store_true", help="對所有 ticker table 執行")
+        p.add_argument("ticker", nargs="?", help="指定單一 ticker，例如 AAPL")
+        p.add_argument("--source", choices=["db", "parquet"],
+                       help="facts 來源（預設 FACT_SOURCE；parquet 讀取 export 的匯出檔）")
+        if name == "embed":
+            p.add_argument("--reset", action="store_true",
+                           help="先清除舊的向量資料（刪除 collection）再上傳")
+            p.add_argument("--profile", choices=PROFILE_NAMES,
+                           help="新建 collection 的 index profile（預設 QDRANT_INDEX_PROFILE）")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("reindex", help="將 index profile（量化 / on-disk / HNSW）套用到既有 collection")
+    p.add_argument("--profile", choices=PROFILE_NAMES, required=True)
+    p.add_argument("collections", nargs="*", help="未指定則套用到全部 collection")
+    p.set_defaults(func=cmd_reindex)
+
+    p = sub.add_parser("ask", help="RAG 問答；不帶問題則進入互動模式")
+    p.add_argument("--mode", help="all、company:<ticker> 或 collection name")
+    p.add_argument("--k", type=int, default=2, help="每個 collection 取回的片段數")
+    p.add_argument("--max-chunks", type=int, default=8)
+    p.add_argument("question", nargs="*")
+    p.set_defaults(func=cmd_ask)
+
+    p = sub.add_parser("batch", help="批次問答（JSONL / CSV → JSONL），中斷後重跑會略過已完成的題目")
+    p.add_argument("input", help="JSONL 或 CSV，欄位：question、mode、id、k、max_chunks")
+    p.add_argument("--out", help="輸出 JSONL（預設 <input>.answers.jsonl）")
+    p.add_argument("--scope", action="append", help="沒有 mode 的問題使用的查詢範圍，可重複指定（預設 all）")
+    p.add_argument("--each-company", action="store_true", help="沒有 mode 的問題對每家公司各問一次")
+    p.add_argument("--k", type=int, default=2, help="每個 collection 取回的片段數")
+    p.add_argument("--max-chunks", type=int, default=8)
+    p.add_argument("--concurrency", type=int, help="檢索 + LLM 的 thread 數（預設 RAG_BATCH_CONCURRENCY）")
+    p.add_argument("--llm-concurrency", type=int, help="同時送出的 LLM 請求上限（預設 RAG_BATCH_LLM_CONCURRENCY）")
+    p.add_argument("--llm-rps", type=float, help="LLM 每秒請求上限，0 不限速（預設 RAG_BATCH_LLM_RPS）")
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser("serve", help="啟動 async RAG 查詢服務")
+    p.add_argument("--host")
+    p.add_argument("--port", type=int)
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser("ingest", help="監看 XBRL 資料夾，新檔自動 parse → DB → embed → Qdrant")
+    p.add_argument("--dir", help="監看的資料夾（預設 XBRL_DIR）")
+    p.add_argument("--once", action="store_true", help="只處理現有檔案後結束")
+    p.add_argument("--watch", choices=["auto", "inotify", "poll"], default="auto")
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("enrich", help="以 yfinance 補 ticker / 產業資料")
+    p.add_argument("what", choices=["tickers", "sector"])
+    p.add_argument("--input")
+    p.add_argument("--output")
+    p.set_defaults(func=cmd_enrich)
+
+    p = sub.add_parser("dedup-report", help="跨報告 fact 去重的儲存量 / embedding 量統計")
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_dedup_report)
+
+    p = sub.add_parser("derive", help="重算衍生指標；預設只處理有新報告的 ticker")
+    p.add_argument("--full", action="store_true", help="重算所有 ticker")
+    p.set_defaults(func=cmd_derive)
+
+    p = sub.add_parser("summarize", help="由 fact 與衍生指標產生報告 / 公司摘要，寫入摘要層 collection")
+    p.add_argument("--all", action="store_true", help="對所有 ticker 執行")
+    p.add_argument("ticker", nargs="?", help="指定單一 ticker，例如 AAPL")
+    p.add_argument("--reset", action="store_true", help="刪除並重建摘要 collection")
+    p.add_argument("--profile", choices=PROFILE_NAMES,
+                   help="新建 collection 的 index profile（預設 QDRANT_INDEX_PROFILE）")
+    p.set_defaults(func=cmd_summarize)
+
+    p = sub.add_parser("route", help="顯示問題的路由結果（公司 / 期間 → collection）")
+    p.add_argument("--refresh-map", action="store_true",
+                   help="下載 SEC company_tickers.json 到 SEC_TICKER_MAP")
+    p.add_argument("question", nargs="*")
+    p.set_defaults(func=cmd_route)
+
+    p = sub.add_parser("llm-cache", help="LLM 回應快取統計；--evict 淘汰過期 / 超量項目，--clear 清空")
+    p.add_argument("--evict", action="store_true")
+    p.add_argument("--clear", action="store_true")
+    p.set_defaults(func=cmd_llm_cache)
+
+    p = sub.add_parser("facts", help="以結構化期間 / 維度條件查詢 fact（xbrl.fact 索引欄位）")
+    p.add_argument("ticker")
+    p.add_argument("--concept", action="append", help="us-gaap concept，可重複指定")
+    p.add_argument("--from", dest="start", help="期間起日（含），YYYY-MM-DD")
+    p.add_argument("--to", dest="end", help="期間迄日（含），YYYY-MM-DD")
+    kind = p.add_mutually_exclusive_group()
+    kind.add_argument("--instant", dest="instant", action="store_const", const=True,
+                      help="只取 instant（時點）fact")
+    kind.add_argument("--duration", dest="instant", action="store_const", const=False,
+                      help="只取 duration（期間）fact")
+    dims = p.add_mutually_exclusive_group()
+    dims.add_argument("--consolidated", dest="consolidated", action="store_const", const=True,
+                      help="只取無維度的合併數")
+    dims.add_argument("--segments", dest="consolidated", action="store_const", const=False,
+                      help="只取有維度（segment / member）的 fact")
+    p.add_argument("--member", action="append", metavar="AXIS=MEMBER",
+                   help="維度條件，例如 ProductOrServiceAxis=ServiceMember，可重複指定")
+    p.add_argument("--limit", type=int)
+    p.add_argument("--json", action="store_true")
+    p.set_defaults(func=cmd_facts, parser=p)
+
+    p = sub.add_parser("export", help="facts 與衍生指標匯出成欄式檔案（Parquet / Arrow IPC）")
+    p.add_argument("--all", action="store_true", help="匯出所有 ticker table")
+    p.add_argument("--format", choices=["parquet", "arrow"], default="parquet")
+    p.add_argument("--partition", choices=["ticker", "year"], default="ticker")
+    p.add_argument("--out", help="輸出目錄（預設 FACT_EXPORT_DIR）")
+    p.add_argument("--clean", action="store_true", help="先清空輸出目錄")
+    p.add_argument("ticker", nargs="?", help="指定單一 ticker，例如 AAPL")
+    p.set_defaults(func=cmd_export)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
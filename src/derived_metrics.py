@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# 衍生指標：成長率、利潤率、流動比率、槓桿等，預先算好存入 xbrl.metric
+#
+# 讀取 fact_store 去重後的 fact（無維度的合併數），以 pandas 一次對所有 ticker / 期間向量化計算，
+# 只重算 fact 數量有變動的 ticker（新報告進來時），結果以長表存放：
+#
+#   xbrl.metric        (ticker, period_end, span, metric) → value，並記錄該期間所屬的 report
+#   xbrl.metric_state  每個 ticker 上次計算時的 fact 參照數
+#
+# pipeline 會把每份報告的指標組成精簡文字 chunk 一起 embed，rag_en 檢索時優先放入 prompt，
+# LLM 不必再自行從原始 fact 計算。
+import argparse
+from psycopg2.extras import execute_values
+from metrics import span, inc
+from fact_store import SCHEMA
+
+# 標準化名稱 → 依優先序的 us-gaap concept
+CONCEPTS = {
+    "revenue": ["Revenues", "RevenueFromContractWithCustomerExcludingAssessedTax",
+                "SalesRevenueNet", "RevenueFromContractWithCustomerIncludingAssessedTax"],
+    "cost_of_revenue": ["CostOfRevenue", "CostOfGoodsAndServicesSold"],
+    "gross_profit": ["GrossProfit"],
+    "operating_income": ["OperatingIncomeLoss"],
+    "net_income": ["NetIncomeLoss", "ProfitLoss"],
+    "eps": ["EarningsPerShareBasic"],
+    "assets": ["Assets"],
+    "assets_current": ["AssetsCurrent"],
+    "liabilities": ["Liabilities"],
+    "liabilities_current": ["LiabilitiesCurrent"],
+    "equity": ["StockholdersEquity",
+               "StockholdersEquityIncludingPortionAttributableToNoncontrollingInterest"],
+    "cash": ["CashAndCashEquivalentsAtCarryingValue"],
+}
+INSTANT = {"assets", "assets_current", "liabilities", "liabilities_current", "equity", "cash"}
+GROWTH = ["revenue", "operating_income", "net_income", "eps"]
+
+# metric → (顯示名稱, 格式)；pct 以百分比顯示
+METRICS = {
+    "revenue_yoy": ("Revenue growth YoY", "pct"),
+    "revenue_qoq": ("Revenue growth QoQ", "pct"),
+    "operating_income_yoy": ("Operating income growth YoY", "pct"),
+    "operating_income_qoq": ("Operating income growth QoQ", "pct"),
+    "net_income_yoy": ("Net income growth YoY", "pct"),
+    "net_income_qoq": ("Net income growth QoQ", "pct"),
+    "eps_yoy": ("EPS growth YoY", "pct"),
+    "eps_qoq": ("EPS growth QoQ", "pct"),
+    "gross_margin": ("Gross margin", "pct"),
+    "operating_margin": ("Operating margin", "pct"),
+    "net_margin": ("Net margin", "pct"),
+    "return_on_equity": ("Return on equity", "pct"),
+    "current_ratio": ("Current ratio", "x"),
+    "cash_ratio": ("Cash ratio", "x"),
+    "debt_to_equity": ("Liabilities to equity", "x"),
+    "debt_to_assets": ("Liabilities to assets", "pct"),
+}
+SPAN_LABEL = {"Q": "quarter", "FY": "fiscal year"}
+
+
+def ensure_schema(cur):
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.metric (
+            ticker     VARCHAR NOT NULL,
+            period_end DATE NOT NULL,
+            span       VARCHAR(2) NOT NULL,
+            metric     VARCHAR NOT NULL,
+            value      DOUBLE PRECISION NOT NULL,
+            report     VARCHAR,
+            PRIMARY KEY (ticker, period_end, span, metric)
+        );
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.metric_state (
+            ticker       VARCHAR PRIMARY KEY,
+            fact_refs    INTEGER NOT NULL,
+            refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+
+# fact 參照數有變動（或從未計算）的 ticker
+def stale_tickers(cur, full: bool = False) -> list[str]:
+    cur.execute(f"""
+        SELECT rf.ticker, count(*), s.fact_refs
+        FROM {SCHEMA}.report_fact rf
+        LEFT JOIN {SCHEMA}.metric_state s ON s.ticker = rf.ticker
+        GROUP BY rf.ticker, s.fact_refs
+    """)
+    return [tk for tk, refs, done in cur.fetchall() if full or refs != done]
+
+
+def load_facts(cur, tickers: list[str]):
+    import pandas as pd
+    alias = {c: name for name, cs in CONCEPTS.items() for c in cs}
+    with span("db.query", query="metric_facts"):
+        cur.execute(f"""
+            SELECT ticker, concept, period, value FROM {SCHEMA}.fact
+            WHERE dims = '' AND ticker = ANY(%s) AND concept = ANY(%s)
+        """, (tickers, list(alias)))
+        df = pd.DataFrame(cur.fetchall(), columns=["ticker", "concept", "period", "value"])
+        cur.execute(f"""
+            SELECT ticker, report, max(f.period_end)
+            FROM {SCHEMA}.report_fact rf JOIN {SCHEMA}.fact f USING (ticker, fact_key)
+            WHERE ticker = ANY(%s) GROUP BY ticker, report
+        """, (tickers,))
+        reports = pd.DataFrame(cur.fetchall(), columns=["ticker", "report", "end"])
+    return prepare(df, reports)
+
+
+# df: (ticker, concept, period, value)、reports: (ticker, report, end)；DB 與 fact_export 的 Parquet 共用
+def prepare(df, reports):
+    import pandas as pd
+    alias = {c: name for name, cs in CONCEPTS.items() for c in cs}
+    df["name"] = df["concept"].map(alias)
+    df["priority"] = [CONCEPTS[n].index(c) for n, c in zip(df["name"], df["concept"])]
+    df["value"] = pd.to_numeric(df["value"], errors="coerce")
+    reports["end"] = pd.to_datetime(reports["end"], errors="coerce")
+    return df.dropna(subset=["value"]), reports
+
+
+# 每個 (ticker, 期末日, span) 一列的標準化數字：Q / FY 的流量數與同日的時點數（summary_index 共用）
+def figures(df):
+    import numpy as np
+    import pandas as pd
+    period = df["period"].str.split("/", n=1, expand=True).reindex(columns=[0, 1])
+    instant = period[1].isna()
+    df["end"] = pd.to_datetime(period[1].fillna(period[0]), errors="coerce")
+    start = pd.to_datetime(period[0].where(~instant), errors="coerce")
+    days = (df["end"] - start).dt.days
+    df["span"] = np.select([instant, days.between(80, 100), days.between(350, 380)],
+                           ["I", "Q", "FY"], default="YTD")
+
+    # 同一期間若有多個同義 concept，取優先序最前者
+    df = df.sort_values("priority").drop_duplicates(["ticker", "end", "span", "name"])
+    flows = df[df["span"].isin(["Q", "FY"]) & ~df["name"].isin(INSTANT)].pivot_table(
+        index=["ticker", "end", "span"], columns="name", values="value", aggfunc="first")
+    stocks = df[(df["span"] == "I") & df["name"].isin(INSTANT)].pivot_table(
+        index=["ticker", "end"], columns="name", values="value", aggfunc="first")
+    frame = flows.reset_index().merge(stocks.reset_index(), on=["ticker", "end"], how="left")
+    for col in CONCEPTS:
+        if col not in frame:
+            frame[col] = np.nan
+    return frame
+
+
+def compute(df, reports):
+    import numpy as np
+    import pandas as pd
+    if df.empty:
+        return pd.DataFrame(columns=["ticker", "period_end", "span", "metric", "value", "report"])
+    frame = figures(df)
+
+    def ratio(a, b):
+        return (a / b).replace([np.inf, -np.inf], np.nan)
+
+    gross = frame["gross_profit"].fillna(frame["revenue"] - frame["cost_of_revenue"])
+    equity = frame["equity"].fillna(frame["assets"] - frame["liabilities"])
+    out = pd.DataFrame({
+        "gross_margin": ratio(gross, frame["revenue"]),
+        "operating_margin": ratio(frame["operating_income"], frame["revenue"]),
+        "net_margin": ratio(frame["net_income"], frame["revenue"]),
+        "return_on_equity": ratio(frame["net_income"], equity).where(frame["span"] == "FY"),
+        "current_ratio": ratio(frame["assets_current"], frame["liabilities_current"]),
+        "cash_ratio": ratio(frame["cash"], frame["liabilities_current"]),
+        "debt_to_equity": ratio(frame["liabilities"], equity),
+        "debt_to_assets": ratio(frame["liabilities"], frame["assets"]),
+    })
+
+    # QoQ：同 ticker 上一個季度（間隔約 3 個月才算）
+    frame = frame.sort_values(["ticker", "span", "end"])
+    prev = frame.groupby(["ticker", "span"])[GROWTH + ["end"]].shift(1)
+    consecutive = (frame["span"] == "Q") & ((frame["end"] - prev["end"]).dt.days.between(80, 100))
+    # YoY：同 ticker、同 span，期末日約早一年的期間
+    left = frame[["ticker", "span", "end"]].assign(target=frame["end"] - pd.Timedelta(days=365))
+    right = frame[["ticker", "span", "end"] + GROWTH].rename(columns={"end": "target"})
+    year_ago = pd.merge_asof(left.reset_index().sort_values("target"), right.sort_values("target"),
+                             on="target", by=["ticker", "span"], direction="nearest",
+                             tolerance=pd.Timedelta(days=15)).set_index("index")
+    for col in GROWTH:
+        out[f"{col}_qoq"] = ratio(frame[col] - prev[col], prev[col].abs()).where(consecutive)
+        out[f"{col}_yoy"] = ratio(frame[col] - year_ago[col], year_ago[col].abs())
+
+    out[["ticker", "period_end", "span"]] = frame[["ticker", "end", "span"]]
+    long = out.melt(id_vars=["ticker", "period_end", "span"], var_name="metric").dropna(subset=["value"])
+    owners = (reports.sort_values("report").drop_duplicates(["ticker", "end"])
+              .rename(columns={"end": "period_end"}))
+    return long.merge(owners, on=["ticker", "period_end"], how="left")
+
+
+# 重算 stale ticker 的指標；回傳寫入的列數
+def refresh(cur, full: bool = False) -> int:
+    ensure_schema(cur)
+    cur.execute("SELECT to_regclass(%s)", (f"{SCHEMA}.report_fact",))
+    if cur.fetchone()[0] is None:
+        return 0
+    tickers = stale_tickers(cur, full)
+    if not tickers:
+        return 0
+    with span("metrics.derive") as sp:
+        df, reports = load_facts(cur, tickers)
+        result = compute(df, reports)
+        sp.set(tickers=len(tickers), facts=len(df), metrics=len(result))
+    with span("db.write", table="xbrl.metric"):
+        cur.execute(f"DELETE FROM {SCHEMA}.metric WHERE ticker = ANY(%s)", (tickers,))
+        execute_values(cur, f"""
+            INSERT INTO {SCHEMA}.metric (ticker, period_end, span, metric, value, report) VALUES %s
+        """, [(r.ticker, r.period_end.date(), r.span, r.metric, float(r.value),
+               r.report if isinstance(r.report, str) else None)
+              for r in result.itertuples(index=False)], page_size=1000)
+        cur.execute(f"""
+            INSERT INTO {SCHEMA}.metric_state (ticker, fact_refs, refreshed_at)
+            SELECT ticker, count(*), now() FROM {SCHEMA}.report_fact
+            WHERE ticker = ANY(%s) GROUP BY ticker
+            ON CONFLICT (ticker) DO UPDATE SET fact_refs = EXCLUDED.fact_refs,
+                                               refreshed_at = EXCLUDED.refreshed_at
+        """, (tickers,))
+    inc("derived_metrics_total", len(result))
+    print(f"[INFO] 衍生指標：{len(tickers)} 支 ticker，{len(result)} 筆")
+    return len(result)
+
+
+def format_value(metric: str, value: float) -> str:
+    if METRICS[metric][1] == "pct":
+        return f"{value * 100:+.2f}%" if metric.endswith(("_yoy", "_qoq")) else f"{value * 100:.2f}%"
+    return f"{value:.2f}"
+
+
+# 每份報告的指標文字 chunk：{report: text}
+def report_metrics(cur, ticker: str) -> dict:
+    cur.execute("SELECT to_regclass(%s)", (f"{SCHEMA}.metric",))
+    if cur.fetchone()[0] is None:
+        return {}
+    with span("db.query", query="report_metrics"):
+        cur.execute(f"""
+            SELECT report, period_end, span, metric, value FROM {SCHEMA}.metric
+            WHERE ticker = %s AND report IS NOT NULL
+            ORDER BY report, span DESC, metric
+        """, (ticker.lower(),))
+        return metric_texts(cur.fetchall())
+
+
+# rows: (report, period_end, span, metric, value)，依 report、span DESC、metric 排序
+def metric_texts(rows) -> dict:
+    grouped = {}
+    for report, end, sp, metric, value in rows:
+        grouped.setdefault((report, end, sp), []).append((metric, value))
+    order = {m: i for i, m in enumerate(METRICS)}
+    texts = {}
+    for (report, end, sp), values in grouped.items():
+        lines = [f"Derived metrics: {report} ({SPAN_LABEL.get(sp, sp)} ended {end:%Y-%m-%d})"]
+        lines += [f"{METRICS[m][0]}: {format_value(m, v)}"
+                  for m, v in sorted(values, key=lambda x: order.get(x[0], 99)) if m in METRICS]
+        texts[report] = (texts[report] + "\n" if report in texts else "") + "\n".join(lines)
+    return texts
+
+
+def main(full: bool = False):
+    import psycopg2
+    from pipeline import DB_PARAMS
+    conn = psycopg2.connect(**DB_PARAMS)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            refresh(cur, full)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="計算衍生指標（成長率、利潤率、比率）")
+    parser.add_argument("--full", action="store_true", help="忽略狀態，重算所有 ticker")
+    main(parser.parse_args().full)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# EDGAR client：edgar_fetcher 與 download_db 共用的 SEC 請求、CIK 對照、filings 列舉與報告季別
+#
+# get_filings 可指定申報日窗口（since / until）與表單類型：
+# - 窗口可寫成日期（2023-05-01）、年（2023）或報告季別（2023Q2，與 get_quarter / collection 名稱相同）
+# - submissions 主檔的 recent 區塊已涵蓋窗口時不再讀分頁；否則依各分頁的 filingFrom / filingTo
+#   只抓與窗口重疊的分頁，並以 SEC_PAGE_CONCURRENCY 個 thread 同時抓取
+# - 不指定窗口時維持原本行為：依序讀分頁直到湊滿 min_count 筆
+# 所有請求共用同一個節流（每 SEC_REQUEST_DELAY 秒最多一個），多 thread 時也不會超過 SEC 速率限制。
+import os
+import re
+import time
+import threading
+import requests
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from metrics import span, inc
+
+HEADERS = {"User-Agent": "Your Name your@email.com"}
+
+# SEC 端點與節流秒數可由環境變數覆寫（benchmark 會指向本機假伺服器）
+SEC_WWW_URL = os.getenv('SEC_WWW_URL', 'https://www.sec.gov')
+SEC_DATA_URL = os.getenv('SEC_DATA_URL', 'https://data.sec.gov')
+REQUEST_DELAY = float(os.getenv('SEC_REQUEST_DELAY', '0.2'))
+PAGE_CONCURRENCY = int(os.getenv('SEC_PAGE_CONCURRENCY', '4'))
+
+CIK_URL = SEC_WWW_URL + "/files/company_tickers.json"
+BASE_SUB_URL = SEC_DATA_URL + "/submissions/CIK{}.json"
+BASE_ARCHIVE_URL = SEC_WWW_URL + "/Archives/edgar/data"
+FORMS = ('10-Q', '10-K')
+
+PERIOD_RE = re.compile(r"^(\d{4})(?:Q([1-4]))?$", re.I)
+
+_throttle_lock = threading.Lock()
+_next_at = 0.0
+_cik_map = None
+
+
+# 全域節流：預約下一個可送出的時間點，多 thread 同時呼叫時依序錯開
+def throttle():
+    global _next_at
+    if REQUEST_DELAY <= 0:
+        return
+    with _throttle_lock:
+        now = time.monotonic()
+        slot = max(now, _next_at)
+        _next_at = slot + REQUEST_DELAY
+    if slot > now:
+        time.sleep(slot - now)
+
+
+# 所有 SEC 請求都經過這裡：記錄 span / 狀態碼並節流
+def sec_get(url, endpoint):
+    throttle()
+    with span("sec.http", endpoint=endpoint) as sp:
+        resp = requests.get(url, headers=HEADERS)
+        sp.set(url=url, status=resp.status_code, bytes=len(resp.content))
+    inc("sec_http_requests_total", endpoint=endpoint, status=resp.status_code)
+    return resp
+
+
+def load_cik_map():
+    resp = sec_get(CIK_URL, "company_tickers")
+    resp.raise_for_status()
+    data = resp.json()
+    # 對 CIK 左側補零至 10 位
+    return {item['ticker'].lower(): str(item['cik_str']).zfill(10) for item in data.values()}
+
+
+# cik_map 未指定時，整個程序只下載一次 company_tickers.json
+def get_cik(ticker, cik_map=None):
+    global _cik_map
+    if cik_map is None:
+        if _cik_map is None:
+            _cik_map = load_cik_map()
+        cik_map = _cik_map
+    return cik_map.get(ticker.lower())
+
+
+# 申報日 → 報告季別（1–3 月申報的是前一年 Q4）
+def get_quarter(filing_date_str):
+    dt = datetime.strptime(filing_date_str, "%Y-%m-%d")
+    m, y = dt.month, dt.year
+    if m in (4, 5, 6):
+        return f"{y}Q1"
+    if m in (7, 8, 9):
+        return f"{y}Q2"
+    if m in (10, 11, 12):
+        return f"{y}Q3"
+    return f"{y-1}Q4"
+
+
+# 報告季別 / 年 → 對應的申報日範圍（get_quarter 的反函數）
+def period_range(value: str) -> tuple[date, date]:
+    m = PERIOD_RE.match(value.strip())
+    if not m:
+        raise ValueError(f"無法解析期間：{value!r}（請用 YYYY-MM-DD、YYYY 或 YYYYQn）")
+    y, q = int(m.group(1)), int(m.group(2) or 0)
+    first, last = (q, q) if q else (1, 4)
+    # YYYYQn 於下一季申報：Q1 → 4–6 月、…、Q4 → 隔年 1–3 月
+    start = date(y + first // 4, first % 4 * 3 + 1, 1)
+    end_y, end_m = y + last // 4, last % 4 * 3 + 3
+    end = date(end_y + end_m // 12, end_m % 12 + 1, 1) - timedelta(days=1)
+    return start, end
+
+
+# since / until → ISO 申報日字串（可直接與 submissions 內的日期字串比較）
+def parse_window(since=None, until=None) -> tuple:
+    def bound(value, idx):
+        if not value:
+            return None
+        value = str(value)
+        if re.match(r"^\d{4}-\d{2}-\d{2}$", value):
+            return value
+        return period_range(value)[idx].isoformat()
+    lo, hi = bound(since, 0), bound(until, 1)
+    if lo and hi and lo > hi:
+        raise ValueError(f"期間起點 {since} 晚於終點 {until}")
+    return lo, hi
+
+
+def in_window(filing_date: str, lo, hi) -> bool:
+    return (not lo or filing_date >= lo) and (not hi or filing_date <= hi)
+
+
+# 分頁的 filingFrom / filingTo 與窗口不重疊就不必下載；缺少 metadata 的分頁保守地視為相關
+def page_overlaps(page: dict, lo, hi) -> bool:
+    start, end = page.get('filingFrom'), page.get('filingTo')
+    if lo and end and end < lo:
+        return False
+    if hi and start and start > hi:
+        return False
+    return True
+
+
+# 萃取 helper（支援 main.recent 或 page root）
+def extract_filings(block: dict, cik, forms=FORMS) -> list[dict]:
+    fld = block.get('filings', {}).get('recent', block)
+    out = []
+    for i, form in enumerate(fld.get('form', [])):
+        if form in forms:
+            acc = fld['accessionNumber'][i]
+            no_dash = acc.replace('-', '')
+            out.append({
+                'accessionNumber': acc,
+                'reportDate':      fld['reportDate'][i],
+                'filingDate':      fld['filingDate'][i],
+                'filingURL':       f"{BASE_ARCHIVE_URL}/{int(cik)}/{no_dash}/index.json",
+                'form':            form
+            })
+    return out
+
+
+def fetch_page(cik, page: dict, forms=FORMS) -> list[dict]:
+    pr = sec_get(f"{SEC_DATA_URL}/submissions/{page['name']}", "submissions_page")
+    if pr.status_code != 200:
+        return []
+    return extract_filings(pr.json(), cik, forms)
+
+
+def get_filings(cik, since=None, until=None, forms=FORMS, min_count=40):
+    lo, hi = parse_window(since, until)
+    windowed = bool(lo or hi)
+    resp = sec_get(BASE_SUB_URL.format(cik), "submissions")
+    if resp.status_code != 200:
+        return []
+    data_main = resp.json()
+    with span("sec.filings", windowed=windowed) as sp:
+        filings = extract_filings(data_main, cik, forms)
+        pages = [p for p in data_main.get('filings', {}).get('files', []) if p.get('name')]
+        if windowed:
+            # recent 區塊最舊一筆已早於窗口起點：更舊的分頁都不需要
+            recent_dates = data_main.get('filings', {}).get('recent', {}).get('filingDate', [])
+            if lo and recent_dates and min(recent_dates) < lo:
+                wanted = []
+            else:
+                wanted = [p for p in pages if page_overlaps(p, lo, hi)]
+            if wanted:
+                with ThreadPoolExecutor(max_workers=max(1, min(PAGE_CONCURRENCY, len(wanted))),
+                                        thread_name_prefix="sec-page") as pool:
+                    for chunk in pool.map(lambda p: fetch_page(cik, p, forms), wanted):
+                        filings += chunk
+            filings = [f for f in filings if in_window(f['filingDate'], lo, hi)]
+        else:
+            # 不足 min_count 時依序往分頁檔繼續抓
+            wanted = []
+            for page in pages:
+                if len(filings) >= min_count:
+                    break
+                wanted.append(page)
+                filings += fetch_page(cik, page, forms)
+        sp.set(pages=len(pages), fetched=len(wanted), filings=len(filings))
+    inc("sec_submission_pages_skipped_total", len(pages) - len(wanted))
+
+    # 去重並依申報日排序
+    seen = set()
+    unique = []
+    for f in sorted(filings, key=lambda x: x['filingDate'], reverse=True):
+        if f['accessionNumber'] not in seen:
+            unique.append(f)
+            seen.add(f['accessionNumber'])
+    return unique
@@ -0,0 +1,162 @@
+# Embedding backend：pipeline、rag_en、rag_service 共用
+#
+#   EMBED_BACKEND=ollama  透過 Ollama HTTP（預設；優先使用批次 /api/embed，舊版退回 /api/embeddings）
+#   EMBED_BACKEND=onnx    在本機 CPU 以 ONNX Runtime 執行 nomic 相容模型，不需 Ollama
+#
+# ONNX backend 需要 ONNX_MODEL_DIR 內的 model.onnx 與 tokenizer.json
+# （例如 nomic-ai/nomic-embed-text-v1.5 的 onnx/model.onnx），以及 onnxruntime、tokenizers 套件。
+# 兩個 backend 都回傳 L2 正規化的 float32 NumPy 陣列 (n, dim)。
+import os
+
+from metrics import span, inc
+
+EMBED_BACKEND = os.getenv('EMBED_BACKEND', 'ollama')
+EMBED_MODEL = os.getenv('EMBED_MODEL', 'nomic-embed-text')
+OLLAMA_URL = os.getenv('OLLAMA_URL') or os.getenv(
+    'OLLAMA_EMBED_API_URL', 'http://localhost:11434/api/embeddings').rsplit('/api/', 1)[0]
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '32'))
+ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', '../models/nomic-embed-text-v1.5')
+EMBED_THREADS = int(os.getenv('EMBED_THREADS', '0'))          # 0 = ONNX Runtime 自行決定
+EMBED_MAX_TOKENS = int(os.getenv('EMBED_MAX_TOKENS', '2048'))
+EMBED_MAX_BATCH_TOKENS = int(os.getenv('EMBED_MAX_BATCH_TOKENS', '16384'))
+
+
+def normalize(vecs):
+    import numpy as np
+    vecs = np.asarray(vecs, dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs / np.maximum(norms, 1e-12)
+
+
+class OllamaEmbedder:
+    name = 'ollama'
+
+    def __init__(self, url: str = OLLAMA_URL, model: str = EMBED_MODEL,
+                 batch_size: int = EMBED_BATCH_SIZE):
+        import requests
+        self.url = url.rstrip('/')
+        self.model = model
+        self.batch_size = batch_size
+        self.session = requests.Session()
+        self.batch_api = True
+        self.dim = 0             # 第一次 embed 後才知道向量維度
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        if self.batch_api:
+            resp = self.session.post(f"{self.url}/api/embed",
+                                     json={"model": self.model, "input": texts})
+            if resp.status_code != 404:
+                resp.raise_for_status()
+                return resp.json()["embeddings"]
+            # 舊版 Ollama 沒有 /api/embed
+            self.batch_api = False
+        out = []
+        for text in texts:
+            resp = self.session.post(f"{self.url}/api/embeddings",
+                                     json={"model": self.model, "prompt": text})
+            resp.raise_for_status()
+            # Ollama 回傳的欄位是 "embedding"
+            out.append(resp.json()["embedding"])
+        return out
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+        # 空輸入不呼叫 Ollama，回傳 (0, dim) 的陣列
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vecs = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            with span("embed.batch", backend=self.name) as sp:
+                vecs.extend(self._embed_batch(batch))
+                sp.set(texts=len(batch), chars=sum(len(t) for t in batch))
+            inc("embed_texts_total", len(batch), backend=self.name)
+        vecs = normalize(vecs)
+        self.dim = vecs.shape[1]
+        return vecs
+
+
+class OnnxEmbedder:
+    name = 'onnx'
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, threads: int = EMBED_THREADS,
+                 max_tokens: int = EMBED_MAX_TOKENS, max_batch: int = EMBED_BATCH_SIZE,
+                 max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, 'model.onnx')
+        if not os.path.exists(model_path):
+            model_path = os.path.join(model_dir, 'onnx', 'model.onnx')
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=opts,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # 輸出的最後一維即向量維度（symbolic 時為字串，等第一次 embed 再取得）
+        dim = self.session.get_outputs()[0].shape[-1]
+        self.dim = dim if isinstance(dim, int) else 0
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=max_tokens)
+        self.max_batch = max_batch
+        self.max_batch_tokens = max_batch_tokens
+
+    def _run(self, encodings):
+        import numpy as np
+        width = max(len(e.ids) for e in encodings)
+        ids = np.zeros((len(encodings), width), dtype=np.int64)
+        mask = np.zeros_like(ids)
+        for row, e in enumerate(encodings):
+            ids[row, :len(e.ids)] = e.ids
+            mask[row, :len(e.ids)] = 1
+        feeds = {'input_ids': ids, 'attention_mask': mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.zeros_like(ids)
+        hidden = self.session.run(None, feeds)[0]
+        # mean pooling（與 Ollama 的 nomic-embed-text 相同），之後統一 L2 正規化
+        m = mask[:, :, None].astype(np.float32)
+        return (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+
+    def embed(self, texts: list[str]):
+        import numpy as np
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        encodings = self.tokenizer.encode_batch(texts)
+        # 動態批次：依長度排序，讓同批 padding 最少，並以 token 預算限制批次大小
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        out = [None] * len(texts)
+        batch = []
+        for i in order + [None]:
+            if i is not None:
+                width = len(encodings[i].ids)
+                if not batch or (len(batch) < self.max_batch
+                                 and width * (len(batch) + 1) <= self.max_batch_tokens):
+                    batch.append(i)
+                    continue
+            with span("embed.batch", backend=self.name) as sp:
+                vecs = self._run([encodings[j] for j in batch])
+                sp.set(texts=len(batch), tokens=sum(len(encodings[j].ids) for j in batch))
+            inc("embed_texts_total", len(batch), backend=self.name)
+            for j, v in zip(batch, vecs):
+                out[j] = v
+            batch = [i] if i is not None else []
+        vecs = normalize(np.stack(out))
+        self.dim = vecs.shape[1]
+        return vecs
+
+
+BACKENDS = {'ollama': OllamaEmbedder, 'onnx': OnnxEmbedder}
+_embedders = {}
+
+
+# 依名稱取得（並快取）embedding backend
+def get_embedder(backend: str = None):
+    backend = backend or EMBED_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的 EMBED_BACKEND: {backend}（可用：{', '.join(BACKENDS)}）")
+    if backend not in _embedders:
+        _embedders[backend] = BACKENDS[backend]()
+    return _embedders[backend]
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+# facts 語料的欄式匯出（Parquet / Arrow IPC）與 memory-mapped 讀取
+#
+# 每個 ticker 匯出成一個檔案（依 --partition 放在 facts/ticker=<tk>/ 或 facts/year=<YYYY>/ 下），
+# 每列是一個 (report, fact) 參照：
+#
+#   ticker / report / owner / concept / period / dims / unit / decimals   dictionary-encoded 字串
+#   seq            報告文本中的順序
+#   fact_key       fact_store 的 sha1（20 bytes；舊格式 JSONB 報告為 null）
+#   value          原始文字；value_num 為 float64（非數值為 null）
+#   period_start / period_end   date32（instant 與舊格式報告的 start 為 null）
+#   year           報告年度（取自 report 名稱）
+#
+# owner = report 的列即該報告擁有的 fact（fact_store.assign_owners），其餘列是前期比較數的參照，
+# 因此 extract_reports() 重建出的文本與從 PostgreSQL 取出的完全相同（content_hash 不變，不會重新 embed）。
+# 衍生指標另存於 metric/<tk>.*。讀取時以 memory map 開檔，全語料掃描不必連 DB：
+#
+#   python fact_export.py --all --format parquet --partition ticker
+#   FACT_SOURCE=parquet python pipeline.py upsert --all
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+from datetime import datetime, timezone
+from psycopg2 import sql
+from metrics import span, inc
+import fact_store
+import derived_metrics
+
+FACT_EXPORT_DIR = os.getenv('FACT_EXPORT_DIR', '../parquet')
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+PARTITIONS = ['ticker', 'year']
+DICT_COLUMNS = ['ticker', 'report', 'owner', 'concept', 'period', 'dims', 'unit', 'decimals']
+YEAR_RE = re.compile(r'_(\d{4})')
+MANIFEST = '_manifest.json'
+
+
+def schema():
+    import pyarrow as pa
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('ticker', text), ('report', text), ('owner', text), ('seq', pa.int32()),
+        ('fact_key', pa.binary(20)), ('concept', text), ('period', text),
+        ('period_start', pa.date32()), ('period_end', pa.date32()), ('dims', text),
+        ('unit', text), ('decimals', text), ('value', pa.string()), ('value_num', pa.float64()),
+        ('year', pa.int16()),
+    ])
+
+
+def metric_schema():
+    import pyarrow as pa
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('ticker', text), ('report', text), ('period_end', pa.date32()), ('span', text),
+        ('metric', text), ('value', pa.float64()),
+    ])
+
+
+def report_year(report: str):
+    m = YEAR_RE.search(report)
+    return int(m.group(1)) if m else None
+
+
+# 一個 ticker 的所有 (report, fact) 參照，依報告文本順序
+def ticker_rows(cur, ticker: str) -> list[tuple]:
+    with span("db.query", query="export_reports"):
+        cur.execute(sql.SQL("SELECT report, facts FROM {}").format(sql.Identifier(ticker)))
+        reports = cur.fetchall()
+    rows, deduped, owner_of, refs = [], None, None, None
+    for report, facts_jsonb in reports:
+        if facts_jsonb is not None:
+            # 舊格式（FACT_DEDUP=0）：整份 JSONB，沒有期間資訊
+            for seq, (tag, props) in enumerate(facts_jsonb.items()):
+                rows.append((report, report, seq, None, tag, '', '',
+                             props.get('unitRef') or props.get('unit') or '',
+                             props.get('decimals'), props.get('value', '')))
+            continue
+        if deduped is None:
+            refs = fact_store.fetch_ticker_facts(cur, ticker)
+            deduped, _ = fact_store.assign_owners(refs)
+            owner_of = {f['fact_key']: r for r, facts in deduped.items() for f in facts}
+        owned = deduped.get(report, [])
+        for seq, f in enumerate(owned):
+            rows.append((report, report, seq, f['fact_key'], f['concept'], f['period'], f['dims'],
+                         f['unit'], f['decimals'], f['value']))
+        seq = len(owned)
+        for r, key, concept, period, dims, unit, value, decimals in refs:
+            if r == report and owner_of[key] != report:
+                rows.append((report, owner_of[key], seq, key, concept, period, dims,
+                             unit, decimals, value))
+                seq += 1
+    return rows
+
+
+def build_table(ticker: str, rows: list[tuple]):
+    import pyarrow as pa
+    import pandas as pd
+    cols = list(zip(*rows)) if rows else [()] * 10
+    report, owner, seq, key, concept, period, dims, unit, decimals, value = cols
+    periods = pd.Series(period, dtype=object).str.split('/', n=1, expand=True).reindex(columns=[0, 1])
+    instant = periods[1].isna()
+    start = pd.to_datetime(periods[0].where(~instant), errors='coerce')
+    end = pd.to_datetime(periods[1].fillna(periods[0]), errors='coerce')
+    arrays = {
+        'ticker': [ticker] * len(rows), 'report': report, 'owner': owner, 'seq': seq,
+        'fact_key': [bytes.fromhex(k) if k else None for k in key],
+        'concept': concept, 'period': period,
+        'period_start': start.dt.date.where(start.notna(), None),
+        'period_end': end.dt.date.where(end.notna(), None),
+        'dims': dims, 'unit': unit, 'decimals': decimals, 'value': value,
+        'value_num': pd.to_numeric(pd.Series(value, dtype=object), errors='coerce'),
+        'year': [report_year(r) for r in report],
+    }
+    out = schema()
+    return pa.table([
+        pa.array(arrays[f.name], pa.string()).dictionary_encode() if f.name in DICT_COLUMNS
+        else pa.array(arrays[f.name], f.type, from_pandas=True)
+        for f in out], schema=out)
+
+
+def write_table(table, path: str, fmt: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    if fmt == 'parquet':
+        pq.write_table(table, tmp, compression='zstd', use_dictionary=True, write_statistics=True)
+    else:
+        # Arrow IPC 不壓縮，讀取時可直接 memory map 零複製
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table.combine_chunks())
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def ticker_files(kind: str, ticker: str, root: str = None) -> list[str]:
+    root = root or FACT_EXPORT_DIR
+    pattern = os.path.join(root, kind, '*', f'{ticker}.*') if kind == 'facts' else \
+        os.path.join(root, kind, f'{ticker}.*')
+    return sorted(p for p in glob.glob(pattern) if not p.endswith('.tmp'))
+
+
+def load_manifest(root: str = None) -> dict:
+    path = os.path.join(root or FACT_EXPORT_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def export_ticker(cur, ticker: str, root: str, fmt: str, partition: str) -> dict:
+    import pyarrow.compute as pc
+    ext = FORMATS[fmt]
+    with span("export.facts") as sp:
+        table = build_table(ticker, ticker_rows(cur, ticker))
+        for old in ticker_files('facts', ticker, root) + ticker_files('metric', ticker, root):
+            os.remove(old)
+        size = 0
+        if partition == 'ticker':
+            size += write_table(table, os.path.join(root, 'facts', f'ticker={ticker}', ticker + ext), fmt)
+        else:
+            for year in pc.unique(table['year']).to_pylist():
+                part = table.filter(pc.equal(table['year'], year) if year is not None
+                                    else pc.is_null(table['year']))
+                size += write_table(part, os.path.join(root, 'facts', f'year={year or "unknown"}',
+                                                       ticker + ext), fmt)
+        sp.set(ticker=ticker, rows=table.num_rows, bytes=size)
+
+    metric_rows = 0
+    cur.execute("SELECT to_regclass(%s)", (f"{fact_store.SCHEMA}.metric",))
+    if cur.fetchone()[0] is not None:
+        import pyarrow as pa
+        with span("db.query", query="export_metrics"):
+            cur.execute(f"""
+                SELECT report, period_end, span, metric, value FROM {fact_store.SCHEMA}.metric
+                WHERE ticker = %s AND report IS NOT NULL
+                ORDER BY report, span DESC, metric
+            """, (ticker,))
+            rows = cur.fetchall()
+        if rows:
+            report, end, sp_, metric, value = zip(*rows)
+            out = metric_schema()
+            metrics = pa.table([
+                pa.array([ticker] * len(rows), pa.string()).dictionary_encode(),
+                pa.array(report, pa.string()).dictionary_encode(),
+                pa.array(end, pa.date32()),
+                pa.array(sp_, pa.string()).dictionary_encode(),
+                pa.array(metric, pa.string()).dictionary_encode(),
+                pa.array(value, pa.float64()),
+            ], schema=out)
+            size += write_table(metrics, os.path.join(root, 'metric', ticker + ext), fmt)
+            metric_rows = len(rows)
+    inc("fact_export_rows_total", table.num_rows)
+    reports = len(set(table['report'].to_pylist()))
+    print(f"[INFO] {ticker}: {reports} 份報告，{table.num_rows} 筆 fact 參照，"
+          f"{metric_rows} 筆衍生指標，{size / 1024:.1f} KB")
+    return {'reports': reports, 'rows': table.num_rows, 'metrics': metric_rows, 'bytes': size}
+
+
+def export(tickers: list[str] = None, root: str = None, fmt: str = 'parquet',
+           partition: str = 'ticker', clean: bool = False) -> dict:
+    import shutil
+    import psycopg2
+    import pipeline
+    root = root or FACT_EXPORT_DIR
+    if clean and os.path.isdir(root):
+        shutil.rmtree(root)
+    manifest = load_manifest(root)
+    if manifest and (manifest['format'], manifest['partition']) != (fmt, partition):
+        print(f"[ERROR] {root} 已是 {manifest['format']} / {manifest['partition']} 匯出，"
+              f"改變格式或分割方式請加上 --clean")
+        sys.exit(1)
+    tickers = tickers or pipeline.list_ticker_tables()
+    manifest = {'format': fmt, 'partition': partition, 'tickers': manifest.get('tickers', {})}
+    conn = psycopg2.connect(**pipeline.DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            for tk in tickers:
+                manifest['tickers'][tk.lower()] = export_ticker(cur, tk.lower(), root, fmt, partition)
+    finally:
+        conn.close()
+    manifest['exported_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    with open(os.path.join(root, MANIFEST), 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2)
+    return manifest
+
+
+# ---- 讀取（memory-mapped）----
+
+def read_file(path: str, columns: list[str] = None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if path.endswith('.parquet'):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.select(columns) if columns else table
+
+
+def read_ticker(kind: str, ticker: str, columns: list[str] = None, root: str = None):
+    import pyarrow as pa
+    files = ticker_files(kind, ticker.lower(), root)
+    if not files:
+        return None
+    return pa.concat_tables([read_file(p, columns) for p in files])
+
+
+def list_tickers(root: str = None) -> list[str]:
+    return sorted(load_manifest(root).get('tickers', {}))
+
+
+# 與 pipeline.extract_reports 相同的 (report, text)，但來源是匯出的檔案
+def extract_reports(ticker: str, root: str = None):
+    import pyarrow as pa
+    with span("export.read", kind="facts") as sp:
+        table = read_ticker('facts', ticker, ['report', 'owner', 'concept', 'period', 'dims',
+                                              'unit', 'value'], root)
+        sp.set(ticker=ticker, rows=table.num_rows if table is not None else 0)
+    if table is None:
+        return
+    # 先 cast 成 string 再 to_numpy 整欄解碼，比逐筆 to_pylist 快一個數量級（直接對 dictionary 欄 to_numpy 會丟失 null）
+    cols = {name: table[name].cast(pa.string()).to_numpy() for name in table.column_names}
+    # 同一份報告的列在檔案中是連續的
+    current, owned, refs = None, [], set()
+    for i, report in enumerate(cols['report']):
+        if report != current:
+            if owned:
+                yield current, fact_store.report_text(current, owned, sorted(refs))
+            current, owned, refs = report, [], set()
+        if cols['owner'][i] != report:
+            refs.add(cols['owner'][i])
+            continue
+        owned.append({'concept': cols['concept'][i], 'period': cols['period'][i],
+                      'dims': cols['dims'][i], 'unit': cols['unit'][i], 'value': cols['value'][i]})
+    if owned:
+        yield current, fact_store.report_text(current, owned, sorted(refs))
+
+
+def report_metrics(ticker: str, root: str = None) -> dict:
+    table = read_ticker('metric', ticker, ['report', 'period_end', 'span', 'metric', 'value'], root)
+    if table is None:
+        return {}
+    return derived_metrics.metric_texts(zip(*(table[c].to_pylist() for c in table.column_names)))
+
+
+# 全語料掃描：所有匯出檔組成一個 dataset，filter 可下推到 Parquet row group
+def scan(columns: list[str] = None, filter=None, root: str = None):
+    import pyarrow.dataset as ds
+    from pyarrow.fs import LocalFileSystem
+    manifest = load_manifest(root)
+    files = sorted(glob.glob(os.path.join(root or FACT_EXPORT_DIR, 'facts', '*',
+                                          '*' + FORMATS[manifest.get('format', 'parquet')])))
+    if not files:
+        return None
+    dataset = ds.dataset(files, format='ipc' if manifest.get('format') == 'arrow' else 'parquet',
+                         filesystem=LocalFileSystem(use_mmap=True))
+    with span("export.scan") as sp:
+        table = dataset.to_table(columns=columns, filter=filter)
+        sp.set(files=len(files), rows=table.num_rows)
+    return table
+
+
+# derived_metrics.compute 的輸入（與 derived_metrics.load_facts 相同），不連 DB
+def metric_inputs(tickers: list[str] = None, root: str = None):
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    alias = [c for cs in derived_metrics.CONCEPTS.values() for c in cs]
+    cond = ds.field('fact_key').is_valid()
+    if tickers:
+        cond = cond & ds.field('ticker').isin([t.lower() for t in tickers])
+    table = scan(['ticker', 'report', 'owner', 'concept', 'period', 'dims', 'value_num'], cond, root)
+    if table is None:
+        return derived_metrics.prepare(*empty_metric_inputs())
+    df = table.to_pandas()
+    for col in ('ticker', 'report', 'owner', 'concept', 'period', 'dims'):
+        df[col] = df[col].astype(object)
+    # 與 load_facts 相同：報告期末日 = 報告參照到的 fact 中最晚的期末日（period 右側 10 字元）
+    reports = (df.assign(end=df['period'].str[-10:]).groupby(['ticker', 'report'], sort=False)['end']
+               .max().reset_index())
+    facts = df[(df['owner'] == df['report']) & (df['dims'] == '') & df['concept'].isin(alias)]
+    facts = facts[['ticker', 'concept', 'period', 'value_num']].rename(columns={'value_num': 'value'})
+    return derived_metrics.prepare(facts.reset_index(drop=True), reports)
+
+
+def empty_metric_inputs():
+    import pandas as pd
+    return (pd.DataFrame(columns=['ticker', 'concept', 'period', 'value']),
+            pd.DataFrame(columns=['ticker', 'report', 'end']))
+
+
+def main(tickers: list[str] = None, root: str = None, fmt: str = 'parquet',
+         partition: str = 'ticker', clean: bool = False):
+    manifest = export(tickers, root, fmt, partition, clean)
+    total = sum(t['bytes'] for t in manifest['tickers'].values())
+    print(f"[INFO] 已匯出 {len(manifest['tickers'])} 支 ticker 到 {root or FACT_EXPORT_DIR}"
+          f"（{fmt}, partition={partition}, {total / 1024:.1f} KB）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="facts 匯出成 Parquet / Arrow（欄式、分割）")
+    parser.add_argument("--all", action="store_true", help="匯出所有 ticker table")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--partition", choices=PARTITIONS, default="ticker")
+    parser.add_argument("--out", help=f"輸出目錄（預設 FACT_EXPORT_DIR={FACT_EXPORT_DIR}）")
+    parser.add_argument("--clean", action="store_true", help="先清空輸出目錄")
+    parser.add_argument("ticker", nargs="?")
+    args = parser.parse_args()
+    if not args.all and not args.ticker:
+        parser.error("請指定 --all 或 ticker")
+    main(None if args.all else [args.ticker.lower()], args.out, args.format, args.partition, args.clean)
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# 跨報告 fact 去重
+#
+# 10-K / 10-Q 會重複揭露前期比較數，若每份報告各自存一份完整 facts JSONB，同一個數字
+# 會在 PostgreSQL 與 Qdrant 中重複多次。這裡將 fact 以 (ticker, concept, period, dims, unit, value)
+# 去重後只存一次：
+#
+#   xbrl.fact         每個唯一 fact 一列（fact_key = 上述欄位的 sha1）
+#   xbrl.report_fact  報告 → fact_key 的參照
+#
+# 報告表（每個 ticker 一張）仍保留 report 列，但 facts 欄為 NULL，由這裡重建。
+# 每個 fact 只歸屬一份「本期」報告（報告期末日 = fact 的期末日，否則為最早的報告），
+# pipeline 只 embed 該報告擁有的 fact。FACT_DEDUP=0 則維持原本整份 JSONB 的寫法。
+#
+# context / unit 於解析時就展開：xbrl.fact 另有 period_start / period_end / instant / dimensions
+# （JSONB，axis → member）欄位並建立索引，期間範圍、instant / duration、「只看合併數」（dims = ''）
+# 都是索引條件（find_facts），不必在字串或 JSONB 內比對。
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from metrics import span, inc, traced
+
+FACT_DEDUP = os.getenv('FACT_DEDUP', '1') != '0'
+SCHEMA = 'xbrl'
+
+XBRLI = '{http://www.xbrl.org/2003/instance}'
+XBRLDI = '{http://xbrl.org/2006/xbrldi}'
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+
+def ensure_schema(cur):
+    # 既有的 xbrl.fact 還沒有結構化欄位 → 這次加上欄位後需要回填（只會發生一次）
+    cur.execute("SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = %s AND table_name = 'fact'", (SCHEMA,))
+    columns = {row[0] for row in cur.fetchall()}
+    backfill = bool(columns) and 'instant' not in columns
+    cur.execute(f"""
+        CREATE SCHEMA IF NOT EXISTS {SCHEMA};
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.fact (
+            ticker   VARCHAR NOT NULL,
+            fact_key CHAR(40) NOT NULL,
+            concept  VARCHAR NOT NULL,
+            period   VARCHAR NOT NULL,
+            dims     VARCHAR NOT NULL DEFAULT '',
+            unit     VARCHAR NOT NULL DEFAULT '',
+            decimals VARCHAR,
+            value    TEXT NOT NULL,
+            PRIMARY KEY (ticker, fact_key)
+        );
+        ALTER TABLE {SCHEMA}.fact
+            ADD COLUMN IF NOT EXISTS period_start DATE,
+            ADD COLUMN IF NOT EXISTS period_end   DATE,
+            ADD COLUMN IF NOT EXISTS instant      BOOLEAN,
+            ADD COLUMN IF NOT EXISTS dimensions   JSONB NOT NULL DEFAULT '{{}}';
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.report_fact (
+            ticker   VARCHAR NOT NULL,
+            report   VARCHAR NOT NULL,
+            fact_key CHAR(40) NOT NULL,
+            PRIMARY KEY (ticker, report, fact_key)
+        );
+    """)
+    if backfill:
+        backfill_periods(cur)
+    cur.execute(f"""
+        CREATE INDEX IF NOT EXISTS fact_consolidated_idx
+            ON {SCHEMA}.fact (ticker, concept, period_end) WHERE dims = '';
+        CREATE INDEX IF NOT EXISTS fact_period_idx
+            ON {SCHEMA}.fact (ticker, period_end, period_start);
+        CREATE INDEX IF NOT EXISTS fact_dimensions_idx
+            ON {SCHEMA}.fact USING gin (dimensions jsonb_path_ops);
+    """)
+
+
+# 舊版寫入的 fact 由 period / dims 字串回填結構化欄位（ensure_schema 剛加上欄位時執行）
+@traced("db.write", table="xbrl.fact", op="backfill_periods")
+def backfill_periods(cur):
+    cur.execute(f"""
+        UPDATE {SCHEMA}.fact SET
+            instant = strpos(period, '/') = 0,
+            period_start = CASE WHEN period ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}}/'
+                                THEN left(period, 10)::date END,
+            period_end = CASE WHEN period ~ '\\d{{4}}-\\d{{2}}-\\d{{2}}$'
+                              THEN right(period, 10)::date END,
+            dimensions = (SELECT coalesce(jsonb_object_agg(split_part(d, '=', 1),
+                                                           substr(d, strpos(d, '=') + 1)), '{{}}')
+                          FROM unnest(string_to_array(nullif(dims, ''), ';')) d)
+        WHERE instant IS NULL
+    """)
+    inc("xbrl_facts_backfilled_total", max(cur.rowcount, 0))
+
+
+# xs:date / xs:dateTime → YYYY-MM-DD（DATE 欄），無法辨識則為 None
+def iso_date(text: str):
+    return text[:10] if DATE_RE.match(text or '') else None
+
+
+def local(qname: str) -> str:
+    return (qname or '').rsplit(':', 1)[-1].strip()
+
+
+# context id → {period, dims, period_start, period_end, instant, dimensions}
+# period 為 "start/end" 或 instant 日期；dims 為排序後的 "axis=member;..."，dimensions 為同內容的 dict
+def parse_contexts(root) -> dict:
+    contexts = {}
+    for ctx in root.iter(f'{XBRLI}context'):
+        instant = (ctx.findtext(f'{XBRLI}period/{XBRLI}instant') or '').strip()
+        if instant:
+            period, start, end = instant, None, instant
+        else:
+            start = (ctx.findtext(f'{XBRLI}period/{XBRLI}startDate') or '').strip()
+            end = (ctx.findtext(f'{XBRLI}period/{XBRLI}endDate') or '').strip()
+            period = f"{start}/{end}"
+        dimensions = {}
+        for member in ctx.iter(f'{XBRLDI}explicitMember', f'{XBRLDI}typedMember'):
+            value = local(member.text) if member.text and member.text.strip() else \
+                ''.join(member.itertext()).strip()
+            dimensions[local(member.get('dimension'))] = value
+        contexts[ctx.get('id')] = {
+            'period': period,
+            'dims': ';'.join(sorted(f"{k}={v}" for k, v in dimensions.items())),
+            'period_start': iso_date(start),
+            'period_end': iso_date(end),
+            'instant': bool(instant),
+            'dimensions': dimensions,
+        }
+    return contexts
+
+
+# unit id → 可讀單位，例如 USD、USD/shares
+def parse_units(root) -> dict:
+    units = {}
+    for unit in root.iter(f'{XBRLI}unit'):
+        num = unit.find(f'{XBRLI}divide/{XBRLI}unitNumerator')
+        den = unit.find(f'{XBRLI}divide/{XBRLI}unitDenominator')
+        if num is not None and den is not None:
+            units[unit.get('id')] = '/'.join(
+                '*'.join(local(m.text) for m in part.iter(f'{XBRLI}measure')) for part in (num, den))
+        else:
+            units[unit.get('id')] = '*'.join(local(m.text) for m in unit.iter(f'{XBRLI}measure'))
+    return units
+
+
+# 解析 instance 內所有 fact（不再以 concept 覆蓋），period / dims / unit 都已解析成跨文件可比的值
+def parse_facts(root) -> list[dict]:
+    from lxml import etree
+    contexts = parse_contexts(root)
+    units = parse_units(root)
+    records = {}
+    for fact in root.iter():
+        ctx = fact.get('contextRef')
+        if not ctx or ctx not in contexts:
+            continue
+        c = contexts[ctx]
+        unit_ref = fact.get('unitRef')
+        rec = {
+            'concept':  etree.QName(fact.tag).localname,
+            'period':   c['period'],
+            'dims':     c['dims'],
+            'unit':     units.get(unit_ref, unit_ref or ''),
+            'decimals': fact.get('decimals'),
+            'value':    (fact.text or '').strip(),
+            'period_start': c['period_start'],
+            'period_end':   c['period_end'],
+            'instant':      c['instant'],
+            'dimensions':   c['dimensions'],
+        }
+        rec['fact_key'] = fact_key(rec)
+        records[rec['fact_key']] = rec
+    return list(records.values())
+
+
+# FACT_DEDUP=0 的整份 JSONB（{concept: props}，同名 concept 以最後一個為準）；
+# 除原本的 contextRef / unitRef 外也寫入展開後的期間與維度，可用 JSONB 運算子過濾
+def parse_legacy(root) -> dict:
+    from lxml import etree
+    contexts = parse_contexts(root)
+    facts = {}
+    for fact in root.iter():
+        ctx = fact.get('contextRef')
+        if not ctx:
+            continue
+        c = contexts.get(ctx, {})
+        facts[etree.QName(fact.tag).localname] = {
+            'value': fact.text,
+            'unitRef': fact.get('unitRef'),
+            'contextRef': ctx,
+            'decimals': fact.get('decimals'),
+            'periodStart': c.get('period_start'),
+            'periodEnd': c.get('period_end'),
+            'instant': c.get('instant'),
+            'dimensions': c.get('dimensions', {}),
+        }
+    return facts
+
+
+def fact_key(rec: dict) -> str:
+    raw = '\x1f'.join((rec['concept'], rec['period'], rec['dims'], rec['unit'], rec['value']))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def period_end(period: str) -> str:
+    return period.rsplit('/', 1)[-1]
+
+
+# 寫入一份報告：新 fact 插入 xbrl.fact，已存在的只加參照；回傳 (fact 數, 新增數)
+def store_report(cur, ticker: str, report: str, records: list[dict]) -> tuple[int, int]:
+    tk = ticker.lower()
+    with span("db.write", table="xbrl.fact") as sp:
+        inserted = execute_values(cur, f"""
+            INSERT INTO {SCHEMA}.fact (ticker, fact_key, concept, period, dims, unit, decimals, value,
+                                       period_start, period_end, instant, dimensions)
+            VALUES %s ON CONFLICT DO NOTHING RETURNING fact_key
+        """, [(tk, r['fact_key'], r['concept'], r['period'], r['dims'], r['unit'],
+               r['decimals'], r['value'], r['period_start'], r['period_end'], r['instant'],
+               json.dumps(r['dimensions'])) for r in records], fetch=True, page_size=1000)
+        execute_values(cur, f"""
+            INSERT INTO {SCHEMA}.report_fact (ticker, report, fact_key)
+            VALUES %s ON CONFLICT DO NOTHING
+        """, [(tk, report, r['fact_key']) for r in records], page_size=1000)
+        sp.set(report=report, facts=len(records), new=len(inserted))
+    inc("xbrl_facts_deduplicated_total", len(records) - len(inserted))
+    return len(records), len(inserted)
+
+
+# 報告表的 report 列；去重模式下 facts 為 NULL
+@traced("db.write", table="ticker")
+def insert_report_row(cur, ticker: str, report: str, facts):
+    cur.execute(
+        sql.SQL("INSERT INTO {table} (report, facts) VALUES (%s, %s::jsonb)").format(
+            table=sql.Identifier(ticker.lower())),
+        (report, json.dumps(facts) if facts is not None else None))
+
+
+def fetch_ticker_facts(cur, ticker: str) -> list[tuple]:
+    cur.execute("SELECT to_regclass(%s)", (f"{SCHEMA}.report_fact",))
+    if cur.fetchone()[0] is None:
+        return []
+    with span("db.query", query="ticker_facts"):
+        cur.execute(f"""
+            SELECT rf.report, f.fact_key, f.concept, f.period, f.dims, f.unit, f.value, f.decimals
+            FROM {SCHEMA}.report_fact rf
+            JOIN {SCHEMA}.fact f ON f.ticker = rf.ticker AND f.fact_key = rf.fact_key
+            WHERE rf.ticker = %s
+            ORDER BY rf.report, f.concept, f.period, f.dims
+        """, (ticker.lower(),))
+        return cur.fetchall()
+
+
+# 決定每個 fact 的歸屬報告：期末日相同的報告優先，否則為期末日最早的報告
+def assign_owners(rows: list[tuple]) -> tuple[dict, dict]:
+    report_end, holders, facts = {}, {}, {}
+    for report, key, concept, period, dims, unit, value, decimals in rows:
+        end = period_end(period)
+        report_end[report] = max(report_end.get(report, ''), end)
+        holders.setdefault(key, []).append(report)
+        facts[key] = {'fact_key': key, 'concept': concept, 'period': period, 'dims': dims,
+                      'unit': unit, 'decimals': decimals, 'value': value}
+    owned, refs = {r: [] for r in report_end}, {r: set() for r in report_end}
+    for key, reports in holders.items():
+        end = period_end(facts[key]['period'])
+        same = sorted(r for r in reports if report_end[r] == end)
+        owner = same[0] if same else min(reports, key=lambda r: (report_end[r], r))
+        owned[owner].append(facts[key])
+        for r in reports:
+            if r != owner:
+                refs[r].add(owner)
+    return owned, refs
+
+
+# 每份報告的 (擁有的 facts, 參照到的其他報告)
+def report_facts(cur, ticker: str) -> dict:
+    owned, refs = assign_owners(fetch_ticker_facts(cur, ticker))
+    return {r: (owned[r], sorted(refs[r])) for r in owned}
+
+
+# 以結構化欄位查詢 fact，條件都落在索引上（fact_consolidated_idx / fact_period_idx / fact_dimensions_idx）
+#   start / end     期間完全落在 [start, end] 內（instant 看日期，duration 看起訖）
+#   instant         True 只取 instant（資產負債表），False 只取 duration（損益、現金流量）
+#   consolidated    True 只取無維度的合併數，False 只取有維度（segment / member）的 fact
+#   members         {axis: member}，須全部符合
+def find_facts(cur, ticker: str, concepts: list[str] = None, start=None, end=None, instant=None,
+               consolidated=None, members: dict = None, limit: int = None) -> list[dict]:
+    where, params = ["ticker = %s"], [ticker.lower()]
+    if concepts:
+        where.append("concept = ANY(%s)")
+        params.append(list(concepts))
+    if start:
+        where.append("period_end >= %s AND (period_start IS NULL OR period_start >= %s)")
+        params += [start, start]
+    if end:
+        where.append("period_end <= %s")
+        params.append(end)
+    if instant is not None:
+        where.append("instant = %s")
+        params.append(instant)
+    if consolidated is not None:
+        where.append("dims = ''" if consolidated else "dims <> ''")
+    if members:
+        where.append("dimensions @> %s::jsonb")
+        params.append(json.dumps(members))
+    with span("db.query", query="find_facts") as sp:
+        cur.execute(f"""
+            SELECT concept, period, dims, unit, decimals, value, period_start, period_end, instant, dimensions
+            FROM {SCHEMA}.fact WHERE {' AND '.join(where)}
+            ORDER BY period_end, concept, dims
+        """ + (" LIMIT %s" if limit else ""), params + ([limit] if limit else []))
+        cols = [d[0] for d in cur.description]
+        rows = [dict(zip(cols, r)) for r in cur.fetchall()]
+        sp.set(rows=len(rows))
+    return rows
+
+
+def dedup_report(cur) -> dict:
+    cur.execute("SELECT to_regclass(%s)", (f"{SCHEMA}.report_fact",))
+    if cur.fetchone()[0] is None:
+        return {}
+    size = ("pg_column_size(jsonb_build_object('value', f.value, 'unitRef', f.unit, "
+            "'period', f.period, 'dims', f.dims, 'decimals', f.decimals))")
+    with span("db.query", query="dedup_report"):
+        cur.execute(f"""
+            SELECT rf.ticker, count(DISTINCT rf.report), count(*),
+                   sum({size} + length(f.concept))
+            FROM {SCHEMA}.report_fact rf
+            JOIN {SCHEMA}.fact f ON f.ticker = rf.ticker AND f.fact_key = rf.fact_key
+            GROUP BY rf.ticker
+        """)
+        full = {r[0]: r[1:] for r in cur.fetchall()}
+        cur.execute(f"""
+            SELECT f.ticker, count(*), sum({size} + length(f.concept))
+            FROM {SCHEMA}.fact f GROUP BY f.ticker
+        """)
+        unique = {r[0]: r[1:] for r in cur.fetchall()}
+        cur.execute(f"SELECT pg_total_relation_size('{SCHEMA}.fact'), "
+                    f"pg_total_relation_size('{SCHEMA}.report_fact')")
+        fact_bytes, ref_bytes = cur.fetchone()
+
+    tickers = {}
+    totals = {'reports': 0, 'fact_refs': 0, 'unique_facts': 0, 'full_bytes': 0,
+              'dedup_bytes': 0, 'full_embed_chars': 0, 'dedup_embed_chars': 0}
+    for tk, (reports, refs, full_bytes) in sorted(full.items()):
+        n_unique, dedup_bytes = unique.get(tk, (0, 0))
+        # embedding 量：整份報告（含比較數）的文本 vs 只含歸屬 fact 的文本
+        rows = fetch_ticker_facts(cur, tk)
+        full_text = {}
+        for report, _, concept, period, dims, unit, value, _ in rows:
+            full_text.setdefault(report, []).append(
+                {'concept': concept, 'period': period, 'dims': dims, 'unit': unit, 'value': value})
+        owned, ref_map = assign_owners(rows)
+        full_chars = sum(len(report_text(r, f)) for r, f in full_text.items())
+        dedup_chars = sum(len(report_text(r, f, sorted(ref_map[r]))) for r, f in owned.items())
+        row = {'reports': reports, 'fact_refs': refs, 'unique_facts': n_unique,
+               'full_bytes': int(full_bytes), 'dedup_bytes': int(dedup_bytes),
+               'full_embed_chars': full_chars, 'dedup_embed_chars': dedup_chars}
+        tickers[tk] = row
+        for k in totals:
+            totals[k] += row[k]
+    totals['xbrl_table_bytes'] = fact_bytes + ref_bytes
+    return {'tickers': tickers, 'total': totals}
+
+
+def report_text(report: str, facts: list[dict], refs: list[str] = ()) -> str:
+    import pipeline
+    text = pipeline.report_text(report, facts)
+    if refs:
+        text += "\nComparatives reported in: " + ", ".join(refs)
+    return text
+
+
+def ratio(a, b) -> str:
+    return f"{a / b:.2f}x" if b else "n/a"
+
+
+def print_report(stats: dict):
+    if not stats:
+        print("[INFO] 尚無去重資料（xbrl.report_fact 不存在）")
+        return
+    print(f"{'ticker':<10}{'reports':>8}{'refs':>9}{'unique':>9}{'facts':>8}"
+          f"{'JSONB KB':>10}{'dedup KB':>10}{'bytes':>8}{'embed chars':>13}{'dedup':>11}{'chars':>8}")
+    rows = list(stats['tickers'].items()) + [('TOTAL', stats['total'])]
+    for tk, r in rows:
+        print(f"{tk:<10}{r['reports']:>8}{r['fact_refs']:>9}{r['unique_facts']:>9}"
+              f"{ratio(r['fact_refs'], r['unique_facts']):>8}"
+              f"{r['full_bytes'] / 1024:>10.1f}{r['dedup_bytes'] / 1024:>10.1f}"
+              f"{ratio(r['full_bytes'], r['dedup_bytes']):>8}"
+              f"{r['full_embed_chars']:>13}{r['dedup_embed_chars']:>11}"
+              f"{ratio(r['full_embed_chars'], r['dedup_embed_chars']):>8}")
+    print(f"\n[INFO] xbrl.fact + xbrl.report_fact 實際佔用 "
+          f"{stats['total']['xbrl_table_bytes'] / 1024:.1f} KB（含索引）")
+
+
+def print_facts(rows: list[dict], as_json: bool = False):
+    if as_json:
+        json.dump(rows, sys.stdout, indent=2, default=str)
+        print()
+        return
+    for r in rows:
+        label = r['period'] + (f"; {r['dims']}" if r['dims'] else '')
+        print(f"{r['concept']} [{label}]: {r['value']} {r['unit']}".strip())
+    print(f"[INFO] {len(rows)} 筆 fact")
+
+
+def query_main(ticker: str, as_json: bool = False, **filters):
+    import psycopg2
+    from pipeline import DB_PARAMS
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            rows = find_facts(cur, ticker, **filters)
+    finally:
+        conn.close()
+    print_facts(rows, as_json)
+
+
+def main(as_json: bool = False):
+    import psycopg2
+    from pipeline import DB_PARAMS
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            stats = dedup_report(cur)
+    finally:
+        conn.close()
+    if as_json:
+        json.dump(stats, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(stats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="跨報告 fact 去重統計")
+    parser.add_argument("--json", action="store_true")
+    main(parser.parse_args().json)
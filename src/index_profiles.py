@@ -0,0 +1,135 @@
+# Qdrant collection 的索引設定檔：量化、on-disk 與 HNSW 參數
+#
+#   default  原本的設定：float32 向量全在 RAM，無量化
+#   disk     向量與 payload 放在 mmap（on-disk），無量化
+#   int8     scalar int8 量化常駐 RAM，原始向量 on-disk，查詢時 rescoring
+#   binary   binary 量化常駐 RAM（768 維 → 96 bytes），原始向量 on-disk，較大 oversampling
+#
+# 以 QDRANT_INDEX_PROFILE 選擇；QDRANT_HNSW_M / QDRANT_HNSW_EF_CONSTRUCT / QDRANT_HNSW_EF /
+# QDRANT_OVERSAMPLING 可覆寫個別參數
+import os
+
+INDEX_PROFILES = {
+    "default": {},
+    "disk": {"on_disk": True, "on_disk_payload": True},
+    "int8": {"quantization": "int8", "on_disk": True, "on_disk_payload": True,
+             "m": 16, "ef_construct": 100, "ef": 128, "oversampling": 2.0},
+    "binary": {"quantization": "binary", "on_disk": True, "on_disk_payload": True,
+               "m": 16, "ef_construct": 100, "ef": 128, "oversampling": 3.0},
+}
+
+DEFAULT_PROFILE = os.getenv("QDRANT_INDEX_PROFILE", "default")
+# Qdrant 建立 collection 時的 HNSW 預設值；reindex 回 default 時據此還原
+HNSW_DEFAULTS = {"m": 16, "ef_construct": 100}
+
+ENV_OVERRIDES = {
+    "m": ("QDRANT_HNSW_M", int),
+    "ef_construct": ("QDRANT_HNSW_EF_CONSTRUCT", int),
+    "ef": ("QDRANT_HNSW_EF", int),
+    "oversampling": ("QDRANT_OVERSAMPLING", float),
+}
+
+
+def get_profile(name: str = None) -> dict:
+    name = name or DEFAULT_PROFILE
+    if name not in INDEX_PROFILES:
+        raise ValueError(f"未知的 index profile: {name}（可用：{', '.join(INDEX_PROFILES)}）")
+    profile = dict(INDEX_PROFILES[name], name=name)
+    for key, (env, cast) in ENV_OVERRIDES.items():
+        if os.getenv(env):
+            profile[key] = cast(os.getenv(env))
+    return profile
+
+
+def quantization_config(profile: dict):
+    from qdrant_client.http import models
+    kind = profile.get("quantization")
+    if kind == "int8":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+    if kind == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def hnsw_config(profile: dict):
+    from qdrant_client.http import models
+    if "m" not in profile and "ef_construct" not in profile:
+        return None
+    return models.HnswConfigDiff(m=profile.get("m"), ef_construct=profile.get("ef_construct"))
+
+
+# create_collection() 的參數
+def collection_kwargs(vector_size: int, profile: dict) -> dict:
+    from qdrant_client.http.models import VectorParams, Distance
+    kwargs = {
+        "vectors_config": VectorParams(size=vector_size, distance=Distance.COSINE,
+                                       on_disk=profile.get("on_disk") or None),
+    }
+    if profile.get("on_disk_payload"):
+        kwargs["on_disk_payload"] = True
+    if hnsw_config(profile) is not None:
+        kwargs["hnsw_config"] = hnsw_config(profile)
+    if quantization_config(profile) is not None:
+        kwargs["quantization_config"] = quantization_config(profile)
+    return kwargs
+
+
+# 將 profile 套用到既有 collection（不需重新 embed）；每個設定都明確送出，
+# 從調校過的 profile 換回 default 時 HNSW / on-disk payload 也會還原
+def update_kwargs(profile: dict) -> dict:
+    from qdrant_client.http import models
+    kwargs = {
+        "vectors_config": {"": models.VectorParamsDiff(on_disk=bool(profile.get("on_disk")))},
+        "collection_params": models.CollectionParamsDiff(
+            on_disk_payload=bool(profile.get("on_disk_payload"))),
+        "hnsw_config": models.HnswConfigDiff(**{k: profile.get(k, v) for k, v in HNSW_DEFAULTS.items()}),
+    }
+    quant = quantization_config(profile)
+    kwargs["quantization_config"] = quant if quant is not None else models.Disabled.DISABLED
+    return kwargs
+
+
+# 由既有 collection 的設定（get_collection().config）還原 profile：collection 可能以不同 profile
+# 建立或 reindex 過，量化 / on-disk / HNSW 以實際設定為準，查詢端的 ef / oversampling
+# 不存在 collection 上，沿用相同量化種類的 profile（可被環境變數覆寫）
+def profile_from_config(config) -> dict:
+    vectors = config.params.vectors
+    if isinstance(vectors, dict):
+        vectors = vectors.get("") or next(iter(vectors.values()), None)
+    quant = getattr(vectors, "quantization_config", None) or config.quantization_config
+    kind = None
+    if getattr(quant, "scalar", None) is not None:
+        kind = "int8"
+    elif getattr(quant, "binary", None) is not None:
+        kind = "binary"
+    on_disk = bool(getattr(vectors, "on_disk", None))
+    profile = get_profile(kind or ("disk" if on_disk else "default"))
+    profile["on_disk"] = on_disk
+    hnsw = getattr(config, "hnsw_config", None)
+    if hnsw is not None:
+        profile.update(m=hnsw.m, ef_construct=hnsw.ef_construct)
+    return profile
+
+
+# search() 的 search_params；default profile 回傳 None 維持原本行為
+def search_params(profile: dict = None):
+    profile = profile or get_profile()
+    if "ef" not in profile and not profile.get("quantization"):
+        return None
+    from qdrant_client.http import models
+    quant = None
+    if profile.get("quantization"):
+        quant = models.QuantizationSearchParams(
+            ignore=False, rescore=True, oversampling=profile.get("oversampling", 2.0))
+    return models.SearchParams(hnsw_ef=profile.get("ef"), quantization=quant)
+
+
+# 估算常駐記憶體（bytes）：RAM 中的向量 / 量化向量 + HNSW 連結
+def estimate_ram(n_points: int, dim: int, profile: dict) -> dict:
+    vectors = 0 if profile.get("on_disk") else n_points * dim * 4
+    kind = profile.get("quantization")
+    quant = n_points * dim if kind == "int8" else (n_points * dim // 8 if kind == "binary" else 0)
+    graph = n_points * profile.get("m", HNSW_DEFAULTS["m"]) * 2 * 4
+    return {"vectors": vectors, "quantized": quant, "hnsw": graph,
+            "total": vectors + quant + graph}
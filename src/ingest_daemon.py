@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# 監看 XBRL 下載資料夾，新檔案落地後自動 parse → PostgreSQL → chunk → embed → Qdrant
+#
+# 監看方式：Linux 用 inotify（IN_CLOSE_WRITE / IN_MOVED_TO，檔案寫完才觸發），其他平台或
+# INGEST_WATCH=poll 時每 INGEST_POLL_INTERVAL 秒掃描一次，大小與 mtime 連續兩次不變才視為寫完。
+# 啟動時先補處理資料夾內尚未入庫的檔案（報告已存在的直接略過，不會重複寫入）。
+#
+# 每個階段有自己的 worker pool，階段之間以有界 queue（INGEST_QUEUE_SIZE）相連，下游塞車時上游自然等待：
+#   parse   解析 XBRL（檔名 <TICKER>_<YYYY>Q<n>[&Annual].xml）
+#   store   寫入報告表 / xbrl.fact，重算該 ticker 的衍生指標
+#   chunk   重建該 ticker 的報告文本並比對 content hash（同一 ticker 的多份新檔合併成一次；
+#           同一 ticker 上一輪的 plan 全部寫入 Qdrant 後才開始下一輪，舊文本不會蓋掉新文本）
+#   embed   只 embed 內容有變的 chunk
+#   upsert  寫入 Qdrant
+#
+#   python ingest_daemon.py                 # 持續監看 XBRL_DIR
+#   python ingest_daemon.py --once          # 只補處理現有檔案後結束
+import os
+import re
+import time
+import queue
+import select
+import struct
+import argparse
+import threading
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2 import sql
+from metrics import span, inc, observe
+import arelle_db
+import fact_store
+import derived_metrics
+import pipeline
+
+load_dotenv()
+WATCH_MODE = os.getenv('INGEST_WATCH', 'auto')                  # auto / inotify / poll
+POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '2'))
+QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', '64'))
+WORKERS = {
+    'parse':  int(os.getenv('INGEST_PARSE_WORKERS', '2')),
+    'store':  int(os.getenv('INGEST_STORE_WORKERS', '2')),
+    'chunk':  int(os.getenv('INGEST_CHUNK_WORKERS', '2')),
+    'embed':  int(os.getenv('INGEST_EMBED_WORKERS', '2')),
+    'upsert': int(os.getenv('INGEST_UPSERT_WORKERS', '1')),
+}
+
+FILE_RE = re.compile(r"^(?P<ticker>[^_]+)_(?P<quarter>\d{4}Q[1-4])(?:&Annual)?\.xml$")
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    # 以 ctypes 直接呼叫 libc 的 inotify，不需額外套件；不支援的平台於建構時丟出 OSError
+    def __init__(self, path: str):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        self.path = path
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+
+    def poll(self, timeout: float) -> list[str]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths, offset = [], 0
+        while offset < len(buf):
+            _, _, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            start = offset + EVENT_HEADER.size
+            name = buf[start:start + length].rstrip(b"\0").decode(errors="replace")
+            offset = start + length
+            if name:
+                paths.append(os.path.join(self.path, name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher:
+    # 定期掃描；同一檔案的 (size, mtime) 連續兩次相同才回報，避免讀到寫到一半的檔案
+    def __init__(self, path: str, interval: float = POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.last = {}
+        self.emitted = {}
+
+    def poll(self, timeout: float) -> list[str]:
+        time.sleep(min(timeout, self.interval))
+        current = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    current[entry.path] = (st.st_size, st.st_mtime_ns)
+        ready = [p for p, sig in current.items()
+                 if self.last.get(p) == sig and self.emitted.get(p) != sig]
+        for p in ready:
+            self.emitted[p] = current[p]
+        self.last = current
+        return ready
+
+    def close(self):
+        pass
+
+
+def make_watcher(path: str, mode: str = WATCH_MODE):
+    if mode in ("auto", "inotify"):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            if mode == "inotify":
+                raise
+            print(f"[WARNING] inotify 無法使用（{e}），改用輪詢")
+    return PollWatcher(path)
+
+
+class Stage:
+    # 一個階段 = 輸入 queue + worker threads；fn 回傳要交給下一階段的項目（list，可為空）
+    def __init__(self, name: str, fn, workers: int, daemon: "IngestDaemon"):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.daemon = daemon
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.next = None
+        self.threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.loop, name=f"ingest-{self.name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def put(self, item):
+        self.daemon.track(1)
+        self.queue.put(item)
+
+    def loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                with span(f"ingest.{self.name}"):
+                    outputs = self.fn(item) or []
+                for out in outputs:
+                    self.next.put(out)
+            except Exception as e:
+                inc("ingest_errors_total", stage=self.name)
+                print(f"[ERROR] ingest {self.name} 失敗：{type(e).__name__}: {e}")
+            finally:
+                self.daemon.track(-1)
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+
+class IngestDaemon:
+    def __init__(self, watch_dir: str = None, mode: str = WATCH_MODE, workers: dict = None):
+        self.watch_dir = watch_dir or arelle_db.xml_dir
+        self.mode = mode
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.derive_lock = threading.Lock()
+        self.idle = threading.Condition()
+        self.inflight = 0
+        self.known = {}          # ticker → 已入庫的 report
+        self.ticker_locks = {}
+        self.dirty = set()       # 已排入 chunk 階段、尚未開始處理的 ticker
+        self.passes = {}         # ticker → 目前這一輪 chunk 尚未寫入 Qdrant 的 plan 數
+        self.pass_done = threading.Condition(self.lock)
+        self.landed = {}         # report → 檔案出現的時間，用來量測落地到可查詢的延遲
+        self.stats = {'files': 0, 'skipped': 0, 'reports': 0, 'points': 0}
+        self.latencies = []
+        workers = dict(WORKERS, **(workers or {}))
+        self.stages = [Stage(name, getattr(self, name), workers[name], self)
+                       for name in ('parse', 'store', 'chunk', 'embed', 'upsert')]
+        for a, b in zip(self.stages, self.stages[1:]):
+            a.next = b
+
+    # 每個 worker thread 各自一條 DB 連線
+    def conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or conn.closed:
+            conn = self.local.conn = psycopg2.connect(**arelle_db.DB_PARAMS)
+        return conn
+
+    def track(self, n: int):
+        with self.idle:
+            self.inflight += n
+            if self.inflight == 0:
+                self.idle.notify_all()
+
+    def ticker_lock(self, ticker: str) -> threading.Lock:
+        with self.lock:
+            return self.ticker_locks.setdefault(ticker, threading.Lock())
+
+    def known_reports(self, ticker: str) -> set:
+        with self.lock:
+            if ticker in self.known:
+                return self.known[ticker]
+        reports = set()
+        with self.conn() as conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass(%s)", (ticker.lower(),))
+            if cur.fetchone()[0] is not None:
+                cur.execute(sql.SQL("SELECT DISTINCT report FROM {}").format(sql.Identifier(ticker.lower())))
+                reports = {r[0] for r in cur.fetchall()}
+        with self.lock:
+            return self.known.setdefault(ticker, reports)
+
+    # landed_at：檔案落地時間（watcher 以 mtime 計，輪詢的掃描間隔也算進延遲）
+    def submit(self, path: str, landed_at: float = None):
+        if not FILE_RE.match(os.path.basename(path)):
+            return
+        report = os.path.basename(path).rsplit('.', 1)[0]
+        with self.lock:
+            self.landed.setdefault(report, landed_at or time.time())
+        self.stages[0].put(path)
+
+    # parse：已入庫的報告不再解析
+    def parse(self, path: str):
+        ticker = FILE_RE.match(os.path.basename(path))['ticker']
+        report = os.path.basename(path).rsplit('.', 1)[0]
+        if report in self.known_reports(ticker):
+            with self.lock:
+                self.stats['skipped'] += 1
+                self.landed.pop(report, None)
+            return []
+        from lxml import etree
+        with span("xbrl.parse", source="ingest") as sp:
+            root = etree.parse(path).getroot()
+            data = fact_store.parse_facts(root) if fact_store.FACT_DEDUP else fact_store.parse_legacy(root)
+            sp.set(file=os.path.basename(path), facts=len(data))
+        with self.lock:
+            self.stats['files'] += 1
+        return [(ticker, report, data)]
+
+    # store：同一 ticker 的寫入依序進行，報告已存在（其他 worker 先寫入）就略過
+    def store(self, item):
+        ticker, report, data = item
+        with self.ticker_lock(ticker):
+            known = self.known_reports(ticker)
+            if report in known:
+                return []
+            conn = self.conn()
+            with conn, conn.cursor() as cur:
+                arelle_db.ensure_table(cur, ticker.lower())
+                if fact_store.FACT_DEDUP:
+                    fact_store.insert_report_row(cur, ticker, report, None)
+                    fact_store.store_report(cur, ticker, report, data)
+                else:
+                    fact_store.insert_report_row(cur, ticker, report, data)
+            with self.lock:
+                known.add(report)
+                self.stats['reports'] += 1
+            inc("xbrl_facts_total", len(data), source="ingest")
+        if fact_store.FACT_DEDUP:
+            with self.derive_lock, conn, conn.cursor() as cur:
+                derived_metrics.refresh(cur)
+        with self.lock:
+            if ticker in self.dirty:
+                return []
+            self.dirty.add(ticker)
+        return [ticker]
+
+    # chunk：重建整個 ticker 的文本（新報告可能改變其他報告擁有的 fact），只留下 content hash 有變的 chunk
+    def chunk(self, ticker: str):
+        table = ticker.lower()
+        with self.pass_done:
+            self.pass_done.wait_for(lambda: table not in self.passes)
+            self.dirty.discard(ticker)
+            self.passes[table] = 1
+        plans = []
+        try:
+            derived = pipeline.report_metrics(table)
+            reports = []
+            for report, text in pipeline.extract_reports(table):
+                reports.append(report)
+                plan = pipeline.plan_report(table, report, text, derived.get(report))
+                if plan["todo"] or plan["stale"]:
+                    plans.append(plan)
+            pipeline.drop_orphans(table, reports)
+        except BaseException:
+            plans = []
+            raise
+        finally:
+            with self.pass_done:
+                self.passes[table] += len(plans)
+            self.plan_done(table)
+        return plans
+
+    # 一個 plan 寫入（或失敗）後呼叫；該 ticker 這一輪全部完成時喚醒等待中的 chunk
+    def plan_done(self, table: str):
+        with self.pass_done:
+            self.passes[table] -= 1
+            if self.passes[table] <= 0:
+                del self.passes[table]
+                self.pass_done.notify_all()
+
+    def embed(self, plan: dict):
+        try:
+            todo = [plan["chunks"][idx] for idx in plan["todo"]]
+            return [(plan, pipeline.embed(todo) if todo else [])]
+        except BaseException:
+            self.plan_done(plan["ticker"])
+            raise
+
+    def upsert(self, item):
+        plan, vectors = item
+        try:
+            pipeline.write_report(plan, vectors)
+        finally:
+            self.plan_done(plan["ticker"])
+        with self.lock:
+            self.stats['points'] += len(plan["todo"])
+            t0 = self.landed.pop(plan["report"], None)
+        if t0 is not None:
+            seconds = max(0.0, time.time() - t0)
+            with self.lock:
+                self.latencies.append(seconds)
+            observe("ingest_latency_seconds", seconds)
+            print(f"[INFO] {plan['report']} 已可查詢（落地後 {seconds:.2f}s）")
+        return []
+
+    def start(self):
+        if fact_store.FACT_DEDUP:
+            with self.conn() as conn, conn.cursor() as cur:
+                fact_store.ensure_schema(cur)
+        for stage in self.stages:
+            stage.start()
+
+    # 啟動時補處理資料夾內既有的檔案
+    def scan(self):
+        for name in sorted(os.listdir(self.watch_dir)):
+            self.submit(os.path.join(self.watch_dir, name))
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        with self.idle:
+            return self.idle.wait_for(lambda: self.inflight == 0, timeout)
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def run(self, once: bool = False, stop_event: threading.Event = None):
+        os.makedirs(self.watch_dir, exist_ok=True)
+        watcher = None if once else make_watcher(self.watch_dir, self.mode)
+        self.start()
+        try:
+            self.scan()
+            if once:
+                self.wait_idle()
+                return self.stats
+            print(f"[INFO] 監看 {self.watch_dir}（{type(watcher).__name__}），Ctrl+C 結束")
+            stop_event = stop_event or threading.Event()
+            while not stop_event.is_set():
+                for path in watcher.poll(0.5):
+                    try:
+                        landed_at = min(time.time(), os.stat(path).st_mtime)
+                    except FileNotFoundError:
+                        continue
+                    self.submit(path, landed_at)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if watcher is not None:
+                watcher.close()
+            self.wait_idle()
+            self.stop()
+        return self.stats
+
+
+def main(watch_dir: str = None, once: bool = False, mode: str = WATCH_MODE, workers: dict = None):
+    stats = IngestDaemon(watch_dir, mode, workers).run(once=once)
+    print(f"[INFO] ingest 結束：{stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="監看 XBRL 資料夾，新檔自動入庫並寫入 Qdrant")
+    parser.add_argument("--dir", help="監看的資料夾（預設 XBRL_DIR）")
+    parser.add_argument("--once", action="store_true", help="只處理現有檔案後結束")
+    parser.add_argument("--watch", choices=["auto", "inotify", "poll"], default=WATCH_MODE)
+    args = parser.parse_args()
+    main(args.dir, args.once, args.watch)
@@ -0,0 +1,197 @@
+# LLM 回應快取 + 同步 / async 的 in-flight 合併（rag_en 與 rag_service 共用）
+#
+# key = sha256(model, temperature, max_tokens, system prompt, prompt 模板, sha256(context), question)，
+# 存在 SQLite（LLM_CACHE_PATH），超過 LLM_CACHE_TTL 秒過期，超過 LLM_CACHE_MAX_ENTRIES 筆時
+# 淘汰最久未使用的項目。只快取成功的回答；LLM_CACHE=0 時不落地，但仍會合併同時進行的相同請求。
+# 上游呼叫回傳 (answer, 實際回答的 model)：fallback / hedge 由其他 model 回答時不寫入快取，
+# 避免之後以主要 model 的 key 取出別的 model 的回答（同時等待的請求仍共用這次結果）。
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+
+from metrics import inc
+
+LLM_CACHE = os.getenv('LLM_CACHE', '1') != '0'
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', '../cache/llm_cache.sqlite')
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000'))
+EVICT_EVERY = 100
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# data 為 rag_en.build_llm_request 組出的 request body
+def cache_key(data: dict, template: str, context: str, question: str) -> str:
+    system = next((m['content'] for m in data['messages'] if m['role'] == 'system'), '')
+    parts = [data['model'], data.get('temperature'), data.get('max_tokens'),
+             system, sha256(template), sha256(context), question]
+    return sha256(json.dumps(parts, ensure_ascii=False))
+
+
+class LLMCache:
+    def __init__(self, path: str = None, ttl: float = LLM_CACHE_TTL,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # 可重入：get_or_call 持有鎖時還要再查一次快取
+        self.lock = threading.RLock()
+        self.inflight: dict[str, Future] = {}
+        self.ainflight: dict[str, asyncio.Future] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'fallback': 0}
+        self.puts = 0
+        self.db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key      TEXT PRIMARY KEY,
+                    model    TEXT,
+                    answer   TEXT NOT NULL,
+                    created  REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    hits     INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)")
+
+    def get(self, key: str):
+        if self.db is None:
+            return None
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT answer FROM llm_cache WHERE key = ? AND created > ?",
+                                  (key, now - self.ttl)).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE llm_cache SET accessed = ?, hits = hits + 1 WHERE key = ?",
+                                (now, key))
+        return row[0] if row else None
+
+    def put(self, key: str, answer: str, model: str = None):
+        if self.db is None or not answer:
+            return
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO llm_cache (key, model, answer, created, accessed) "
+                            "VALUES (?, ?, ?, ?, ?)", (key, model, answer, now, now))
+            self.puts += 1
+            if self.puts % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self.db.execute("DELETE FROM llm_cache WHERE created <= ?", (now - self.ttl,))
+        self.db.execute("""
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)
+        """, (self.max_entries,))
+
+    def evict(self):
+        if self.db is not None:
+            with self.lock:
+                self._evict(time.time())
+
+    def clear(self):
+        if self.db is not None:
+            with self.lock:
+                self.db.execute("DELETE FROM llm_cache")
+
+    def info(self) -> dict:
+        out = dict(self.stats, path=self.path, ttl=self.ttl, max_entries=self.max_entries)
+        if self.db is not None:
+            with self.lock:
+                out['entries'] = self.db.execute("SELECT count(*) FROM llm_cache").fetchone()[0]
+        return out
+
+    # 只快取 key 所對應 model 的回答
+    def _store(self, key: str, answer: str, model: str, answered_by: str):
+        if model is None or answered_by == model:
+            self.put(key, answer, model)
+        elif answer:
+            self.stats['fallback'] += 1
+            inc("llm_cache_total", model=model, result="fallback")
+
+    def _hit(self, key, model):
+        cached = self.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            inc("llm_cache_total", model=model, result="hit")
+        return cached
+
+    # 同步版本：第一個請求呼叫 fn()（回傳 (answer, answered_by)），其他 thread 的相同請求等待同一個結果
+    def get_or_call(self, key: str, fn, model: str = None):
+        cached = self._hit(key, model)
+        if cached is not None:
+            return cached
+        with self.lock:
+            fut = self.inflight.get(key)
+            leader = fut is None
+            if leader:
+                # 前一個 leader 可能在上面查完快取後才寫入結果並移出 in-flight，持鎖再查一次
+                cached = self._hit(key, model)
+                if cached is not None:
+                    return cached
+                fut = self.inflight[key] = Future()
+        if not leader:
+            self.stats['coalesced'] += 1
+            inc("llm_cache_total", model=model, result="coalesced")
+            return fut.result()
+        self.stats['misses'] += 1
+        inc("llm_cache_total", model=model, result="miss")
+        try:
+            answer, answered_by = fn()
+            self._store(key, answer, model, answered_by)
+            fut.set_result(answer)
+            return answer
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    # async 版本：coro_fn() 回傳 coroutine（結果為 (answer, answered_by)），
+    # 同一 event loop 內的相同請求共用一個 future
+    async def aget_or_call(self, key: str, coro_fn, model: str = None):
+        cached = self._hit(key, model)
+        if cached is not None:
+            return cached
+        fut = self.ainflight.get(key)
+        if fut is not None:
+            self.stats['coalesced'] += 1
+            inc("llm_cache_total", model=model, result="coalesced")
+            answer, _ = await asyncio.shield(fut)
+            return answer
+        self.stats['misses'] += 1
+        inc("llm_cache_total", model=model, result="miss")
+        fut = asyncio.ensure_future(coro_fn())
+        self.ainflight[key] = fut
+
+        # 呼叫端被取消時上游請求仍會完成，結果照樣寫入快取
+        def done(f):
+            self.ainflight.pop(key, None)
+            if not f.cancelled() and f.exception() is None:
+                answer, answered_by = f.result()
+                self._store(key, answer, model, answered_by)
+        fut.add_done_callback(done)
+        answer, _ = await asyncio.shield(fut)
+        return answer
+
+
+_cache = None
+
+
+def get_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        _cache = LLMCache(LLM_CACHE_PATH if LLM_CACHE else None)
+    return _cache
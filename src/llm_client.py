@@ -0,0 +1,290 @@
+# OpenAI 相容 chat completions client：依序的 model 清單、逾時、hedged request、circuit breaker
+#
+#   LLM_MODELS            逗號分隔，依優先序（第一個為主要 model）
+#   LLM_TIMEOUT           單一上游請求逾時秒數
+#   LLM_HEDGE_DELAY       主要請求超過此秒數仍未回應，就對下一個 model 送出 hedged request，取先成功者；
+#                         "p95" 表示使用該 model 目前的 p95 延遲（至少 LLM_HEDGE_MIN_DELAY），0 表示不 hedge
+#   LLM_BREAKER_FAILURES  連續失敗幾次後打開該 model 的 circuit breaker
+#   LLM_BREAKER_COOLDOWN  breaker 打開後多久放行一次試探請求（half-open）
+#
+# 失敗（逾時、非 200、回應格式錯誤）會立即改用下一個 model；全部失敗才丟出 LLMError。
+# rag_en 使用同步的 complete()（thread），rag_service 使用 acomplete()（aiohttp）；
+# with_model=True 時回傳 (content, 實際回答的 model)，呼叫端可據此決定是否快取。
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from metrics import span, inc, observe
+
+DEFAULT_MODELS = "google/gemini-2.0-flash-exp:free,deepseek/deepseek-chat-v3-0324:free"
+LLM_MODELS = [m.strip() for m in os.getenv('LLM_MODELS', DEFAULT_MODELS).split(',') if m.strip()]
+# RAG_LLM_TIMEOUT 為 rag_service 原本的設定名稱，仍然有效
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', os.getenv('RAG_LLM_TIMEOUT', '60')))
+LLM_HEDGE_DELAY = os.getenv('LLM_HEDGE_DELAY', '8')
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1'))
+LLM_MAX_INFLIGHT = int(os.getenv('LLM_MAX_INFLIGHT', '2'))
+LLM_BREAKER_FAILURES = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+
+
+class LLMError(Exception):
+    pass
+
+
+class ModelState:
+    # 單一 model 的 circuit breaker 與延遲統計
+    def __init__(self, name: str, failures: int, cooldown: float, window: int = 200):
+        self.name = name
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.latencies = deque(maxlen=window)
+        self.failures = 0
+        self.opened_at = None
+        # half-open 時放行的試探請求的 token；None 表示目前沒有試探請求
+        self.probe = None
+        self.counts = {'success': 0, 'failure': 0, 'rejected': 0}
+        self.lock = threading.Lock()
+
+    # 放行時回傳 ticket（試探請求為專屬的 token，結束時帶回 record），不放行回傳 None
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # half-open：cooldown 後只放行一個試探請求
+            if self.probe is None and time.monotonic() - self.opened_at >= self.cooldown:
+                self.probe = object()
+                return self.probe
+            self.counts['rejected'] += 1
+            return None
+
+    def success(self, seconds: float):
+        with self.lock:
+            self.latencies.append(seconds)
+            self.failures = 0
+            self.opened_at = None
+            self.probe = None
+            self.counts['success'] += 1
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.counts['failure'] += 1
+            if self.probe is not None or self.failures >= self.max_failures:
+                if self.opened_at is None or self.probe is not None:
+                    inc("llm_breaker_open_total", model=self.name)
+                self.opened_at = time.monotonic()
+                self.probe = None
+
+    # 試探請求被取消（例如 hedge 輸掉）：沒有結果，釋放試探名額，下一個請求可以再試探；
+    # 其他被取消的請求（breaker 打開前就送出的）不影響目前的試探請求
+    def release(self, ticket):
+        with self.lock:
+            if ticket is not None and ticket is self.probe:
+                self.probe = None
+
+    def percentile(self, q: float):
+        with self.lock:
+            vals = sorted(self.latencies)
+        if not vals:
+            return None
+        return vals[min(len(vals) - 1, int(q * len(vals)))]
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if self.probe is not None else 'open'
+
+    def stats(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {'state': self.state, **self.counts,
+                'p50_ms': round(p50 * 1000, 1) if p50 is not None else None,
+                'p95_ms': round(p95 * 1000, 1) if p95 is not None else None}
+
+
+class LLMClient:
+    def __init__(self, url: str, models: list[str] = None, timeout: float = LLM_TIMEOUT,
+                 hedge_delay: str = LLM_HEDGE_DELAY, hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+                 max_inflight: int = LLM_MAX_INFLIGHT,
+                 breaker_failures: int = LLM_BREAKER_FAILURES,
+                 breaker_cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.url = url
+        self.models = list(models or LLM_MODELS)
+        self.timeout = timeout
+        self.hedge_delay = str(hedge_delay)
+        self.hedge_min_delay = hedge_min_delay
+        self.max_inflight = max(1, max_inflight)
+        self.state = {m: ModelState(m, breaker_failures, breaker_cooldown) for m in self.models}
+        self.session = None
+        self.pool = ThreadPoolExecutor(max_workers=self.max_inflight * 8, thread_name_prefix="llm")
+        self.hedged = 0
+
+    def model_state(self, model: str) -> ModelState:
+        if model not in self.state:
+            self.state[model] = ModelState(model, LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN)
+        return self.state[model]
+
+    # 依序取出下一個 breaker 允許的 model 與其 ticket（要送出時才檢查，避免白白佔用 half-open 的試探名額）
+    def next_model(self, queue: list[str]):
+        while queue:
+            model = queue.pop(0)
+            ticket = self.model_state(model).allow()
+            if ticket is not None:
+                return model, ticket
+        return None, None
+
+    def delay_for(self, model: str):
+        if self.hedge_delay in ('', '0', 'off'):
+            return None
+        if self.hedge_delay == 'p95':
+            p95 = self.model_state(model).percentile(0.95)
+            return max(self.hedge_min_delay, p95) if p95 is not None else self.hedge_min_delay * 4
+        return float(self.hedge_delay)
+
+    def parse(self, model: str, status: int, body) -> str:
+        if status != 200:
+            raise LLMError(f"{model}: HTTP {status}: {str(body)[:200]}")
+        try:
+            content = body["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            raise LLMError(f"{model}: malformed response: {str(body)[:200]}")
+        if not content:
+            raise LLMError(f"{model}: empty response")
+        return content
+
+    def record(self, model: str, t0: float, error: Exception = None, status=None, ticket=None):
+        seconds = time.perf_counter() - t0
+        outcome = 'cancelled' if isinstance(error, asyncio.CancelledError) else ('error' if error else 'ok')
+        inc("llm_requests_total", model=model, status=status if status is not None else outcome)
+        if error is None:
+            self.model_state(model).success(seconds)
+            observe("llm_latency_seconds", seconds, model=model)
+        elif isinstance(error, asyncio.CancelledError):
+            self.model_state(model).release(ticket)
+        else:
+            self.model_state(model).failure()
+
+    # ---- 同步（requests + thread pool）----
+    def _post(self, model: str, headers: dict, data: dict, ticket=None) -> str:
+        import requests
+        if self.session is None:
+            self.session = requests.Session()
+        t0 = time.perf_counter()
+        status = None
+        try:
+            with span("llm.chat", model=model) as sp:
+                resp = self.session.post(self.url, headers=headers, json=dict(data, model=model),
+                                         timeout=self.timeout)
+                status = resp.status_code
+                sp.set(status=status, prompt_chars=len(data["messages"][-1]["content"]))
+            body = resp.json() if status == 200 else resp.text
+            content = self.parse(model, status, body)
+        except Exception as e:
+            self.record(model, t0, e, status, ticket)
+            raise
+        self.record(model, t0, status=status, ticket=ticket)
+        return content
+
+    def complete(self, headers: dict, data: dict, models: list[str] = None, with_model: bool = False):
+        queue = list(models or self.models)
+        pending, errors = {}, []
+
+        def launch():
+            model, ticket = self.next_model(queue)
+            if model is not None:
+                pending[self.pool.submit(self._post, model, headers, data, ticket)] = model
+
+        launch()
+        if not pending:
+            raise LLMError(f"all models unavailable (circuit open): {', '.join(models or self.models)}")
+        while pending:
+            hedge = self.delay_for(next(iter(pending.values())))
+            can_hedge = queue and len(pending) < self.max_inflight and hedge is not None
+            done, _ = wait(pending, timeout=hedge if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                self.hedged += 1
+                inc("llm_hedged_total")
+                launch()
+                continue
+            for fut in done:
+                model = pending.pop(fut)
+                try:
+                    # 較慢的另一個請求留在背景完成，只用來更新統計
+                    content = fut.result()
+                    return (content, model) if with_model else content
+                except Exception as e:
+                    errors.append(str(e))
+                    if queue:
+                        launch()
+        raise LLMError("; ".join(errors) or "no model attempted")
+
+    # ---- async（aiohttp）----
+    async def _apost(self, http, model: str, headers: dict, data: dict, ticket=None) -> str:
+        import aiohttp
+        t0 = time.perf_counter()
+        status = None
+        try:
+            with span("llm.chat", model=model) as sp:
+                async with http.post(self.url, headers=headers, json=dict(data, model=model),
+                                     timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                    status = resp.status
+                    sp.set(status=status)
+                    body = await resp.json() if status == 200 else await resp.text()
+            content = self.parse(model, status, body)
+        except BaseException as e:
+            self.record(model, t0, e, status, ticket)
+            raise
+        self.record(model, t0, status=status, ticket=ticket)
+        return content
+
+    async def acomplete(self, http, headers: dict, data: dict, models: list[str] = None,
+                        with_model: bool = False):
+        queue = list(models or self.models)
+        pending, errors = {}, []
+
+        def launch():
+            model, ticket = self.next_model(queue)
+            if model is not None:
+                pending[asyncio.ensure_future(self._apost(http, model, headers, data, ticket))] = model
+
+        launch()
+        if not pending:
+            raise LLMError(f"all models unavailable (circuit open): {', '.join(models or self.models)}")
+        try:
+            while pending:
+                hedge = self.delay_for(next(iter(pending.values())))
+                can_hedge = queue and len(pending) < self.max_inflight and hedge is not None
+                done, _ = await asyncio.wait(pending, timeout=hedge if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged += 1
+                    inc("llm_hedged_total")
+                    launch()
+                    continue
+                for task in done:
+                    model = pending.pop(task)
+                    if task.exception() is None:
+                        return (task.result(), model) if with_model else task.result()
+                    errors.append(str(task.exception()))
+                    if queue:
+                        launch()
+            raise LLMError("; ".join(errors) or "no model attempted")
+        finally:
+            # 已有結果就取消其餘請求，避免佔用 LLM 並行額度
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {'models': {m: s.stats() for m, s in self.state.items()}, 'hedged': self.hedged}
+
+
+_clients = {}
+
+
+def get_client(url: str) -> LLMClient:
+    if url not in _clients:
+        _clients[url] = LLMClient(url)
+    return _clients[url]
@@ -0,0 +1,275 @@
+# 輕量 metrics / tracing：counter、histogram 與 span
+#
+# 預設關閉（METRICS_EXPORT 未設定時 span() 直接回傳共用的 no-op 物件，熱迴圈幾乎零成本）
+#   METRICS_EXPORT=summary                         只印出結束時的統計表（啟用時一律會印）
+#   METRICS_EXPORT=prometheus:/path/to/rag.prom    寫出 Prometheus textfile（node_exporter textfile collector）
+#   METRICS_EXPORT=otlp:http://localhost:4318      以 OTLP/HTTP JSON 送出 metrics 與 traces
+# 多個目標可用逗號分隔，例如 "summary,prometheus:/tmp/rag.prom"
+import atexit
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+import uuid
+
+METRICS_EXPORT = os.getenv('METRICS_EXPORT', '').strip()
+SERVICE_NAME = os.getenv('METRICS_SERVICE', os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0])
+MAX_SPANS = int(os.getenv('METRICS_MAX_SPANS', '20000'))
+ENABLED = bool(METRICS_EXPORT)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}   # key -> [bucket_counts, sum, count]
+_spans: list[dict] = []
+_current = contextvars.ContextVar('metrics_span', default=None)
+_start_ns = time.time_ns()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        i = 0
+        while i < len(BUCKETS) and value > BUCKETS[i]:
+            i += 1
+        h[0][i] += 1
+        h[1] += value
+        h[2] += 1
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+        self.attrs = {}
+        self.parent = None
+        self.trace_id = None
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = _current.get()
+        self.trace_id = self.parent.trace_id if self.parent else uuid.uuid4().hex
+        self._token = _current.set(self)
+        self._t0 = time.perf_counter()
+        self._start_ns = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._t0
+        _current.reset(self._token)
+        metric = self.name.replace('.', '_').replace('-', '_')
+        observe(f"{metric}_seconds", elapsed, **self.labels)
+        if exc_type is not None:
+            inc(f"{metric}_errors_total", **self.labels)
+        record = {
+            'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent else None,
+            'start_ns': self._start_ns, 'end_ns': self._start_ns + int(elapsed * 1e9),
+            'attrs': {**self.labels, **self.attrs},
+            'error': repr(exc) if exc_type is not None else None,
+        }
+        with _lock:
+            if len(_spans) < MAX_SPANS:
+                _spans.append(record)
+        return False
+
+
+# 以 with span("qdrant.upsert", collection=name) as sp: ... 量測一段程式
+# labels 會成為 histogram 標籤（請保持低基數）；sp.set() 的屬性只記在 trace 上
+def span(name: str, **labels):
+    if not ENABLED:
+        return NOOP
+    return Span(name, labels)
+
+
+# 整個函式就是一個 span 時用 @traced("db.write", table="ticker")（同步函式；需要 sp.set() 時用 span）
+def traced(name: str, **labels):
+    def deco(fn):
+        if not ENABLED:
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            with Span(name, labels):
+                return fn(*a, **kw)
+        return wrapper
+    return deco
+
+
+# ---------- 匯出 ----------
+
+def _fmt_labels(labels: tuple, extra: str = '') -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def prometheus_text() -> str:
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+    typed = set()
+    for (name, labels), val in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_fmt_labels(labels)} {val}")
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cum = 0
+        for bound, n in zip(BUCKETS + (float('inf'),), buckets):
+            cum += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            le_label = 'le="' + le + '"'
+            lines.append(f"{name}_bucket{_fmt_labels(labels, le_label)} {cum}")
+        lines.append(f"{name}_sum{_fmt_labels(labels)} {total}")
+        lines.append(f"{name}_count{_fmt_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str):
+    # textfile collector 要求原子寫入
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+
+def _otlp_attrs(labels) -> list:
+    items = labels.items() if isinstance(labels, dict) else labels
+    return [{'key': k, 'value': {'stringValue': str(v)}} for k, v in items]
+
+
+def export_otlp(endpoint: str):
+    import requests
+    now = str(time.time_ns())
+    start = str(_start_ns)
+    resource = {'attributes': _otlp_attrs({'service.name': SERVICE_NAME})}
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        spans = list(_spans)
+    metrics = {}
+    for (name, labels), val in counters.items():
+        m = metrics.setdefault(name, {'name': name, 'sum': {
+            'dataPoints': [], 'aggregationTemporality': 2, 'isMonotonic': True}})
+        m['sum']['dataPoints'].append({'attributes': _otlp_attrs(labels), 'asDouble': val,
+                                       'startTimeUnixNano': start, 'timeUnixNano': now})
+    for (name, labels), (buckets, total, count) in histograms.items():
+        m = metrics.setdefault(name, {'name': name, 'unit': 's', 'histogram': {
+            'dataPoints': [], 'aggregationTemporality': 2}})
+        m['histogram']['dataPoints'].append({
+            'attributes': _otlp_attrs(labels), 'count': str(count), 'sum': total,
+            'bucketCounts': [str(b) for b in buckets], 'explicitBounds': list(BUCKETS),
+            'startTimeUnixNano': start, 'timeUnixNano': now})
+    scope = {'name': 'financial-report-rag'}
+    base = endpoint.rstrip('/')
+    requests.post(f"{base}/v1/metrics", timeout=10, json={'resourceMetrics': [{
+        'resource': resource,
+        'scopeMetrics': [{'scope': scope, 'metrics': list(metrics.values())}]}]})
+    if spans:
+        requests.post(f"{base}/v1/traces", timeout=10, json={'resourceSpans': [{
+            'resource': resource,
+            'scopeSpans': [{'scope': scope, 'spans': [{
+                'traceId': s['trace_id'], 'spanId': s['span_id'],
+                'parentSpanId': s['parent_id'] or '', 'name': s['name'], 'kind': 1,
+                'startTimeUnixNano': str(s['start_ns']), 'endTimeUnixNano': str(s['end_ns']),
+                'attributes': _otlp_attrs(s['attrs']),
+                'status': {'code': 2, 'message': s['error']} if s['error'] else {'code': 1},
+            } for s in spans]}]}]})
+
+
+def summary_table() -> str:
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+    if not histograms and not counters:
+        return ''
+    rows = []
+    for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+        label = name[:-len('_seconds')] if name.endswith('_seconds') else name
+        if labels:
+            label += ' ' + ','.join(f"{k}={v}" for k, v in labels)
+        # 由 bucket 估計 p95（取所在 bucket 上界）
+        target, cum, p95 = 0.95 * count, 0, float('inf')
+        for bound, n in zip(BUCKETS + (float('inf'),), buckets):
+            cum += n
+            if cum >= target:
+                p95 = bound
+                break
+        rows.append((label, count, total, total / count if count else 0.0, p95))
+    counter_rows = [(name + (' ' + ','.join(f"{k}={v}" for k, v in labels) if labels else ''), val)
+                    for (name, labels), val in sorted(counters.items())]
+    width = max([len(r[0]) for r in rows + counter_rows] + [20])
+    out = [f"{'span':<{width}} {'count':>8} {'total s':>10} {'mean ms':>10} {'p95 ≤ ms':>10}"]
+    for label, count, total, mean, p95 in rows:
+        p95s = 'inf' if p95 == float('inf') else f"{p95 * 1000:.0f}"
+        out.append(f"{label:<{width}} {count:>8} {total:>10.3f} {mean * 1000:>10.2f} {p95s:>10}")
+    for label, val in counter_rows:
+        out.append(f"{label:<{width}} {val:>8g}")
+    return "\n".join(out)
+
+
+# 結束時呼叫：一律印出統計表，再依 METRICS_EXPORT 匯出
+def flush():
+    table = summary_table()
+    if table:
+        print("\n[METRICS]\n" + table)
+    for target in [t.strip() for t in METRICS_EXPORT.split(',') if t.strip()]:
+        kind, _, arg = target.partition(':')
+        try:
+            if kind == 'summary':
+                continue
+            if kind == 'prometheus':
+                write_prometheus(arg or f"{SERVICE_NAME}.prom")
+            elif kind == 'otlp':
+                export_otlp(arg or 'http://localhost:4318')
+            else:
+                print(f"[WARNING] 未知的 METRICS_EXPORT 目標：{target}")
+        except Exception as e:
+            print(f"[WARNING] metrics 匯出失敗 {target}: {e}")
+
+
+if ENABLED:
+    atexit.register(flush)
@@ -3,13 +3,16 @@ import os
 import sys
 import json
 import argparse
-import requests
 import psycopg2
 import uuid
+import hashlib
 from psycopg2 import sql
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import VectorParams, Distance, PointStruct
+from metrics import span, inc, traced
+import fact_store
+import derived_metrics
+from embedders import get_embedder
+from index_profiles import INDEX_PROFILES, get_profile, collection_kwargs, update_kwargs
 
 load_dotenv()
 
@@ -21,13 +24,27 @@ DB_PARAMS = {
     'password': os.getenv('DB_PASSWORD'),
 }
 
-OLLAMA_URL = 'http://localhost:11434'
-QDRANT_URL = 'http://localhost:6333'
+QDRANT_URL = os.getenv('QDRANT_URL', 'http://localhost:6333')
+# facts 來源：db（PostgreSQL）或 parquet（fact_export 匯出的 Parquet / Arrow 檔，memory-mapped 讀取）
+FACT_SOURCE = os.getenv('FACT_SOURCE', 'db')
+# chunk 大小上限（字元）；0 表示整份報告一個 chunk。變更後需以 embed --reset 重建 collection
+CHUNK_MAX_CHARS = int(os.getenv('CHUNK_MAX_CHARS', '0'))
 
-qdrant = QdrantClient(url=QDRANT_URL, prefer_grpc=False)
+# Qdrant client 延遲到第一次使用才建立（benchmark 可直接指定 pipeline.qdrant）
+qdrant = None
+
+def get_qdrant():
+    global qdrant
+    if qdrant is None:
+        from qdrant_client import QdrantClient
+        qdrant = QdrantClient(url=QDRANT_URL, prefer_grpc=False)
+    return qdrant
 
 # 列出所有 ticker table
 def list_ticker_tables() -> list[str]:
+    if FACT_SOURCE == 'parquet':
+        import fact_export
+        return fact_export.list_tickers()
     conn = psycopg2.connect(**DB_PARAMS)
     cur = conn.cursor()
     cur.execute("""
@@ -41,8 +58,26 @@ def list_ticker_tables() -> list[str]:
     conn.close()
     return tables
 
+# facts → 可讀文本；facts 可為舊格式的 {tag: props}，或 fact_store 去重後的 fact list（含期間）
+def report_text(report: str, facts) -> str:
+    lines = [f"Report: {report}"]
+    items = facts.items() if isinstance(facts, dict) else ((f['concept'], f) for f in facts)
+    for tag, props in items:
+        val  = props.get('value', '')
+        unit = props.get('unitRef') or props.get('unit') or ''
+        if props.get('period'):
+            label = props['period'] + (f"; {props['dims']}" if props.get('dims') else '')
+            tag = f"{tag} [{label}]"
+        lines.append(f"{tag}: {val} {unit}".strip())
+    return "\n".join(lines)
+
 # ETL：Extract JSONB → 可讀文本
+# facts 為 NULL 的報告是去重寫入的，改由 fact_store 重建（只含該報告擁有的 fact）
 def extract_reports(ticker: str):
+    if FACT_SOURCE == 'parquet':
+        import fact_export
+        yield from fact_export.extract_reports(ticker)
+        return
     conn = psycopg2.connect(**DB_PARAMS)
     cur = conn.cursor()
     try:
@@ -50,89 +85,184 @@ def extract_reports(ticker: str):
         query = sql.SQL("SELECT report, facts FROM {}").format(
             sql.Identifier(ticker)
         )
-        cur.execute(query)
-        for report, facts_jsonb in cur.fetchall():
-            facts = facts_jsonb
-            lines = [f"Report: {report}"]
-            for tag, props in facts.items():
-                val  = props.get('value', '')
-                unit = props.get('unitRef') or ''
-                lines.append(f"{tag}: {val} {unit}".strip())
-            yield report, "\n".join(lines)
+        with span("db.query", query="extract_reports"):
+            cur.execute(query)
+            rows = cur.fetchall()
+        deduped = None
+        for report, facts_jsonb in rows:
+            if facts_jsonb is not None:
+                yield report, report_text(report, facts_jsonb)
+                continue
+            if deduped is None:
+                deduped = fact_store.report_facts(cur, ticker)
+            facts, refs = deduped.get(report, ([], []))
+            if facts:
+                yield report, fact_store.report_text(report, facts, refs)
     finally:
         cur.close()
         conn.close()
 
+# 每份報告的衍生指標文字（derived_metrics 預先計算）
+def report_metrics(ticker: str) -> dict:
+    if FACT_SOURCE == 'parquet':
+        import fact_export
+        return fact_export.report_metrics(ticker)
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            return derived_metrics.report_metrics(cur, ticker)
+    finally:
+        conn.close()
+
 # Chunking + Embedding → Upsert Qdrant
-def chunk_text(text: str) -> list[str]:
-    return [text]
+# 超過 max_chars 時依行切分（不切斷單一 fact），每個 chunk 都保留第一行 "Report: ..." 標題
+def chunk_text(text: str, max_chars: int = None) -> list[str]:
+    max_chars = CHUNK_MAX_CHARS if max_chars is None else max_chars
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+    header, _, body = text.partition("\n")
+    chunks, lines, size = [], [], len(header)
+    for line in body.split("\n"):
+        if lines and size + 1 + len(line) > max_chars:
+            chunks.append("\n".join([header] + lines))
+            lines, size = [], len(header)
+        lines.append(line)
+        size += 1 + len(line)
+    if lines:
+        chunks.append("\n".join([header] + lines))
+    return chunks
 
 def embed(texts: list[str]) -> list[list[float]]:
-    embeddings = []
-    for text in texts:
-        resp = requests.post(
-            f"{OLLAMA_URL}/api/embeddings",
-            json={
-                #"model": "llama3:latest",
-                "model": "nomic-embed-text",
-                "prompt": text
-            }
-        )
-        resp.raise_for_status()
-        # Ollama 回傳的欄位是 "embedding"
-        embeddings.append(resp.json()["embedding"])
-    return embeddings
-
-def ensure_collection(name: str, vector_size: int, reset: bool=False):
-    # 若要重置，先刪除已存在的 collection
-    if reset and qdrant.collection_exists(collection_name=name):
-        qdrant.delete_collection(collection_name=name)
-    # 若 collection 不存在，才建立新 collection
-    if not qdrant.collection_exists(collection_name=name):
-        qdrant.create_collection(
-            collection_name=name,
-            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
-        )
+    # backend 由 EMBED_BACKEND 決定（ollama / onnx），整批一次送出
+    return get_embedder().embed(texts).tolist()
 
-def upsert_chunks(ticker: str, reset: bool=False):
-    for report, text in extract_reports(ticker):
-        collection_name = report.lower()
-        created = False
+def ensure_collection(name: str, vector_size: int, reset: bool=False, profile: str=None):
+    client = get_qdrant()
+    with span("qdrant.ensure_collection") as sp:
+        if reset and client.collection_exists(collection_name=name):
+            client.delete_collection(collection_name=name)
+        # 若 collection 不存在，才依 index profile 建立新 collection
+        if not client.collection_exists(collection_name=name):
+            client.create_collection(
+                collection_name=name,
+                **collection_kwargs(vector_size, get_profile(profile)),
+            )
+        sp.set(collection=name, reset=reset)
+
+# 將 index profile 套用到既有 collection（量化 / on-disk / HNSW），不需重新 embed
+@traced("qdrant.update_collection")
+def apply_profile(name: str, profile: str=None):
+    get_qdrant().update_collection(collection_name=name, **update_kwargs(get_profile(profile)))
+
+# 不在 ids 內的 point（chunk 數變少、衍生指標 chunk 換了位置或消失時留下的舊 point）
+def stale_filter(ids: list[str]):
+    from qdrant_client.http.models import Filter, HasIdCondition
+    return Filter(must_not=[HasIdCondition(has_id=ids)])
 
-        for idx, chunk in enumerate(chunk_text(text)):
-            # 第一次 embed 時建立 collection
-            if not created:
-                emb0 = embed([chunk])[0]
-                ensure_collection(collection_name, len(emb0), reset=reset)
-                created = True
+# 一份報告要寫入的 chunk：比對 content hash，todo 只留下內容有變、需要重新 embed 的 chunk；
+# stale 為 collection 內已不屬於這份報告的舊 point 數，寫入時刪除
+def plan_report(ticker: str, report: str, text: str, derived_text: str=None, reset: bool=False) -> dict:
+    client = get_qdrant()
+    collection_name = report.lower()
+    chunks = chunk_text(text)
+    kinds = ["facts"] * len(chunks)
+    # 衍生指標另成一個精簡 chunk，放在原始 fact chunk 之後（不影響既有 point ID）
+    if derived_text:
+        chunks.append(derived_text)
+        kinds.append("metrics")
 
-            emb = embed([chunk])[0]
+    # 用 UUID v5 產生合法且可重現的 point ID
+    ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{ticker}_{report}_{idx}"))
+           for idx in range(len(chunks))]
 
-            # 用 UUID v5 產生合法且可重現的 point ID
-            raw_id = f"{ticker}_{report}_{idx}"
-            point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, raw_id))
+    hashes = [hashlib.sha1(c.encode('utf-8')).hexdigest() for c in chunks]
 
-            # 用 retrieve() 取代舊的 get() 方法
-            existing_points = qdrant.retrieve(
+    # 一次 retrieve 整份報告的 point，內容未變的 chunk 不再 embed
+    # （去重後報告擁有的 fact 可能因新載入的報告而改變，內容不同就重新 embed 覆寫）
+    existing, stale = set(), 0
+    if not reset and client.collection_exists(collection_name=collection_name):
+        with span("qdrant.retrieve"):
+            existing = {f"{p.id}:{(p.payload or {}).get('content_hash')}" for p in client.retrieve(
                 collection_name=collection_name,
-                ids=[point_id],
-                with_payload=False,
+                ids=ids,
+                with_payload=["content_hash"],
                 with_vectors=False
-            )
-            if existing_points:
-                print(f"• {report} (UUID: {point_id}) exist,skip")
-                continue
+            )}
+            stale = client.count(collection_name=collection_name, count_filter=stale_filter(ids),
+                                 exact=True).count
+    existing = {point_id for point_id, h in zip(ids, hashes) if f"{point_id}:{h}" in existing}
+    for point_id in ids:
+        if point_id in existing:
+            print(f"• {report} (UUID: {point_id}) exist,skip")
+    todo = [idx for idx, point_id in enumerate(ids) if point_id not in existing]
+    return {"ticker": ticker, "report": report, "collection": collection_name, "ids": ids,
+            "chunks": chunks, "kinds": kinds, "hashes": hashes, "todo": todo, "stale": stale}
+
+# plan 中待寫入的 chunk 與其向量（順序同 plan["todo"]）寫入 Qdrant；第一次取得維度後建立 collection
+def write_report(plan: dict, vectors: list[list[float]], reset: bool=False, profile: str=None):
+    from qdrant_client.http.models import PointStruct, FilterSelector
+    collection_name, ids, todo = plan["collection"], plan["ids"], plan["todo"]
+    if plan.get("stale"):
+        with span("qdrant.delete") as sp:
+            get_qdrant().delete(collection_name=collection_name,
+                                points_selector=FilterSelector(filter=stale_filter(ids)))
+            sp.set(collection=collection_name, points=plan["stale"])
+        inc("qdrant_points_deleted_total", plan["stale"])
+        print(f"• {plan['report']} 刪除 {plan['stale']} 個舊 point")
+    if not todo:
+        return
+    ensure_collection(collection_name, len(vectors[0]), reset=reset, profile=profile)
 
-            # 組裝並上傳新點
-            payload = {
-                "ticker": ticker,
-                "report": report,
-                "chunk_index": idx,
-                "text": chunk
-            }
-            point = PointStruct(id=point_id, vector=emb, payload=payload)
-            qdrant.upsert(collection_name=collection_name, points=[point])
-            print(f"• {report} (UUID: {point_id}) upload")
+    # 組裝並上傳新點
+    points = [
+        PointStruct(id=ids[idx], vector=vec, payload={
+            "ticker": plan["ticker"],
+            "report": plan["report"],
+            "chunk_index": idx,
+            "kind": plan["kinds"][idx],
+            "text": plan["chunks"][idx],
+            "content_hash": plan["hashes"][idx]
+        })
+        for idx, vec in zip(todo, vectors)
+    ]
+    with span("qdrant.upsert") as sp:
+        get_qdrant().upsert(collection_name=collection_name, points=points)
+        sp.set(collection=collection_name, points=len(points))
+    inc("qdrant_points_upserted_total", len(points))
+    for idx in todo:
+        print(f"• {plan['report']} (UUID: {ids[idx]}) upload")
+
+# 去重後不再擁有任何 fact 的報告不會出現在 extract_reports，清掉它 collection 內的舊 point
+def drop_orphans(ticker: str, reports) -> int:
+    from qdrant_client.http.models import FilterSelector
+    client = get_qdrant()
+    keep = {r.lower() for r in reports}
+    dropped = 0
+    for c in client.get_collections().collections:
+        if not c.name.startswith(f"{ticker.lower()}_") or c.name in keep:
+            continue
+        n = client.count(collection_name=c.name, exact=True).count
+        if n:
+            with span("qdrant.delete") as sp:
+                client.delete(collection_name=c.name, points_selector=FilterSelector(filter=stale_filter([])))
+                sp.set(collection=c.name, points=n)
+            inc("qdrant_points_deleted_total", n)
+            print(f"• {c.name} 已無擁有的 fact，刪除 {n} 個舊 point")
+            dropped += n
+    return dropped
+
+def upsert_chunks(ticker: str, reset: bool=False, profile: str=None):
+    derived = report_metrics(ticker)
+    reports = []
+    for report, text in extract_reports(ticker):
+        reports.append(report)
+        plan = plan_report(ticker, report, text, derived.get(report), reset=reset)
+        if not plan["todo"] and not plan["stale"]:
+            continue
+        # 整份報告的 chunk 批次 embed
+        vectors = embed([plan["chunks"][idx] for idx in plan["todo"]]) if plan["todo"] else []
+        write_report(plan, vectors, reset=reset, profile=profile)
+    drop_orphans(ticker, reports)
 
 def main():
     parser = argparse.ArgumentParser(description="ETL + Embedding Pipeline")
@@ -151,11 +281,26 @@ def main():
         help="對所有 ticker table 都執行 upsert")
     p2.add_argument("--reset", action="store_true",
         help="先清除舊的向量資料（刪除 collection）再上傳")
+    p2.add_argument("--profile", choices=list(INDEX_PROFILES),
+        help="新建 collection 使用的 index profile（預設 QDRANT_INDEX_PROFILE）")
     p2.add_argument("ticker", nargs="?",
         help="指定單一 ticker，例如 AAPL")
 
+    # reindex
+    p3 = sub.add_parser("reindex", help="將 index profile 套用到既有 collection")
+    p3.add_argument("--profile", choices=list(INDEX_PROFILES), required=True)
+    p3.add_argument("collections", nargs="*",
+        help="指定 collection，未指定則套用到全部")
+
     args = parser.parse_args()
 
+    if args.cmd == "reindex":
+        names = args.collections or [c.name for c in get_qdrant().get_collections().collections]
+        for name in names:
+            apply_profile(name, args.profile)
+            print(f"• {name} -> {args.profile}")
+        return
+
     if args.cmd == "extract" or args.cmd == "upsert":
         if args.all:
             tickers = list_ticker_tables()
@@ -172,7 +317,7 @@ def main():
                 for report, text in extract_reports(tk):
                     print(f"\n--- {report} ---\n{text}\n")
             else:
-                upsert_chunks(tk, reset=args.reset)
+                upsert_chunks(tk, reset=args.reset, profile=args.profile)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# 查詢路由：從問題文字抽出 ticker / 公司名稱 / 財報期間 / 表單類型，縮小要搜尋的 collection
+#
+# 字典來自 ticker CSV（TICKER_CSV_PATH 的 Name / Ticker / Found_Name 欄）與 SEC company_tickers.json
+# 的本機副本（SEC_TICKER_MAP，可用 `python cli.py route --refresh-map` 下載），只在第一次使用時載入。
+# collection 名稱為 <ticker>_<YYYY>q<N> 或 <ticker>_<YYYY>q4&annual，因此路由結果直接是 collection 清單；
+# 條件過嚴找不到時依序放寬（先去掉期間、再去掉公司），完全無法判斷則回到原本的全部範圍。
+#
+#   python query_router.py "How did Apple's revenue change in Q3 2024?"
+import os
+import re
+import csv
+import sys
+import json
+from datetime import date
+from dotenv import load_dotenv
+from metrics import span, inc
+
+load_dotenv()
+
+TICKER_CSV = os.getenv('TICKER_CSV_PATH', '../csv/global_ticker.csv')
+SEC_TICKER_MAP = os.getenv('SEC_TICKER_MAP', '../csv/company_tickers.json')
+ROUTING = os.getenv('RAG_ROUTING', '1') != '0'
+
+# 看起來像 ticker 但多半是一般英文或財報術語的大寫字
+STOPWORDS = {
+    "A", "I", "AN", "AS", "AT", "BE", "BY", "DO", "GO", "IF", "IN", "IS", "IT", "ME", "MY", "NO",
+    "OF", "ON", "OR", "SO", "TO", "UP", "US", "WE", "ALL", "AND", "ANY", "ARE", "CAN", "FOR",
+    "HAS", "HOW", "NEW", "NOW", "ONE", "OUT", "THE", "TWO", "WAS", "WHO", "WHY", "CEO", "CFO",
+    "EPS", "FY", "GAAP", "IPO", "SEC", "USD", "YOY", "QOQ", "ROE", "ROA", "EBIT", "EBITDA",
+    "Q", "K", "TTM", "YTD",
+}
+NAME_SUFFIXES = {
+    "inc", "incorporated", "corp", "corporation", "co", "company", "ltd", "limited", "plc",
+    "llc", "lp", "holdings", "holding", "group", "sa", "nv", "ag", "the", "class", "cl",
+}
+ORDINALS = {"first": 1, "1st": 1, "second": 2, "2nd": 2, "third": 3, "3rd": 3,
+            "fourth": 4, "4th": 4}
+MONTHS = {m: i for i, m in enumerate(
+    ["january", "february", "march", "april", "may", "june", "july", "august",
+     "september", "october", "november", "december"], start=1)}
+
+COLLECTION_RE = re.compile(r"^(?P<ticker>.+?)_(?P<year>\d{4})q(?P<q>[1-4])(?P<annual>&annual)?$")
+TICKER_RE = re.compile(r"(?<![\w$])\$?[A-Z][A-Z.\-]{0,5}(?![\w])")
+WORD_RE = re.compile(r"[a-z0-9&]+")
+
+QUARTER_PATTERNS = [
+    re.compile(r"\bq([1-4])\s*(?:fy\s*)?'?(\d{4}|\d{2})\b"),              # Q3 2024, Q3'24, Q3 FY24
+    re.compile(r"\b(\d{4})\s*-?\s*q([1-4])\b"),                             # 2024Q3, 2024 Q3
+    re.compile(r"\b([1-4])q\s*'?(\d{4}|\d{2})\b"),                          # 3Q24
+    re.compile(r"\b(first|second|third|fourth|1st|2nd|3rd|4th)\s+(?:fiscal\s+)?quarter"
+               r"(?:\s+(?:of|in|for))?(?:\s+(?:fiscal|fy))?\s+'?(\d{4}|\d{2})\b"),
+]
+DATE_PATTERNS = [
+    re.compile(r"\b(\d{4})-(\d{2})-\d{2}\b"),                              # 2024-09-30
+    re.compile(r"\b(" + "|".join(MONTHS) + r")\s+\d{1,2},?\s+(\d{4})\b"),   # September 30, 2024
+]
+FISCAL_YEAR_RE = re.compile(r"\b(?:fy|fiscal(?:\s+year)?)\s*'?(\d{4}|\d{2})\b")
+YEAR_RE = re.compile(r"\b(19\d{2}|20\d{2})\b")
+# 年度區間：between 2022 and 2024、from FY2021 to FY2023、since 2022（到今年）
+RANGE_RE = re.compile(r"\b(?:between|from)\s+(?:fy\s*|fiscal\s+(?:year\s+)?)?(\d{4})\s+"
+                      r"(?:and|to|through|until|-)\s+(?:fy\s*|fiscal\s+(?:year\s+)?)?(\d{4})\b")
+SINCE_RE = re.compile(r"\b(?:since|after)\s+(?:fy\s*|fiscal\s+(?:year\s+)?)?(\d{4})\b")
+MAX_RANGE_YEARS = 20
+ANNUAL_RE = re.compile(r"\b(?:10-?k|annual(?:\s+report)?|full[-\s]year)\b")
+QUARTERLY_RE = re.compile(r"\b(?:10-?q|quarterly)\b")
+
+_dictionary = None
+
+
+def normalize_name(name: str) -> tuple[str, ...]:
+    words = WORD_RE.findall(name.lower().replace("'s", ""))
+    while words and words[-1] in NAME_SUFFIXES:
+        words.pop()
+    while words and words[0] == "the":
+        words.pop(0)
+    return tuple(words)
+
+
+def load_dictionary(csv_path: str = None, sec_map: str = None) -> dict:
+    names = {}
+    csv_path = csv_path or TICKER_CSV
+    if os.path.exists(csv_path):
+        with open(csv_path, newline="", encoding="utf-8") as fh:
+            for row in csv.DictReader(fh):
+                tk = (row.get("Ticker") or "").strip().lower()
+                if not tk:
+                    continue
+                for col in ("Name", "Found_Name"):
+                    if row.get(col):
+                        names.setdefault(normalize_name(row[col]), tk)
+    sec_map = sec_map or SEC_TICKER_MAP
+    if os.path.exists(sec_map):
+        with open(sec_map, encoding="utf-8") as fh:
+            for item in json.load(fh).values():
+                names.setdefault(normalize_name(item["title"]), item["ticker"].lower())
+    # 單字公司名太短容易誤判（例如 "one"），至少 4 個字元
+    names = {k: v for k, v in names.items() if k and (len(k) > 1 or len(k[0]) >= 4)}
+    return {"names": names, "max_words": max((len(k) for k in names), default=1)}
+
+
+def get_dictionary() -> dict:
+    global _dictionary
+    if _dictionary is None:
+        _dictionary = load_dictionary()
+    return _dictionary
+
+
+def full_year(y: str) -> int:
+    return int(y) if len(y) == 4 else 2000 + int(y)
+
+
+# 問題 → {"tickers", "periods": {(year, quarter or None)}, "annual": True / False / None}
+def parse(question: str, known_tickers: set, dictionary: dict = None) -> dict:
+    dictionary = dictionary or get_dictionary()
+    tickers = set()
+    for tok in TICKER_RE.findall(question):
+        raw = tok.lstrip("$")
+        if raw.lower() in known_tickers and (tok.startswith("$") or raw not in STOPWORDS):
+            tickers.add(raw.lower())
+
+    words = WORD_RE.findall(question.lower().replace("'s", ""))
+    names = dictionary["names"]
+    for n in range(min(dictionary["max_words"], len(words)), 0, -1):
+        for i in range(len(words) - n + 1):
+            tk = names.get(tuple(words[i:i + n]))
+            if tk and tk in known_tickers:
+                tickers.add(tk)
+
+    text = question.lower()
+    periods = set()
+    for pat in QUARTER_PATTERNS:
+        for m in pat.finditer(text):
+            a, b = m.groups()
+            if pat is QUARTER_PATTERNS[1]:
+                periods.add((int(a), int(b)))
+            elif a in ORDINALS:
+                periods.add((full_year(b), ORDINALS[a]))
+            else:
+                periods.add((full_year(b), int(a)))
+            text = text.replace(m.group(0), " ")
+    for pat in DATE_PATTERNS:
+        for m in pat.finditer(text):
+            a, b = m.groups()
+            year, month = (int(a), int(b)) if a.isdigit() else (int(b), MONTHS[a])
+            periods.add((year, (month - 1) // 3 + 1))
+            text = text.replace(m.group(0), " ")
+    for pat in (RANGE_RE, SINCE_RE):
+        for m in pat.finditer(text):
+            first = int(m.group(1))
+            last = int(m.group(2)) if pat is RANGE_RE else date.today().year
+            first, last = min(first, last), max(first, last)
+            periods.update((y, None) for y in range(first, min(last, first + MAX_RANGE_YEARS) + 1))
+            text = text.replace(m.group(0), " ")
+    annual = True if ANNUAL_RE.search(text) else (False if QUARTERLY_RE.search(text) else None)
+    for m in FISCAL_YEAR_RE.finditer(text):
+        periods.add((full_year(m.group(1)), None))
+        annual = True if annual is None else annual
+        text = text.replace(m.group(0), " ")
+    for m in YEAR_RE.finditer(text):
+        periods.add((int(m.group(1)), None))
+    return {"tickers": tickers, "periods": periods, "annual": annual}
+
+
+def collection_matches(name: str, tickers: set, periods: set, annual) -> bool:
+    m = COLLECTION_RE.match(name)
+    if not m:
+        return not tickers and not periods and annual is None
+    if tickers and m["ticker"] not in tickers:
+        return False
+    year, q, is_annual = int(m["year"]), int(m["q"]), bool(m["annual"])
+    if annual is not None and is_annual != annual:
+        return False
+    if periods and (year, q) not in periods and (year, None) not in periods:
+        return False
+    return True
+
+
+# 依問題縮小 collection 範圍；回傳 (collections, info)
+def route(question: str, collections: list[str], dictionary: dict = None) -> tuple[list[str], dict]:
+    if not ROUTING or not collections:
+        return collections, {"routed": False}
+    with span("rag.route") as sp:
+        known = {m["ticker"] for m in map(COLLECTION_RE.match, collections) if m}
+        p = parse(question, known, dictionary)
+        # 由嚴到寬：公司 + 期間 + 表單 → 公司 → 期間 + 表單
+        attempts = [(p["tickers"], p["periods"], p["annual"]),
+                    (p["tickers"], set(), None),
+                    (set(), p["periods"], p["annual"])]
+        selected, level = collections, "all"
+        for i, (tks, periods, annual) in enumerate(attempts):
+            if not tks and not periods and annual is None:
+                continue
+            hit = [c for c in collections if collection_matches(c, tks, periods, annual)]
+            if hit:
+                selected, level = hit, ("full", "company", "period")[i]
+                break
+        info = {"routed": level != "all", "level": level, "tickers": sorted(p["tickers"]),
+                "periods": sorted(f"{y}" + (f"Q{q}" if q else "") for y, q in p["periods"]),
+                "annual": p["annual"], "candidates": len(collections), "selected": len(selected)}
+        sp.set(level=level, candidates=len(collections), selected=len(selected))
+    inc("rag_route_total", level=level)
+    return selected, info
+
+
+# 下載 SEC company_tickers.json 存成本機字典
+def refresh_sec_map(path: str = None):
+    import edgar_client
+    path = path or SEC_TICKER_MAP
+    resp = edgar_client.sec_get(edgar_client.CIK_URL, "company_tickers")
+    resp.raise_for_status()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(resp.content)
+    print(f"[INFO] SEC ticker map 已寫入 {path}（{len(resp.json())} 筆）")
+
+
+def main(question: str, collections: list[str] = None):
+    if collections is None:
+        import rag_en
+        collections = rag_en.get_all_collections()
+    selected, info = route(question, collections)
+    print(json.dumps(info, ensure_ascii=False))
+    for name in selected:
+        print(f"• {name}")
+
+
+if __name__ == "__main__":
+    main(" ".join(sys.argv[1:]))
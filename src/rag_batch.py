@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# 批次問答：從 JSONL / CSV 讀取問題與查詢範圍，批次 embed、平行檢索 + LLM，結果逐筆寫入 JSONL
+#
+# 輸入每列：question（必填）、mode（all / company:<ticker> / collection name）、id、k、max_chunks。
+# 沒有 mode 的問題套用 --scope（可重複指定，預設 all）；--each-company 則展開到每一家公司。
+# 輸出每列：id、question、mode、answer、collections、timings（embed / search / llm / total ms）、error。
+#
+# - 問題以 RAG_BATCH_EMBED_SIZE 為單位批次 embed，embed 下一批時前一批已在檢索 / 呼叫 LLM；
+#   已 embed 但未完成的題目最多 RAG_BATCH_WINDOW 批，embed 不會無限制地跑在前面（向量不會全部堆在記憶體）
+# - 某一批 embed 失敗時，該批每題寫出錯誤紀錄，其他批照常執行（重跑時會重試）
+# - 檢索與 LLM 在 RAG_BATCH_CONCURRENCY 個 thread 中進行；真正送到上游的 LLM 請求另有並行上限
+#   （RAG_BATCH_LLM_CONCURRENCY）與速率限制（RAG_BATCH_LLM_RPS），LLM 快取命中不受限
+# - 每筆完成立即寫出並 flush；對同一個輸出檔重新執行會略過已成功的 id（中斷後可續跑），失敗的會重試
+#
+#   python rag_batch.py questions.jsonl --out answers.jsonl --each-company --llm-rps 2
+import os
+import csv
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+from metrics import span, inc, observe
+from embedders import get_embedder
+import rag_en
+import query_router
+
+load_dotenv()
+BATCH_CONCURRENCY = int(os.getenv('RAG_BATCH_CONCURRENCY', '8'))
+BATCH_LLM_CONCURRENCY = int(os.getenv('RAG_BATCH_LLM_CONCURRENCY', '4'))
+BATCH_LLM_RPS = float(os.getenv('RAG_BATCH_LLM_RPS', '0'))
+BATCH_EMBED_SIZE = int(os.getenv('RAG_BATCH_EMBED_SIZE', '64'))
+BATCH_WINDOW = int(os.getenv('RAG_BATCH_WINDOW', '2'))
+
+
+class RateLimiter:
+    # 每 1/rate 秒放行一個請求；rate <= 0 不限速
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_at)
+            self.next_at = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def item_id(question: str, mode: str, k: int, max_chunks: int) -> str:
+    raw = json.dumps([question, mode, k, max_chunks], ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def read_rows(path: str) -> list[dict]:
+    with open(path, newline='', encoding='utf-8') as fh:
+        if path.lower().endswith('.csv'):
+            return list(csv.DictReader(fh))
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+# 問題 × 查詢範圍 → 待執行項目
+def load_items(path: str, scopes: list[str], k: int = 2, max_chunks: int = 8) -> list[dict]:
+    items = {}
+    for row in read_rows(path):
+        question = (row.get('question') or '').strip()
+        if not question:
+            continue
+        modes = [row['mode']] if row.get('mode') else scopes
+        for mode in modes:
+            item = {'question': question, 'mode': mode,
+                    'k': int(row.get('k') or k), 'max_chunks': int(row.get('max_chunks') or max_chunks)}
+            if row.get('id'):
+                item['id'] = str(row['id']) if len(modes) == 1 else f"{row['id']}@{mode}"
+            else:
+                item['id'] = item_id(question, mode, item['k'], item['max_chunks'])
+            items.setdefault(item['id'], item)
+    return list(items.values())
+
+
+def company_scopes(collections: list[str]) -> list[str]:
+    tickers = {m['ticker'] for m in map(query_router.COLLECTION_RE.match, collections) if m}
+    return [f"company:{tk}" for tk in sorted(tickers)]
+
+
+# 輸出檔中已成功的 id；中斷時最後一行可能不完整，略過即可
+def completed_ids(out: str) -> set:
+    done = set()
+    if not os.path.exists(out):
+        return done
+    with open(out, encoding='utf-8') as fh:
+        for line in fh:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if not rec.get('error'):
+                done.add(rec['id'])
+    return done
+
+
+class BatchRunner:
+    def __init__(self, out: str, concurrency: int = BATCH_CONCURRENCY,
+                 llm_concurrency: int = BATCH_LLM_CONCURRENCY, llm_rps: float = BATCH_LLM_RPS,
+                 embed_size: int = BATCH_EMBED_SIZE, window: int = BATCH_WINDOW):
+        self.out = out
+        self.concurrency = max(1, concurrency)
+        self.embed_size = max(1, embed_size)
+        self.window = max(1, window)
+        self.llm_sem = threading.Semaphore(max(1, llm_concurrency))
+        self.limiter = RateLimiter(llm_rps)
+        self.lock = threading.Lock()
+        self.fh = None
+        self.collections = None
+        self.stats = {'done': 0, 'errors': 0, 'skipped': 0}
+        self.latencies = []
+
+    def post_llm(self, headers: dict, data: dict) -> tuple[str, str]:
+        with self.llm_sem:
+            self.limiter.wait()
+            return rag_en.post_llm(headers, data)
+
+    @staticmethod
+    def record(item: dict, embed_ms: float) -> dict:
+        return {'id': item['id'], 'question': item['question'], 'mode': item['mode'],
+                'answer': None, 'collections': 0, 'timings': {'embed_ms': round(embed_ms, 2)},
+                'error': None}
+
+    def answer(self, item: dict, query_emb: list, embed_ms: float) -> dict:
+        rec = self.record(item, embed_ms)
+        t0 = time.perf_counter()
+        try:
+            with span("rag.ask", mode="batch") as sp:
+                context, rec['collections'] = rag_en.retrieve(
+                    item['mode'], item['question'], query_emb, item['k'], item['max_chunks'],
+                    self.collections)
+                t1 = time.perf_counter()
+                rec['answer'] = rag_en.ask_llm(context, item['question'], post=self.post_llm)
+                t2 = time.perf_counter()
+                sp.set(collections=rec['collections'], context_chars=len(context))
+            rec['timings'].update(search_ms=round((t1 - t0) * 1000, 2), llm_ms=round((t2 - t1) * 1000, 2))
+            if not rec['answer']:
+                rec['error'] = "empty answer (LLM upstream error)"
+        except Exception as e:
+            rec['error'] = f"{type(e).__name__}: {e}"
+        total = embed_ms / 1000 + time.perf_counter() - t0
+        rec['timings']['total_ms'] = round(total * 1000, 2)
+        self.write(rec, total)
+        return rec
+
+    def write(self, rec: dict, seconds: float):
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.fh.write(line)
+            self.fh.flush()
+            self.stats['done'] += 1
+            if rec['error']:
+                self.stats['errors'] += 1
+            else:
+                self.latencies.append(seconds)
+        inc("rag_batch_items_total", status="error" if rec['error'] else "ok")
+        observe("rag_batch_item_seconds", seconds)
+
+    def embed_batch(self, items: list[dict]) -> tuple[dict, float]:
+        questions = list(dict.fromkeys(it['question'] for it in items))
+        t0 = time.perf_counter()
+        with span("rag.batch_embed") as sp:
+            vectors = get_embedder().embed(questions)
+            sp.set(texts=len(questions))
+        share = (time.perf_counter() - t0) * 1000 / len(items)
+        return {q: v.tolist() for q, v in zip(questions, vectors)}, share
+
+    def run(self, items: list[dict]) -> dict:
+        done = completed_ids(self.out)
+        pending = [it for it in items if it['id'] not in done]
+        self.stats['skipped'] = len(items) - len(pending)
+        print(f"[INFO] 共 {len(items)} 題，已完成 {self.stats['skipped']}，待執行 {len(pending)}")
+        if not pending:
+            return self.summary(0.0)
+        self.collections = rag_en.get_all_collections()
+        os.makedirs(os.path.dirname(os.path.abspath(self.out)), exist_ok=True)
+        t0 = time.perf_counter()
+        self.fh = open(self.out, 'a', encoding='utf-8')
+        try:
+            self.submit_all(pending, t0)
+        finally:
+            self.fh.close()
+        return self.summary(time.perf_counter() - t0)
+
+    # 整批 embed 失敗：每題寫出錯誤紀錄
+    def fail_batch(self, batch: list[dict], error: Exception, seconds: float):
+        inc("rag_batch_embed_errors_total")
+        share = seconds / len(batch)
+        for item in batch:
+            rec = self.record(item, share * 1000)
+            rec['error'] = f"embed failed: {type(error).__name__}: {error}"
+            rec['timings']['total_ms'] = round(share * 1000, 2)
+            self.write(rec, share)
+
+    def submit_all(self, pending: list[dict], t0: float):
+        total, finished = len(pending), 0
+        step = max(1, total // 10)
+        outstanding = set()
+
+        def progress(n):
+            nonlocal finished
+            for _ in range(n):
+                finished += 1
+                if finished % step == 0 or finished == total:
+                    print(f"[INFO] {finished}/{total} 完成，{self.stats['errors']} 筆失敗，"
+                          f"{finished / (time.perf_counter() - t0):.1f} 題/s", flush=True)
+
+        # 完成一筆就處理一筆，直到未完成的題數不超過 limit
+        def drain(limit: int):
+            while len(outstanding) > limit:
+                done, _ = wait(outstanding, return_when=FIRST_COMPLETED)
+                outstanding.difference_update(done)
+                for fut in done:
+                    fut.result()
+                progress(len(done))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            for i in range(0, total, self.embed_size):
+                batch = pending[i:i + self.embed_size]
+                # 加上這一批後最多 window 批在途
+                drain(self.window * self.embed_size - len(batch))
+                e0 = time.perf_counter()
+                try:
+                    vectors, share = self.embed_batch(batch)
+                except Exception as e:
+                    print(f"[WARN] 第 {i // self.embed_size + 1} 批 embed 失敗：{e}")
+                    self.fail_batch(batch, e, time.perf_counter() - e0)
+                    progress(len(batch))
+                    continue
+                outstanding.update(pool.submit(self.answer, it, vectors[it['question']], share)
+                                   for it in batch)
+            drain(0)
+
+    def summary(self, elapsed: float) -> dict:
+        lat = sorted(self.latencies)
+        pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1) if lat else None
+        return dict(self.stats, seconds=round(elapsed, 2),
+                    per_s=round(self.stats['done'] / elapsed, 2) if elapsed else 0.0,
+                    p50_ms=pct(0.5), p95_ms=pct(0.95), out=self.out)
+
+
+def main(path: str, out: str = None, scopes: list[str] = None, each_company: bool = False,
+         k: int = 2, max_chunks: int = 8, **kwargs) -> dict:
+    if each_company:
+        scopes = company_scopes(rag_en.get_all_collections())
+    items = load_items(path, scopes or ["all"], k, max_chunks)
+    out = out or os.path.splitext(path)[0] + ".answers.jsonl"
+    # 未指定的選項（None）沿用環境變數預設值
+    summary = BatchRunner(out, **{k: v for k, v in kwargs.items() if v is not None}).run(items)
+    print(json.dumps(summary, ensure_ascii=False))
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批次 RAG 問答（JSONL / CSV → JSONL）")
+    parser.add_argument("input", help="JSONL 或 CSV，欄位：question、mode、id、k、max_chunks")
+    parser.add_argument("--out", help="輸出 JSONL（預設 <input>.answers.jsonl）；已完成的 id 會略過")
+    parser.add_argument("--scope", action="append", help="沒有 mode 的問題使用的查詢範圍，可重複指定")
+    parser.add_argument("--each-company", action="store_true", help="沒有 mode 的問題對每家公司各問一次")
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--max-chunks", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--llm-concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    parser.add_argument("--llm-rps", type=float, default=BATCH_LLM_RPS, help="LLM 每秒請求上限，0 不限速")
+    args = parser.parse_args()
+    if args.each_company and args.scope:
+        parser.error("--scope 與 --each-company 擇一")
+    main(args.input, args.out, args.scope, args.each_company, args.k, args.max_chunks,
+         concurrency=args.concurrency, llm_concurrency=args.llm_concurrency, llm_rps=args.llm_rps)
@@ -1,50 +1,78 @@
 #chcp 65001
 #Microsoft Windows [版本 10.0.26100.4061]
 import os
-import requests
 import json
-from qdrant_client import QdrantClient
 from dotenv import load_dotenv
+from metrics import span, inc
+from index_profiles import search_params, profile_from_config
+from embedders import get_embedder
+import query_router
+import summary_index
+import llm_cache
+import llm_client
 import sys
 import io
 
-if hasattr(sys.stdout, "reconfigure"):
-    sys.stdout.reconfigure(encoding="utf-8", errors="replace")
-else:
-    sys.stdout = io.TextIOWrapper(
-        sys.stdout.buffer, encoding="utf-8", errors="replace"
-    )
-if os.name == 'nt':
-    os.system('chcp 65001 >nul')
+# 互動模式才調整 console 編碼，import 時不做任何事
+def setup_console():
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(encoding="utf-8", errors="replace")
+    else:
+        sys.stdout = io.TextIOWrapper(
+            sys.stdout.buffer, encoding="utf-8", errors="replace"
+        )
+    if os.name == 'nt':
+        os.system('chcp 65001 >nul')
 
 # 載入環境變數
 load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-EMBED_API_URL = os.getenv("OLLAMA_EMBED_API_URL", "http://localhost:11434/api/embeddings")
-EMBED_MODEL = "nomic-embed-text"
-LLM_MODEL = "google/gemini-2.0-flash-exp:free"
-#LLM_MODEL = "deepseek/deepseek-chat-v3-0324:free"
-
-qdrant = QdrantClient(url=QDRANT_URL, prefer_grpc=False)
-
-# 取得所有 collection 名稱
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+# 依序嘗試的 model 清單（LLM_MODELS），第一個為主要 model；hedge / fallback / breaker 見 llm_client.py
+LLM_MODELS = llm_client.LLM_MODELS
+LLM_MODEL = LLM_MODELS[0]
+
+# Qdrant client 延遲到第一次使用才建立
+qdrant = None
+# 摘要層 collection 是否存在（每次 get_all_collections 時更新）
+has_summaries = False
+# 各 collection 的 search_params（依 collection 實際的索引設定，每次 get_all_collections 時清空）
+collection_params = {}
+
+def get_qdrant():
+    global qdrant
+    if qdrant is None:
+        from qdrant_client import QdrantClient
+        qdrant = QdrantClient(url=QDRANT_URL, prefer_grpc=False)
+    return qdrant
+
+# 取得所有財報 collection 名稱（摘要層不算）
 def get_all_collections():
-    return [c.name for c in qdrant.get_collections().collections]
+    global has_summaries
+    with span("qdrant.get_collections"):
+        names = [c.name for c in get_qdrant().get_collections().collections]
+    has_summaries = summary_index.SUMMARY_COLLECTION in names
+    collection_params.clear()
+    return [n for n in names if n != summary_index.SUMMARY_COLLECTION]
+
+# 依 collection 實際的量化 / HNSW 設定組 search_params（不同 collection 可能用不同 profile）
+def search_params_for(collection: str):
+    if collection not in collection_params:
+        with span("qdrant.get_collection") as sp:
+            config = get_qdrant().get_collection(collection).config
+            sp.set(collection=collection)
+        collection_params[collection] = search_params(profile_from_config(config))
+    return collection_params[collection]
 
 # 取得某公司的所有 collection（用ticker開頭比對）
 def get_collections_by_company(ticker: str):
     ticker = ticker.lower()
     return [c for c in get_all_collections() if c.startswith(ticker)]
 
-# 文字轉 embedding
+# 文字轉 embedding（backend 由 EMBED_BACKEND 決定）
 def embed_query(query: str) -> list:
-    resp = requests.post(
-        EMBED_API_URL,
-        json={"model": EMBED_MODEL, "prompt": query}
-    )
-    resp.raise_for_status()
-    return resp.json()["embedding"]
+    return get_embedder().embed([query])[0].tolist()
 
 # 查單一 collection
 # def search_qdrant(collection: str, query_emb: list, top_k: int = 3):
@@ -56,19 +84,36 @@ def embed_query(query: str) -> list:
 #     ).result
 #     return [hit.payload["text"] for hit in hits]
 
+def search_hits(collection: str, query_emb: list, top_k: int = 3, query_filter=None) -> list[dict]:
+    with span("qdrant.search") as sp:
+        hits = get_qdrant().search(
+            collection_name=collection,
+            query_vector=query_emb,
+            query_filter=query_filter,
+            limit=top_k,
+            with_payload=True,
+            search_params=search_params_for(collection)
+        )
+        sp.set(collection=collection, hits=len(hits))
+    return [hit.payload for hit in hits]
+
 def search_qdrant(collection: str, query_emb: list, top_k: int = 3):
-    hits = qdrant.search(
-        collection_name=collection,
-        query_vector=query_emb,
-        limit=top_k,
-        with_payload=True
-    )
-    return [hit.payload["text"] for hit in hits]
-
-# 組 prompt 丟 LLM
-def ask_llm(context: str, question: str) -> str:
-    # 英文版 prompt，並在 system message 中強調「英文回答」
-    prompt_en = f"""You are a financial analysis assistant. Answer ONLY in English, based on the following financial excerpts:
+    return [p["text"] for p in search_hits(collection, query_emb, top_k)]
+
+# 預先算好的衍生指標 chunk 精簡且不需 LLM 再計算，排在原始 fact 前面優先放入 prompt
+def select_chunks(payloads: list[dict], max_chunks: int) -> list[str]:
+    ordered = sorted(payloads, key=lambda p: p.get("kind") != "metrics")
+    return [p["text"] for p in ordered[:max_chunks]]
+
+# 兩層檢索的 context：摘要在前，每份深入的報告再補一個明細 chunk（衍生指標優先）
+def summary_chunks(summaries: list[dict], details: list[dict], drilled: int, max_chunks: int) -> list[str]:
+    return [p["text"] for p in summaries] + select_chunks(details, min(drilled, max_chunks))
+
+# 組 prompt（rag_en 與 rag_service 共用）
+# 英文版 prompt，並在 system message 中強調「英文回答」
+PROMPT_TEMPLATE = """You are a financial analysis assistant. Answer ONLY in English, based on the following financial excerpts:
+
+Lines under "Derived metrics" are precomputed from the filings (growth, margins, ratios); use them directly instead of recalculating from raw facts. "Company summary" and "Report summary" excerpts give an overview across companies and periods.
 
 [Financial Excerpts]
 {context}
@@ -78,6 +123,9 @@ def ask_llm(context: str, question: str) -> str:
 
 [Answer in English]"""
 
+def build_llm_request(context: str, question: str) -> tuple[dict, dict]:
+    prompt_en = PROMPT_TEMPLATE.format(context=context, question=question)
+
     headers = {
         "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "HTTP-Referer": "https://example.com/",
@@ -94,46 +142,86 @@ def ask_llm(context: str, question: str) -> str:
         "max_tokens": 10000,
         "transforms": ["middle-out"]
     }
-    resp = requests.post(
-        "https://openrouter.ai/api/v1/chat/completions",
-        headers=headers,
-        json=data
-    )
-    if resp.status_code != 200:
-        print("▶︎ OpenRouter API Error:", resp.status_code)
-        print(resp.text)   # 查看伺服器回傳的錯誤訊息 JSON
-        return ""
-    # 只取 content，並確保回傳純文字
-    return resp.json()["choices"][0]["message"]["content"]
-
-# 主查詢函式：可選全部、某公司、單一 collection
-def rag_ask_multi(query_mode, question, per_collection_k=2, max_chunks=8):
-    query_emb = embed_query(question)
+    return headers, data
+
+# 組 prompt 丟 LLM：逾時、hedged request 與 model fallback 由 llm_client 處理
+# 回傳 (answer, 實際回答的 model)
+def post_llm(headers: dict, data: dict) -> tuple[str, str]:
+    try:
+        return llm_client.get_client(OPENROUTER_URL).complete(headers, data, LLM_MODELS, with_model=True)
+    except llm_client.LLMError as e:
+        print("▶︎ OpenRouter API Error:", e)   # 所有 model 都失敗時的錯誤訊息
+        return "", None
+
+# 相同 (model, prompt, context, question) 的回答直接取快取，同時進行的相同請求只呼叫一次；
+# 由 fallback / hedge model 回答時不寫入快取（key 是主要 model）
+# post 可替換實際呼叫上游的函式（批次模式在這裡加上並行上限與限速，快取命中不受限）
+def ask_llm(context: str, question: str, post=None) -> str:
+    headers, data = build_llm_request(context, question)
+    key = llm_cache.cache_key(data, PROMPT_TEMPLATE, context, question)
+    return llm_cache.get_cache().get_or_call(key, lambda: (post or post_llm)(headers, data),
+                                             model=data["model"])
+
+# 依查詢模式決定要搜尋的 collection；all_collections 可由呼叫端預先取得（批次模式共用一次）
+def resolve_collections(query_mode: str, question: str, all_collections: list[str] = None) -> list[str]:
     if query_mode == "all":
-        collections = get_all_collections()
+        # 依問題中的公司 / 期間縮小範圍，判斷不出來才搜尋全部
+        collections, _ = query_router.route(question, all_collections or get_all_collections())
     elif query_mode.startswith("company:"):
         ticker = query_mode.split(":", 1)[1].lower()
-        collections = get_collections_by_company(ticker)
+        candidates = [c for c in all_collections if c.startswith(ticker)] if all_collections \
+            else get_collections_by_company(ticker)
+        collections, _ = query_router.route(question, candidates)
     else:
         # query_mode 直接是 collection name
         collections = [query_mode]
+    return collections
 
-    all_chunks = []
+# 檢索：回傳 (context, 搜尋的 collection 數)
+def retrieve(query_mode, question, query_emb, per_collection_k=2, max_chunks=8, all_collections=None):
+    if query_mode == "all":
+        all_collections = all_collections or get_all_collections()
+    collections = resolve_collections(query_mode, question, all_collections)
+    if summary_index.use_summaries(query_mode, len(collections), has_summaries):
+        return retrieve_summaries(query_emb, collections, len(collections) < len(all_collections),
+                                  per_collection_k, max_chunks)
+    all_hits = []
     for col in collections:
-        chunks = search_qdrant(col, query_emb, top_k=per_collection_k)
-        all_chunks.extend(chunks)
-    # 取最前面 max_chunks 個（你可以根據需要調整）
-    context = "\n---\n".join(all_chunks[:max_chunks])
-    return ask_llm(context, question)
+        all_hits.extend(search_hits(col, query_emb, top_k=per_collection_k))
+    # 取最前面 max_chunks 個（衍生指標優先）
+    return "\n---\n".join(select_chunks(all_hits, max_chunks)), len(collections)
+
+# 寬問題的兩層檢索：先搜摘要層，只深入前幾份報告；回傳 (context, 搜尋的 collection 數)
+def retrieve_summaries(query_emb, collections, routed, per_collection_k=2, max_chunks=8):
+    with span("rag.summaries") as sp:
+        summaries = search_hits(summary_index.SUMMARY_COLLECTION, query_emb, summary_index.SUMMARY_TOP_K,
+                                summary_index.summary_filter(collections) if routed else None)
+        drill = summary_index.drill_collections(summaries, collections)
+        details = []
+        for col in drill:
+            details.extend(search_hits(col, query_emb, top_k=per_collection_k))
+        sp.set(candidates=len(collections), summaries=len(summaries), drill=len(drill))
+    inc("rag_summary_retrievals_total")
+    return "\n---\n".join(summary_chunks(summaries, details, len(drill), max_chunks)), len(drill) + 1
 
-if __name__ == "__main__":
+# 主查詢函式：可選全部、某公司、單一 collection
+def rag_ask_multi(query_mode, question, per_collection_k=2, max_chunks=8):
+    with span("rag.ask") as sp:
+        query_emb = embed_query(question)
+        context, n = retrieve(query_mode, question, query_emb, per_collection_k, max_chunks)
+        sp.set(mode=query_mode, collections=n, context_chars=len(context))
+        return ask_llm(context, question)
+
+def main(query_mode: str = None):
+    setup_console()
     print("==== RAG 財報查詢 ====")
     print("選擇查詢模式：")
     print("1. 輸入 collection name(例:aapl-2024-q1)查單一財報")
     print("2. 輸入 company:<公司代碼> 查詢該公司所有財報(例:company:aapl)")
-    print("3. 輸入 all 查詢全部公司所有財報")
+    print("3. 輸入 all 或直接按 Enter：依問題中的公司 / 期間自動縮小範圍（判斷不出來則查詢全部）")
     print("--------------------------")
-    query_mode = input("請輸入查詢條件：").strip()
+    if not query_mode:
+        query_mode = input("請輸入查詢條件：").strip() or "all"
 
     print("請開始輸入你的問題（輸入 exit 離開）(請使用英文)：")
     while True:
@@ -149,4 +237,7 @@ if __name__ == "__main__":
         except Exception as e:
             #print("發生錯誤：", e)
             sys.stdout.buffer.write(str(e).encode("utf-8", "replace") + b"\n")
+
+if __name__ == "__main__":
+    main()
 #根據財報，判斷apple公司的未來發展如何，詳細敘述理由
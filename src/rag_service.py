@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# 常駐 async RAG 查詢服務（取代 rag_en.py 的 input() 迴圈）
+#
+#   POST /ask     {"question": "...", "mode": "all" | "company:aapl" | "<collection>",
+#                  "per_collection_k": 2, "max_chunks": 8}
+#   POST /search  同上，只回傳檢索到的片段，不呼叫 LLM
+#   GET  /health
+#
+# - Qdrant、embedding（Ollama）、LLM（OpenRouter）各自使用長駐、pooled 的 client
+# - 相同的進行中問題只會執行一次（request coalescing）
+# - LLM 回答經 llm_cache 快取，相同 context + 問題的同時請求只呼叫上游一次
+# - LLM 呼叫經 llm_client：model fallback、hedged request、circuit breaker
+# - 同時到達的查詢 embedding 會 micro-batch 成一次 /api/embed 呼叫
+# - 每個上游有獨立的並行上限（RAG_*_CONCURRENCY）
+import asyncio
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient
+
+from metrics import span, inc
+from index_profiles import search_params, profile_from_config
+from embedders import EMBED_BACKEND, EMBED_MODEL, OLLAMA_URL, get_embedder
+import rag_en
+import query_router
+import summary_index
+import llm_cache
+import llm_client
+
+load_dotenv()
+HOST = os.getenv("RAG_SERVICE_HOST", "0.0.0.0")
+PORT = int(os.getenv("RAG_SERVICE_PORT", "8080"))
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+OPENROUTER_URL = rag_en.OPENROUTER_URL
+
+EMBED_CONCURRENCY = int(os.getenv("RAG_EMBED_CONCURRENCY", "4"))
+QDRANT_CONCURRENCY = int(os.getenv("RAG_QDRANT_CONCURRENCY", "16"))
+LLM_CONCURRENCY = int(os.getenv("RAG_LLM_CONCURRENCY", "4"))
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT = float(os.getenv("RAG_EMBED_BATCH_WAIT_MS", "5")) / 1000
+COLLECTIONS_TTL = float(os.getenv("RAG_COLLECTIONS_TTL", "30"))
+# 單一請求的上限，避免一個查詢拖垮 Qdrant / prompt
+MAX_PER_COLLECTION_K = int(os.getenv("RAG_MAX_PER_COLLECTION_K", "20"))
+MAX_CHUNKS = int(os.getenv("RAG_MAX_CHUNKS", "64"))
+
+
+class EmbedBatcher:
+    # 收集 EMBED_BATCH_WAIT 內到達的查詢，一次送進 Ollama /api/embed（或本機 backend）
+    def __init__(self, session: aiohttp.ClientSession, sem: asyncio.Semaphore,
+                 max_batch: int = EMBED_BATCH_SIZE, max_wait: float = EMBED_BATCH_WAIT):
+        self.session = session
+        self.sem = sem
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.worker = None
+        # event loop 只保留 task 的弱參照，進行中的 flush 必須自己持有
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self):
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [t for t in [self.worker, *self._tasks] if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.worker = None
+        # 尚未被取走的查詢也一併取消，呼叫端不會永遠等待
+        while not self.queue.empty():
+            _, fut = self.queue.get_nowait()
+            if not fut.done():
+                fut.cancel()
+
+    async def embed(self, text: str) -> list[float]:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, fut))
+        return await fut
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        texts = [t for t, _ in batch]
+        try:
+            async with self.sem:
+                vectors = await self.embed_many(texts)
+            for (_, fut), vec in zip(batch, vectors):
+                if not fut.done():
+                    fut.set_result(vec)
+        except asyncio.CancelledError:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.cancel()
+            raise
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    async def embed_many(self, texts: list[str]) -> list[list[float]]:
+        if EMBED_BACKEND != "ollama":
+            # 本機 backend（如 onnx）在 thread 中執行，整批一次推論
+            return (await asyncio.to_thread(get_embedder().embed, texts)).tolist()
+        with span("embed.batch", backend="ollama") as sp:
+            sp.set(texts=len(texts))
+            inc("embed_texts_total", len(texts), backend="ollama")
+            async with self.session.post(f"{OLLAMA_URL}/api/embed",
+                                         json={"model": EMBED_MODEL, "input": texts}) as resp:
+                if resp.status != 404:
+                    resp.raise_for_status()
+                    return (await resp.json())["embeddings"]
+            # 舊版 Ollama 沒有 /api/embed，退回逐筆 /api/embeddings
+            out = []
+            for t in texts:
+                async with self.session.post(f"{OLLAMA_URL}/api/embeddings",
+                                             json={"model": EMBED_MODEL, "prompt": t}) as resp:
+                    resp.raise_for_status()
+                    out.append((await resp.json())["embedding"])
+            return out
+
+
+class RagService:
+    def __init__(self, qdrant: AsyncQdrantClient | None = None):
+        self.qdrant = qdrant
+        self.http = None
+        self.embedder = None
+        self.qdrant_sem = asyncio.Semaphore(QDRANT_CONCURRENCY)
+        self.llm_sem = asyncio.Semaphore(LLM_CONCURRENCY)
+        self.inflight: dict[tuple, asyncio.Future] = {}
+        self.collections: list[str] = []
+        self.collections_at = 0.0
+        self.has_summaries = False
+        self.coalesced_count = 0
+        self.llm_cache = llm_cache.get_cache()
+        self.llm = llm_client.get_client(OPENROUTER_URL)
+        # 各 collection 的 search_params，collection 清單重新查詢時清空
+        self.search_params: dict[str, object] = {}
+
+    async def start(self, app=None):
+        if self.qdrant is None:
+            self.qdrant = AsyncQdrantClient(url=QDRANT_URL, prefer_grpc=False)
+        connector = aiohttp.TCPConnector(limit=EMBED_CONCURRENCY + LLM_CONCURRENCY + 8,
+                                         keepalive_timeout=60)
+        self.http = aiohttp.ClientSession(connector=connector)
+        self.embedder = EmbedBatcher(self.http, asyncio.Semaphore(EMBED_CONCURRENCY))
+        self.embedder.start()
+
+    async def stop(self, app=None):
+        await self.embedder.stop()
+        await self.http.close()
+        await self.qdrant.close()
+
+    async def all_collections(self) -> list[str]:
+        # collection 清單只在 TTL 到期時重新查詢
+        if time.monotonic() - self.collections_at > COLLECTIONS_TTL:
+            with span("qdrant.get_collections"):
+                resp = await self.qdrant.get_collections()
+            names = [c.name for c in resp.collections]
+            # 摘要層不是財報 collection，只記錄是否存在
+            self.has_summaries = summary_index.SUMMARY_COLLECTION in names
+            self.collections = [n for n in names if n != summary_index.SUMMARY_COLLECTION]
+            self.collections_at = time.monotonic()
+            self.search_params.clear()
+        return self.collections
+
+    # 單一 collection 模式：清單內沒有時強制重新查詢一次（可能是 TTL 內新建的）
+    async def has_collection(self, name: str) -> bool:
+        if name in await self.all_collections():
+            return True
+        self.collections_at = 0.0
+        return name in await self.all_collections()
+
+    async def resolve_collections(self, mode: str) -> list[str]:
+        if mode == "all":
+            return await self.all_collections()
+        if mode.startswith("company:"):
+            ticker = mode.split(":", 1)[1].lower()
+            return [c for c in await self.all_collections() if c.startswith(ticker)]
+        return [mode]
+
+    # 依 collection 實際的量化 / HNSW 設定組 search_params（不同 collection 可能用不同 profile）
+    async def search_params_for(self, collection: str):
+        if collection not in self.search_params:
+            with span("qdrant.get_collection") as sp:
+                info = await self.qdrant.get_collection(collection)
+                sp.set(collection=collection)
+            self.search_params[collection] = search_params(profile_from_config(info.config))
+        return self.search_params[collection]
+
+    async def search_one(self, collection: str, query_emb: list, top_k: int,
+                         query_filter=None) -> list[dict]:
+        async with self.qdrant_sem:
+            params = await self.search_params_for(collection)
+            with span("qdrant.search") as sp:
+                hits = await self.qdrant.search(
+                    collection_name=collection,
+                    query_vector=query_emb,
+                    query_filter=query_filter,
+                    limit=top_k,
+                    with_payload=True,
+                    search_params=params
+                )
+                sp.set(collection=collection, hits=len(hits))
+        return [hit.payload for hit in hits]
+
+    async def retrieve(self, question: str, mode: str, per_collection_k: int,
+                       max_chunks: int) -> tuple[list[str], dict]:
+        timings = {}
+        t0 = time.perf_counter()
+        query_emb = await self.embedder.embed(question)
+        timings["embed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+        t0 = time.perf_counter()
+        collections = candidates = await self.resolve_collections(mode)
+        if mode == "all" or mode.startswith("company:"):
+            collections, route = query_router.route(question, candidates)
+            timings["route"] = route.get("level", "off")
+        if summary_index.use_summaries(mode, len(collections), self.has_summaries):
+            # 寬問題：先搜摘要層，只深入前幾份報告
+            routed = len(collections) < len(candidates)
+            summaries = await self.search_one(
+                summary_index.SUMMARY_COLLECTION, query_emb, summary_index.SUMMARY_TOP_K,
+                summary_index.summary_filter(collections) if routed else None)
+            drill = summary_index.drill_collections(summaries, collections)
+            results = await asyncio.gather(
+                *(self.search_one(col, query_emb, per_collection_k) for col in drill))
+            chunks = rag_en.summary_chunks(summaries, [p for r in results for p in r],
+                                         len(drill), max_chunks)
+            timings["search_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            timings["summaries"] = len(summaries)
+            timings["collections"] = len(drill) + 1
+            inc("rag_summary_retrievals_total")
+            return chunks, timings
+        results = await asyncio.gather(
+            *(self.search_one(col, query_emb, per_collection_k) for col in collections))
+        chunks = rag_en.select_chunks([p for r in results for p in r], max_chunks)
+        timings["search_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        timings["collections"] = len(collections)
+        return chunks, timings
+
+    async def ask_llm(self, context: str, question: str) -> str:
+        # 不同 mode / k 檢索到相同片段時也能共用快取或同一個進行中的上游呼叫
+        headers, data = rag_en.build_llm_request(context, question)
+        key = llm_cache.cache_key(data, rag_en.PROMPT_TEMPLATE, context, question)
+        return await self.llm_cache.aget_or_call(key, lambda: self.post_llm(headers, data),
+                                                 model=data["model"])
+
+    # 回傳 (answer, 實際回答的 model)；fallback / hedge 的回答不會以主要 model 的 key 寫入快取
+    async def post_llm(self, headers: dict, data: dict) -> tuple[str, str]:
+        async with self.llm_sem:
+            try:
+                return await self.llm.acomplete(self.http, headers, data, rag_en.LLM_MODELS,
+                                                with_model=True)
+            except llm_client.LLMError as e:
+                raise web.HTTPBadGateway(text=f"LLM upstream error: {e}")
+
+    async def answer(self, question, mode, per_collection_k, max_chunks, search_only):
+        with span("rag.ask", endpoint="search" if search_only else "ask"):
+            chunks, timings = await self.retrieve(question, mode, per_collection_k, max_chunks)
+            result = {"question": question, "mode": mode, "timings": timings}
+            if search_only:
+                result["chunks"] = chunks
+                return result
+            t0 = time.perf_counter()
+            result["answer"] = await self.ask_llm("\n---\n".join(chunks), question)
+            timings["llm_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+            result["chunks"] = len(chunks)
+            return result
+
+    async def run_once(self, key: tuple, *args):
+        # 相同 key 的請求共用同一個 future，上游只被呼叫一次
+        fut = self.inflight.get(key)
+        if fut is not None:
+            self.coalesced_count += 1
+            inc("rag_coalesced_total")
+            return await asyncio.shield(fut)
+        fut = asyncio.ensure_future(self.answer(*args))
+        self.inflight[key] = fut
+        try:
+            return await asyncio.shield(fut)
+        finally:
+            if fut.done():
+                self.inflight.pop(key, None)
+            else:
+                fut.add_done_callback(lambda _: self.inflight.pop(key, None))
+
+    async def handle_query(self, request: web.Request, search_only: bool):
+        try:
+            body = await request.json()
+        except Exception:
+            raise web.HTTPBadRequest(text="invalid JSON body")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="JSON body must be an object")
+        question = body.get("question") or ""
+        if not isinstance(question, str) or not question.strip():
+            raise web.HTTPBadRequest(text="question is required")
+        question = question.strip()
+        mode = body.get("mode", "all")
+        if not isinstance(mode, str):
+            raise web.HTTPBadRequest(text="mode must be a string")
+        try:
+            k = int(body.get("per_collection_k", 2))
+            max_chunks = int(body.get("max_chunks", 8))
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text="per_collection_k and max_chunks must be integers")
+        if not 1 <= k <= MAX_PER_COLLECTION_K:
+            raise web.HTTPBadRequest(text=f"per_collection_k must be between 1 and {MAX_PER_COLLECTION_K}")
+        if not 1 <= max_chunks <= MAX_CHUNKS:
+            raise web.HTTPBadRequest(text=f"max_chunks must be between 1 and {MAX_CHUNKS}")
+        if mode != "all" and not mode.startswith("company:") and not await self.has_collection(mode):
+            raise web.HTTPNotFound(text=f"unknown collection: {mode}")
+        key = (question, mode, k, max_chunks, search_only)
+        t0 = time.perf_counter()
+        result = await self.run_once(key, question, mode, k, max_chunks, search_only)
+        return web.json_response({**result, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2)})
+
+    async def handle_ask(self, request):
+        return await self.handle_query(request, search_only=False)
+
+    async def handle_search(self, request):
+        return await self.handle_query(request, search_only=True)
+
+    async def handle_health(self, request):
+        status = {"status": "ok", "inflight": len(self.inflight), "coalesced": self.coalesced_count,
+                  "llm_cache": self.llm_cache.info(), "llm": self.llm.stats()}
+        try:
+            status["collections"] = len(await self.all_collections())
+        except Exception as e:
+            status["status"] = "degraded"
+            status["qdrant_error"] = str(e)
+        return web.json_response(status, status=200 if status["status"] == "ok" else 503)
+
+
+def create_app(service: RagService | None = None) -> web.Application:
+    service = service or RagService()
+    app = web.Application()
+    app["service"] = service
+    app.on_startup.append(service.start)
+    app.on_cleanup.append(service.stop)
+    app.router.add_post("/ask", service.handle_ask)
+    app.router.add_post("/search", service.handle_search)
+    app.router.add_get("/health", service.handle_health)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=HOST, port=PORT)
@@ -1,5 +1,3 @@
-import pandas as pd
-import yfinance as yf
 import time
 
 sector_map = {
@@ -185,39 +183,47 @@ industry_map = {
     "utilities-renewable": "再生能源"
 }
 
-input_file = '../csv/few_reports.csv'
-df = pd.read_csv(input_file)
-
-df["Sector"] = ""
-df["Industry"] = ""
-
-for i, row in df.iterrows():
-    ticker_symbol = str(row["Ticker"]).strip()
-    try:
-        ticker = yf.Ticker(ticker_symbol)
-        info = ticker.info
-        df.at[i, "Sector"] = info.get("sector", "N/A/N/A/N/A/N/A/N/A/N/A/")
-        df.at[i, "Industry"] = info.get("industry", "N/A/N/A/N/A/N/A/N/A/N/A/")
-        print(f"{i}.{ticker_symbol}")
-    except Exception as e:
-        df.at[i, "Sector"] = "N/A"
-        df.at[i, "Industry"] = "N/A"
-        print(f"{i}.{ticker_symbol} error {e}")
-    time.sleep(1)
-
-df["Industry"] = (
-    df["Industry"]
-    .str.lower()
-    .str.replace(" & ", "-", regex=False)
-    .str.replace("—", "-", regex=False)
-    .str.replace("&", "-", regex=False)
-    .str.replace(" - ", "-", regex=False)
-    .str.replace(" ", "-", regex=False)
-    .str.replace(" — ", "-", regex=False)
-)
-
-df["Sector"] = df["Sector"].map(sector_map).fillna("未知")
-df["Industry"] = df["Industry"].map(industry_map).fillna("未知")
-
-output_file = '../csv/few_reports_with_sector.csv'
-df.to_csv(output_file, index=False)
\ No newline at end of file
+INPUT_FILE = '../csv/few_reports.csv'
+OUTPUT_FILE = '../csv/few_reports_with_sector.csv'
+
+def main(input_file: str = INPUT_FILE, output_file: str = OUTPUT_FILE):
+    import pandas as pd
+    import yfinance as yf
+
+    df = pd.read_csv(input_file)
+
+    df["Sector"] = ""
+    df["Industry"] = ""
+
+    for i, row in df.iterrows():
+        ticker_symbol = str(row["Ticker"]).strip()
+        try:
+            ticker = yf.Ticker(ticker_symbol)
+            info = ticker.info
+            df.at[i, "Sector"] = info.get("sector", "N/A/N/A/N/A/N/A/N/A/N/A/")
+            df.at[i, "Industry"] = info.get("industry", "N/A/N/A/N/A/N/A/N/A/N/A/")
+            print(f"{i}.{ticker_symbol}")
+        except Exception as e:
+            df.at[i, "Sector"] = "N/A"
+            df.at[i, "Industry"] = "N/A"
+            print(f"{i}.{ticker_symbol} error {e}")
+        time.sleep(1)
+
+    df["Industry"] = (
+        df["Industry"]
+        .str.lower()
+        .str.replace(" & ", "-", regex=False)
+        .str.replace("—", "-", regex=False)
+        .str.replace("&", "-", regex=False)
+        .str.replace(" - ", "-", regex=False)
+        .str.replace(" ", "-", regex=False)
+        .str.replace(" — ", "-", regex=False)
+    )
+
+    df["Sector"] = df["Sector"].map(sector_map).fillna("未知")
+    df["Industry"] = df["Industry"].map(industry_map).fillna("未知")
+
+    df.to_csv(output_file, index=False)
+
+if __name__ == "__main__":
+    main()
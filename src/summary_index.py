@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# 摘要層索引：每份報告與每家公司各一個精簡摘要，存在單一 Qdrant collection（SUMMARY_COLLECTION）
+#
+# 摘要離線產生、不經 LLM：由 xbrl.fact 的合併數（derived_metrics.figures）與 xbrl.metric 的衍生指標組成，
+# 公司摘要另含最近幾季的營收 YoY 與最近一個會計年度；公司名稱 / 產業取自 TICKER_CSV_PATH（有 Sector 欄時）。
+# 內容以 content hash 比對，未變的摘要不再 embed。
+#
+# 檢索（rag_en / rag_service 的 all 模式）：路由後仍超過 RAG_SUMMARY_MIN_COLLECTIONS 個 collection 的寬問題，
+# 先在摘要層取前 RAG_SUMMARY_TOP_K 筆（路由有縮小範圍時以 payload 過濾），再只對前 RAG_SUMMARY_DRILL 份報告
+# 搜尋原始 fact chunk；prompt 為摘要 + 少量明細，不再對每個 collection 搜尋後截斷。
+#
+#   python summary_index.py --all
+import os
+import csv
+import uuid
+import hashlib
+import argparse
+from dotenv import load_dotenv
+from metrics import span, inc
+
+load_dotenv()
+SUMMARY_COLLECTION = os.getenv('SUMMARY_COLLECTION', 'summaries')
+SUMMARY_ENABLED = os.getenv('RAG_SUMMARY', '1') != '0'
+SUMMARY_MIN_COLLECTIONS = int(os.getenv('RAG_SUMMARY_MIN_COLLECTIONS', '8'))
+SUMMARY_TOP_K = int(os.getenv('RAG_SUMMARY_TOP_K', '6'))
+SUMMARY_DRILL = int(os.getenv('RAG_SUMMARY_DRILL', '2'))
+SUMMARY_TREND_QUARTERS = 4
+TICKER_CSV = os.getenv('TICKER_CSV_PATH', '../csv/global_ticker.csv')
+
+FLOW_LABELS = [("revenue", "revenue"), ("operating_income", "operating income"),
+               ("net_income", "net income")]
+GROWTH_LABELS = {"yoy": "YoY", "qoq": "QoQ"}
+STOCK_LABELS = [("assets", "assets"), ("liabilities", "liabilities"), ("equity", "equity"), ("cash", "cash")]
+
+
+# ---------- 檢索端（純函式，rag_en 與 rag_service 共用） ----------
+
+def use_summaries(mode: str, n_collections: int, available: bool) -> bool:
+    return (SUMMARY_ENABLED and available and mode == "all"
+            and n_collections > SUMMARY_MIN_COLLECTIONS)
+
+
+# 路由縮小範圍後：報告摘要限定在選到的 collection，公司摘要限定在選到的公司
+def summary_filter(collections: list[str]):
+    from qdrant_client.http import models
+    import query_router
+    tickers = sorted({m["ticker"] for m in map(query_router.COLLECTION_RE.match, collections) if m})
+    return models.Filter(should=[
+        models.FieldCondition(key="collection", match=models.MatchAny(any=list(collections))),
+        models.Filter(must=[
+            models.FieldCondition(key="level", match=models.MatchValue(value="company")),
+            models.FieldCondition(key="ticker", match=models.MatchAny(any=tickers)),
+        ]),
+    ])
+
+
+# 摘要命中 → 要深入搜尋的報告 collection：報告摘要即其 collection，公司摘要取該公司最新的一份
+def drill_collections(payloads: list[dict], collections: list[str], n: int = SUMMARY_DRILL) -> list[str]:
+    available = set(collections)
+    out = []
+    for p in payloads:
+        if p.get("level") == "report":
+            col = p.get("collection")
+        else:
+            own = [c for c in collections if c.startswith(f"{p.get('ticker')}_")]
+            col = max(own) if own else None
+        if col in available and col not in out:
+            out.append(col)
+        if len(out) >= n:
+            break
+    return out
+
+
+# ---------- 摘要產生 ----------
+
+def company_info(path: str = None) -> dict:
+    path = path or TICKER_CSV
+    if not os.path.exists(path):
+        return {}
+    info = {}
+    with open(path, newline='', encoding='utf-8') as fh:
+        for row in csv.DictReader(fh):
+            tk = (row.get('Ticker') or '').strip().lower()
+            if tk:
+                info[tk] = {k: (row.get(k) or '').strip() for k in ('Name', 'Sector', 'Industry')}
+    return info
+
+
+def fmt_amount(v) -> str:
+    for div, suffix in ((1e12, "T"), (1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if abs(v) >= div:
+            return f"{v / div:.2f}{suffix}"
+    return f"{v:.2f}"
+
+
+def heading(ticker: str, info: dict) -> str:
+    meta = info.get(ticker, {})
+    name = meta.get('Name') or ticker.upper()
+    text = f"{name} ({ticker.upper()})"
+    sector = " / ".join(v for v in (meta.get('Sector'), meta.get('Industry')) if v and v != "N/A")
+    return text + (f" | {sector}" if sector else "")
+
+
+def present(v) -> bool:
+    return v is not None and v == v
+
+
+def period_line(row, metrics: dict, latest: bool = False) -> str:
+    from derived_metrics import SPAN_LABEL, format_value
+    parts = []
+    for col, label in FLOW_LABELS:
+        if not present(row.get(col)):
+            continue
+        growth = [f"{GROWTH_LABELS[g]} {format_value(f'{col}_{g}', metrics[f'{col}_{g}'])}"
+                  for g in ("yoy", "qoq") if f"{col}_{g}" in metrics]
+        parts.append(f"{label} {fmt_amount(row[col])}" + (f" ({', '.join(growth)})" if growth else ""))
+    if present(row.get("eps")):
+        parts.append(f"EPS {row['eps']:.2f}")
+    label = SPAN_LABEL.get(row['span'], row['span'])
+    label = f"Latest {label}" if latest else label.capitalize()
+    line = f"{label} ended {row['end']:%Y-%m-%d}: " + ", ".join(parts)
+    margins = [f"{m.split('_')[0]} {format_value(m, metrics[m])}"
+               for m in ("gross_margin", "operating_margin", "net_margin") if m in metrics]
+    if margins:
+        line += "\nMargins: " + ", ".join(margins)
+    return line
+
+
+def balance_line(row, metrics: dict) -> str:
+    from derived_metrics import format_value
+    parts = [f"{label} {fmt_amount(row[col])}" for col, label in STOCK_LABELS if present(row.get(col))]
+    parts += [f"{m.replace('_', ' ')} {format_value(m, metrics[m])}"
+              for m in ("current_ratio", "return_on_equity") if m in metrics]
+    return "Balance sheet: " + ", ".join(parts) if parts else ""
+
+
+# 讀取 figures 與 xbrl.metric，組成 [{level, ticker, report, collection, period_end, text}]
+def build_summaries(cur, tickers: list[str], info: dict = None) -> list[dict]:
+    import derived_metrics
+    from fact_store import SCHEMA
+    info = company_info() if info is None else info
+    with span("summary.load") as sp:
+        df, reports = derived_metrics.load_facts(cur, tickers)
+        if df.empty:
+            return []
+        frame = derived_metrics.figures(df).sort_values(["ticker", "end", "span"])
+        metrics = {}
+        cur.execute("SELECT to_regclass(%s)", (f"{SCHEMA}.metric",))
+        if cur.fetchone()[0] is not None:
+            cur.execute(f"""
+                SELECT ticker, period_end, span, metric, value FROM {SCHEMA}.metric WHERE ticker = ANY(%s)
+            """, (tickers,))
+            for tk, end, sp_, metric, value in cur.fetchall():
+                metrics.setdefault((tk, str(end), sp_), {})[metric] = value
+        sp.set(tickers=len(tickers), periods=len(frame))
+    owners = reports.dropna(subset=["end"]).sort_values("report").drop_duplicates(["ticker", "end"])
+    owner = {(r.ticker, f"{r.end:%Y-%m-%d}"): r.report for r in owners.itertuples(index=False)}
+
+    out = []
+    for tk, rows in frame.groupby("ticker", sort=True):
+        rows = [r for r in rows.to_dict("records") if present(r["end"])]
+        by_report = {}
+        for r in rows:
+            report = owner.get((tk, f"{r['end']:%Y-%m-%d}"))
+            if report:
+                by_report.setdefault(report, []).append(r)
+        for report, rs in sorted(by_report.items()):
+            # 10-K 的全年數排在前面
+            rs = sorted(rs, key=lambda r: r["span"] != "FY")
+            lines = [f"Report summary: {report} | {heading(tk, info)}"]
+            for r in rs:
+                lines.append(period_line(r, metrics.get((tk, f"{r['end']:%Y-%m-%d}", r["span"]), {})))
+            bal = balance_line(rs[0], metrics.get((tk, f"{rs[0]['end']:%Y-%m-%d}", rs[0]["span"]), {}))
+            if bal:
+                lines.append(bal)
+            out.append({"level": "report", "ticker": tk, "report": report, "collection": report.lower(),
+                        "period_end": f"{rs[0]['end']:%Y-%m-%d}", "text": "\n".join(lines)})
+        if by_report:
+            out.append(company_summary(tk, rows, by_report, metrics, info))
+    return out
+
+
+def company_summary(tk: str, rows: list[dict], by_report: dict, metrics: dict, info: dict) -> dict:
+    from derived_metrics import format_value
+    latest_report = max(by_report, key=lambda r: (by_report[r][0]["end"], r))
+    ends = sorted(r["end"] for r in rows)
+    lines = [f"Company summary: {heading(tk, info)}",
+             f"{len(by_report)} reports, periods {ends[0]:%Y-%m-%d} to {ends[-1]:%Y-%m-%d}; "
+             f"latest report {latest_report}"]
+    quarters = [r for r in rows if r["span"] == "Q"]
+    years = [r for r in rows if r["span"] == "FY"]
+    for rs in (quarters, years):
+        if rs:
+            r = rs[-1]
+            lines.append(period_line(r, metrics.get((tk, f"{r['end']:%Y-%m-%d}", r["span"]), {}), latest=True))
+    growth = [metrics[(tk, f"{r['end']:%Y-%m-%d}", "Q")]["revenue_yoy"] for r in quarters
+              if "revenue_yoy" in metrics.get((tk, f"{r['end']:%Y-%m-%d}", "Q"), {})]
+    growth = growth[-SUMMARY_TREND_QUARTERS:]
+    if growth:
+        lines.append(f"Quarterly revenue growth YoY (last {len(growth)}, oldest first): "
+                     + ", ".join(format_value("revenue_yoy", g) for g in growth)
+                     + f"; average {format_value('revenue_yoy', sum(growth) / len(growth))}")
+    return {"level": "company", "ticker": tk, "report": None, "collection": None,
+            "period_end": f"{ends[-1]:%Y-%m-%d}", "text": "\n".join(lines)}
+
+
+def point_id(entry: dict) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"summary_{entry['ticker']}_{entry['report'] or ''}"))
+
+
+# 摘要寫入 Qdrant；內容未變的不再 embed。回傳 (摘要數, 寫入數)
+def upsert(entries: list[dict], reset: bool = False, profile: str = None) -> tuple[int, int]:
+    from qdrant_client.http.models import PointStruct, PayloadSchemaType
+    import pipeline
+    client = pipeline.get_qdrant()
+    if reset and client.collection_exists(collection_name=SUMMARY_COLLECTION):
+        client.delete_collection(collection_name=SUMMARY_COLLECTION)
+    for e in entries:
+        e["content_hash"] = hashlib.sha1(e["text"].encode('utf-8')).hexdigest()
+    ids = [point_id(e) for e in entries]
+    existing = set()
+    if client.collection_exists(collection_name=SUMMARY_COLLECTION):
+        with span("qdrant.retrieve"):
+            existing = {f"{p.id}:{(p.payload or {}).get('content_hash')}" for p in client.retrieve(
+                collection_name=SUMMARY_COLLECTION, ids=ids,
+                with_payload=["content_hash"], with_vectors=False)}
+    todo = [i for i, (pid, e) in enumerate(zip(ids, entries)) if f"{pid}:{e['content_hash']}" not in existing]
+    if not todo:
+        return len(entries), 0
+    vectors = pipeline.embed([entries[i]["text"] for i in todo])
+    pipeline.ensure_collection(SUMMARY_COLLECTION, len(vectors[0]), profile=profile)
+    for field in ("level", "ticker", "collection"):
+        client.create_payload_index(collection_name=SUMMARY_COLLECTION, field_name=field,
+                                    field_schema=PayloadSchemaType.KEYWORD)
+    points = [PointStruct(id=ids[i], vector=vec, payload=entries[i]) for i, vec in zip(todo, vectors)]
+    with span("qdrant.upsert") as sp:
+        for start in range(0, len(points), 256):
+            client.upsert(collection_name=SUMMARY_COLLECTION, points=points[start:start + 256])
+        sp.set(collection=SUMMARY_COLLECTION, points=len(points))
+    inc("qdrant_points_upserted_total", len(points))
+    return len(entries), len(points)
+
+
+def main(tickers: list[str] = None, reset: bool = False, profile: str = None):
+    import psycopg2
+    import pipeline
+    tickers = [t.lower() for t in (tickers or pipeline.list_ticker_tables())]
+    conn = psycopg2.connect(**pipeline.DB_PARAMS)
+    try:
+        with conn.cursor() as cur:
+            entries = build_summaries(cur, tickers)
+    finally:
+        conn.close()
+    if not entries:
+        print("[INFO] 沒有可摘要的資料（需 FACT_DEDUP 寫入的 xbrl.fact）")
+        return 0, 0
+    total, written = upsert(entries, reset=reset, profile=profile)
+    print(f"[INFO] 摘要：{len(tickers)} 支 ticker，{total} 筆（報告 + 公司），新增 / 更新 {written} 筆 → {SUMMARY_COLLECTION}")
+    return total, written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="產生報告 / 公司摘要並寫入 Qdrant 摘要層")
+    parser.add_argument("--all", action="store_true", help="所有 ticker（預設）")
+    parser.add_argument("--reset", action="store_true", help="刪除並重建摘要 collection")
+    parser.add_argument("tickers", nargs="*")
+    args = parser.parse_args()
+    main(args.tickers or None, args.reset)